@@ -8,7 +8,6 @@
 
 import argparse
 import logging
-import logging.handlers
 import sys
 
 from . import __version__, GUESS_PREFIX
@@ -20,6 +19,7 @@ def setup_logging(debug=False, syslog=False):
     params = {}
     params['level'] = logging.DEBUG if debug else logging.INFO
     if syslog:
+        import logging.handlers
         params['format'] = '%(levelname)-5s: %(message)s'
         if sys.platform == 'linux':
             address = '/dev/log'
@@ -63,6 +63,11 @@ if __name__ == '__main__':
     argparser.add_argument('-m', '--match', dest='match',
                            default=GUESS_PREFIX, help='match serial device with '
                            'this string')
+    argparser.add_argument('--machine', dest='machines', action='append',
+                           default=[], metavar='NAME=PORT',
+                           help='also drive the machine NAME on serial port '
+                           'PORT, its routes are under /machine/NAME/ (can be '
+                           'given more than once)')
     argparser.add_argument('-s', '--syslog', dest='syslog', action='store_true',
                            default=False, help='send log messages to Syslog '
                            'service')
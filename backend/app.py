@@ -1,28 +1,38 @@
 import copy
 import glob
+import gzip
+import itertools
 import json
 import logging
+import mmap
 import os
+import re
+import select
+import shutil
 import sys
 import tempfile
 import time
-import webbrowser
 
+import serial
 from bottle import *
-from wsgiref.simple_server import WSGIRequestHandler, make_server
+from wsgiref.simple_server import (ServerHandler, WSGIRequestHandler,
+                                   make_server)
 
 from . import __version__, GUESS_PREFIX
-from .serial_manager import get_serial_manager
-from .flash import flash_upload, reset_atmega
-from .build import build_firmware
-from .filereaders import read_svg, read_dxf, read_ngc
+from .serial_manager import (get_serial_manager, find_serial_manager,
+                             serial_managers, send_queues_as_ready,
+                             clean_gcode_line, gcode_line_error,
+                             DEFAULT_MACHINE, STOP_REASONS)
+from .assets import AssetCache
+from .checkpoint import Journal
+from .discovery import PortCache
+from .uploads import UploadError, read_upload, text_lines
 
 log = logging.getLogger(__name__)
 
 APPNAME = "lasaurapp"
 VERSION = __version__
 COMPANY_NAME = "com.nortd.labs"
-SERIAL_PORT = None
 BITSPERSECOND = 57600
 NETWORK_PORT = 4444
 HARDWARE = 'x86'  # also: 'beaglebone', 'raspberrypi'
@@ -30,6 +40,18 @@ CONFIG_FILE = "lasaurapp.conf"
 COOKIE_KEY = 'secret_key_jkn23489hsdf'
 FIRMWARE = "LasaurGrbl.hex"
 TOLERANCE = 0.08
+JOB_STATS = {}
+JOB_MIMETYPE = 'application/x-lasaur-job'
+STATS_CACHES = {}
+ASSET_CACHE = None
+ASSET_MAX_AGE = 365*24*3600
+JOURNAL_FILE = '.journal.json'
+PORT_CACHE_FILE = '.ports.json'
+MAX_UPLOAD_SIZE = 128*1024*1024
+PREVIEW_VERTICES = 100000
+PREVIEW_MAX_AGE = 24*3600
+re_match_machine_name = re.compile(r'[A-Za-z0-9_-]+$').match
+re_match_preview_token = re.compile(r'[0-9a-f]+$').match
 
 
 def resources_dir():
@@ -69,6 +91,74 @@ def storage_dir():
     return directory
 
 
+def journal_file(machine):
+    """Checkpoint journal of a machine, see `checkpoint.Journal`."""
+    if machine == DEFAULT_MACHINE:
+        return os.path.join(storage_dir(), JOURNAL_FILE)
+    return os.path.join(storage_dir(), '.journal-%s.json' % machine)
+
+
+def machine_serial_manager():
+    """The `SerialManager` of the machine the request is namespaced by, see
+    `MachineDispatcher`, or of the default machine. Unknown machines are a
+    404."""
+    machine = request.environ.get('lasaurapp.machine')
+    if machine is None:
+        return get_serial_manager()
+    serial_manager = find_serial_manager(machine)
+    if serial_manager is None:
+        abort(404, "No such machine: %s" % machine)
+    return serial_manager
+
+
+def stats_cache(kind):
+    """Stats cache of the 'queue' or the 'library' jobs."""
+    from .catalog import get_catalog
+    from .jobstats import StatsCache
+    if kind not in STATS_CACHES:
+        catalog = None
+        if kind == 'queue':
+            job_dir = storage_dir()
+            catalog = get_catalog(job_dir)
+        else:
+            job_dir = os.path.join(resources_dir(), 'library')
+        STATS_CACHES[kind] = StatsCache(
+            job_dir, os.path.join(storage_dir(), '.stats', kind), catalog)
+    return STATS_CACHES[kind]
+
+
+def asset_cache():
+    """Cache of the files of the frontend, see `assets.AssetCache`."""
+    global ASSET_CACHE
+    if ASSET_CACHE is None:
+        ASSET_CACHE = AssetCache(os.path.join(resources_dir(), 'frontend'))
+    return ASSET_CACHE
+
+
+class MachineDispatcher:
+    """Serve the routes of the machine <name> under ``/machine/<name>/``.
+
+    The prefix is moved to ``SCRIPT_NAME`` and the name noted in the
+    environment for `machine_serial_manager`, so routes are registered once
+    instead of once per prefix: bottle compiles its route table again for
+    every dynamic route added.
+    """
+    PREFIX = '/machine/'
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.PREFIX):
+            name, slash, rest = path[len(self.PREFIX):].partition('/')
+            environ['lasaurapp.machine'] = name
+            environ['SCRIPT_NAME'] = (environ.get('SCRIPT_NAME', '') +
+                                      self.PREFIX + name)
+            environ['PATH_INFO'] = slash + rest
+        return self.app(environ, start_response)
+
+
 class HackedWSGIRequestHandler(WSGIRequestHandler):
     """ This is a heck to solve super slow request handling
     on the BeagleBone and RaspberryPi. The problem is WSGIRequestHandler
@@ -86,12 +176,85 @@ class HackedWSGIRequestHandler(WSGIRequestHandler):
         pass
 
 
+    def handle(self):
+        """As `WSGIRequestHandler.handle`, with a `SendfileServerHandler`
+        servicing the serial lines while files are sent."""
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = SendfileServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=False, idle=send_queues_as_ready)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class SendfileServerHandler(ServerHandler):
+    """Sends the files returned through ``wsgi.file_wrapper`` from the
+    kernel with ``os.sendfile``, in non-blocking steps.
+
+    The server has a single thread, so idle is called between the steps
+    and while the client is not ready for more, to keep the serial lines
+    serviced during long downloads.
+    """
+
+    SENDFILE_BLOCK_SIZE = 262144
+
+    def __init__(self, *args, **kw):
+        self.idle = kw.pop('idle', None)
+        ServerHandler.__init__(self, *args, **kw)
+
+
+    def sendfile(self):
+        if not hasattr(os, 'sendfile'):
+            return False
+        filelike = self.result.filelike
+        try:
+            in_fd = filelike.fileno()
+        except (AttributeError, OSError, ValueError):
+            return False
+        offset = getattr(filelike, 'offset', 0)
+        remaining = getattr(filelike, 'length', None)
+        if remaining is None:
+            remaining = os.fstat(in_fd).st_size - offset
+        connection = self.request_handler.connection
+        if not self.headers_sent:
+            self.send_headers()
+        connection.setblocking(False)
+        try:
+            while remaining > 0:
+                try:
+                    sent = os.sendfile(connection.fileno(), in_fd, offset,
+                                       min(remaining, self.SENDFILE_BLOCK_SIZE))
+                    if sent == 0:
+                        break  # the file got shorter
+                    offset += sent
+                    remaining -= sent
+                    self.bytes_sent += sent
+                except BlockingIOError:
+                    sent = 0
+                if self.idle is not None:
+                    self.idle()
+                if not sent:
+                    select.select([], [connection], [], 0.001)
+        finally:
+            connection.setblocking(True)
+        return True
+
+
 def run_with_callback(host, port):
     """ Start a wsgiref server instance with control over the main loop.
         This is a function that I derived from the bottle.py run()
     """
-    serial_manager = get_serial_manager()
-    handler = default_app()
+    for serial_manager in serial_managers():
+        serial_manager.journal = Journal(journal_file(serial_manager.name))
+    handler = MachineDispatcher(default_app())
     server = make_server(host, port, handler, handler_class=HackedWSGIRequestHandler)
     server.timeout = 0.01
     server.quiet = True
@@ -105,15 +268,24 @@ def run_with_callback(host, port):
     log.info(msg)
     print("Point your browser to: ")
     print("http://%s:%d/      (local)" % ('127.0.0.1', port))
+    for serial_manager in serial_managers()[1:]:
+        print("http://%s:%d/machine/%s/      (machine on %s)" % (
+            '127.0.0.1', port, serial_manager.name, serial_manager.port))
     print("Use Ctrl-C to quit.")
     print("-" * 77)
     print()
     # auto-connect on startup
-    global SERIAL_PORT
-    if not SERIAL_PORT:
-        SERIAL_PORT = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
-    serial_manager.connect(SERIAL_PORT, BITSPERSECOND)
+    for serial_manager in serial_managers():
+        if not serial_manager.port:
+            serial_manager.port = serial_manager.match_device(GUESS_PREFIX,
+                                                              BITSPERSECOND)
+        try:
+            serial_manager.connect(serial_manager.port, BITSPERSECOND)
+        except serial.SerialException:
+            log.exception("Failed to connect machine %s to serial.",
+                          serial_manager.name)
     # open web-browser
+    import webbrowser
     try:
         webbrowser.open_new_tab('http://127.0.0.1:%s' % port)
         pass
@@ -123,14 +295,15 @@ def run_with_callback(host, port):
     server.timeout = 0
     while 1:
         try:
-            serial_manager.send_queue_as_ready()
+            send_queues_as_ready()
             server.handle_request()
             time.sleep(0.0004)
         except KeyboardInterrupt:
             break
     print("\nShutting down...")
     log.info("Shutting down...")
-    serial_manager.close()
+    for serial_manager in serial_managers():
+        serial_manager.close()
 
 
 
@@ -144,30 +317,194 @@ def run_with_callback(host, port):
 
 
 
+def serve_asset(path):
+    """Serve a file of the frontend from memory, compressed if the client
+    accepts it.
+
+    Requested with the current version, as referenced by the pages, it can
+    be cached for good, otherwise it has to be revalidated with its ETag.
+    """
+    asset = asset_cache().get(path)
+    if asset is None:
+        return HTTPError(404, "File does not exist.")
+    encoding, data, etag = asset.representation(
+        request.environ.get('HTTP_ACCEPT_ENCODING', ''))
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+    if request.query.get('v') == asset.etag:
+        headers['Cache-Control'] = 'public, max-age=%d, immutable' % ASSET_MAX_AGE
+    else:
+        headers['Cache-Control'] = 'no-cache'
+    if asset.matches(request.environ.get('HTTP_IF_NONE_MATCH', '')):
+        return HTTPResponse(status=304, **headers)
+    if asset.mimetype:
+        headers['Content-Type'] = asset.mimetype
+        if asset.mimetype.startswith('text/'):
+            headers['Content-Type'] += '; charset=UTF-8'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(len(data))
+    return HTTPResponse(data, **headers)
+
+
 @route('/css/:path#.+#')
 def static_css_handler(path):
-    return static_file(path, root=os.path.join(resources_dir(), 'frontend/css'))
+    return serve_asset('css/' + path)
 
 @route('/js/:path#.+#')
 def static_js_handler(path):
-    return static_file(path, root=os.path.join(resources_dir(), 'frontend/js'))
+    return serve_asset('js/' + path)
 
 @route('/img/:path#.+#')
 def static_img_handler(path):
-    return static_file(path, root=os.path.join(resources_dir(), 'frontend/img'))
+    return serve_asset('img/' + path)
 
 @route('/favicon.ico')
 def favicon_handler():
-    return static_file('favicon.ico', root=os.path.join(resources_dir(),
-                                                        'frontend/img'))
+    return serve_asset('img/favicon.ico')
 
 
 ### LIBRARY
 
+class FileRange:
+    """The length bytes of the open file fp from offset on, as a file for
+    ``wsgi.file_wrapper``, see `SendfileServerHandler`."""
+
+    def __init__(self, fp, offset, length):
+        self.fp = fp
+        self.offset = offset
+        self.length = length
+        self.remaining = length
+        fp.seek(offset)
+
+
+    def fileno(self):
+        return self.fp.fileno()
+
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+    def close(self):
+        self.fp.close()
+
+
+def file_etag(stats):
+    """The ETag of a file with stats, from its modification time and
+    size."""
+    return '"%x-%x"' % (int(stats.st_mtime * 1000000), stats.st_size)
+
+
+def not_modified(etag, mtime):
+    """Tell if the conditional headers of the request match a file with
+    etag, modified at mtime."""
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return any(tag.strip() in (etag, 'W/' + etag, '*')
+                   for tag in if_none_match.split(','))
+    if_modified_since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        since = parse_date(if_modified_since.split(';')[0].strip())
+        return since is not None and since >= int(mtime)
+    return False
+
+
+def serve_file(filename, mimetype='application/octet-stream', download=None):
+    """Serve a file, with support for a byte range and conditional requests.
+
+    The file is handed to the server as is, which sends it with
+    ``os.sendfile``, see `SendfileServerHandler`.
+    """
+    try:
+        fp = open(filename, 'rb')
+    except (IOError, OSError):
+        return HTTPError(404, "File does not exist.")
+    stats = os.fstat(fp.fileno())
+    size = stats.st_size
+    etag = file_etag(stats)
+    last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                                  time.gmtime(stats.st_mtime))
+    headers = {'Content-Type': mimetype,
+               'Accept-Ranges': 'bytes',
+               'ETag': etag,
+               'Last-Modified': last_modified}
+    if download:
+        headers['Content-Disposition'] = 'attachment; filename="%s"' % download
+    if not_modified(etag, stats.st_mtime):
+        fp.close()
+        return HTTPResponse(status=304, **headers)
+    start, end, status = 0, size, 200
+    if_range = request.environ.get('HTTP_IF_RANGE')
+    if ('HTTP_RANGE' in request.environ and
+            (if_range is None or if_range in (etag, last_modified))):
+        ranges = list(parse_range_header(request.environ['HTTP_RANGE'], size))
+        if not ranges:
+            fp.close()
+            error = HTTPError(416, "Requested Range Not Satisfiable")
+            error.set_header('Content-Range', "bytes */%d" % size)
+            return error
+        start, end = ranges[0]
+        headers['Content-Range'] = "bytes %d-%d/%d" % (start, end - 1, size)
+        status = 206
+    headers['Content-Length'] = str(end - start)
+    return HTTPResponse(FileRange(fp, start, end - start), status, **headers)
+
+
+def serve_job(root, name):
+    """Serve a stored job.
+
+    Jobs are sent in the ``.lsa`` JSON format, or in the binary format of
+    `jobfile` when asked for with ``?format=binary``, converting as needed.
+    Job files stored in the format asked for are sent as they are, see
+    `serve_file`. Either way the ETag is that of the stored file, which
+    is how `job_run_handler` tells if the job changed since.
+    """
+    from . import jobfile
+    filename = os.path.abspath(os.path.join(root, name))
+    if (not filename.startswith(os.path.abspath(root) + os.sep) or
+            not os.path.isfile(filename)):
+        return HTTPError(404, "File does not exist.")
+    binary = request.query.get('format') == 'binary'
+    with open(filename, 'rb') as fp:
+        stored_binary = jobfile.is_job(fp.read(4))
+        response.set_header('ETag', file_etag(os.fstat(fp.fileno())))
+    if stored_binary and binary:
+        return serve_file(filename, JOB_MIMETYPE)
+    elif stored_binary:
+        with open(filename, 'rb') as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                response.content_type = 'text/plain'
+                return jobfile.to_lsa(data)
+    elif binary:
+        with open(filename) as fp:
+            response.content_type = JOB_MIMETYPE
+            return jobfile.from_lsa(fp.read())
+    return serve_file(filename, 'text/plain; charset=UTF-8')
+
+
 @route('/library/get/:path#.+#')
 def static_library_handler(path):
-    return static_file(path, root=os.path.join(resources_dir(), 'library'),
-                       mimetype='text/plain')
+    return serve_job(os.path.join(resources_dir(), 'library'), path)
+
+@route('/library/stats/:path#.+#')
+def library_stats_handler(path):
+    try:
+        return json.dumps(stats_cache('library').stats(os.path.basename(path)))
+    except IOError:
+        return HTTPError(404, "File does not exist.")
+
+@route('/library/thumbnail/:path#.+#')
+def library_thumbnail_handler(path):
+    try:
+        filename = stats_cache('library').thumbnail(os.path.basename(path))
+    except IOError:
+        return HTTPError(404, "File does not exist.")
+    return static_file(os.path.basename(filename),
+                       root=os.path.dirname(filename), mimetype='image/png')
 
 @route('/library/list')
 def library_list_handler():
@@ -194,98 +531,181 @@ def decode_filename(name):
 
 @route('/queue/get/:name#.+#')
 def static_queue_handler(name):
-    return static_file(name, root=storage_dir(), mimetype='text/plain')
+    return serve_job(storage_dir(), name)
 
 @route('/queue/list')
-def library_list_handler():
-    # base64.urlsafe_b64encode()
-    # base64.urlsafe_b64decode()
-    # return a json list of file names
-    files = []
-    cwd_temp = os.getcwd()
+def queue_list_handler():
+    # return a json list of file names, oldest first
+    # optionally paginated with offset and limit
+    from .catalog import get_catalog
     try:
-        os.chdir(storage_dir())
-        files = list(filter(os.path.isfile, glob.glob("*")))
-        files.sort(key=lambda x: os.path.getmtime(x))
-    finally:
-        os.chdir(cwd_temp)
-    return json.dumps(files)
+        offset = int(request.query.get('offset') or 0)
+        limit = int(request.query.get('limit') or -1)
+    except ValueError:
+        return HTTPError(400, "Invalid offset or limit.")
+    return json.dumps(get_catalog(storage_dir()).list(offset, limit))
 
 @route('/queue/save', method='POST')
 def queue_save_handler():
+    """Store a job in the queue.
+
+    The job, in the ``.lsa`` JSON or the binary format of `jobfile`, is
+    the raw request body, with 'job_name' in the query string, or the
+    'job_data' field of a form. It's streamed to disk as it's uploaded.
+
+    A job made of the preview of an import is stored at full resolution
+    with the token of the import as 'preview', see `job_from_preview`.
+
+    The stats and the thumbnail of the job are computed right away, so
+    listing the queue never has to load a job, see `stats_cache`.
+    """
+    from . import jobfile
+    from .catalog import get_catalog
     ret = '0'
-    if 'job_name' in request.forms and 'job_data' in request.forms:
-        name = request.forms.get('job_name')
-        job_data = request.forms.get('job_data')
-        filename = os.path.abspath(os.path.join(storage_dir(), name.strip('/\\')))
-        if os.path.exists(filename) or os.path.exists(filename+'.starred'):
+    try:
+        params, job_data = read_upload_request('job_data')
+    except UploadError as e:
+        return HTTPError(e.status, str(e))
+    if params.get('job_name') and job_data:
+        name = params.get('job_name').strip('/\\')
+        catalog = get_catalog(storage_dir())
+        filename = os.path.abspath(catalog.filename(name))
+        if not filename.startswith(storage_dir()):
+            return ret
+        if catalog.get(name) is not None:
             return "file_exists"
         try:
-            fp = open(filename, 'w')
-            fp.write(job_data)
-            log.info("File saved: %s", filename)
-            ret = '1'
-        finally:
-            fp.close()
+            if isinstance(job_data, str):
+                data = jobfile.from_lsa(job_data)
+                with open(filename, 'wb') as fp:
+                    fp.write(data)
+            else:
+                receive_job(job_data, filename)
+        except ValueError as e:
+            # an UploadError or a malformed job
+            return HTTPError(getattr(e, 'status', 400), str(e))
+        if params.get('preview'):
+            try:
+                with open(filename, 'rb') as fp:
+                    data = job_from_preview(params.get('preview'), fp.read())
+            except IOError:
+                os.remove(filename)
+                return "preview_expired"
+            with open(filename, 'wb') as fp:
+                fp.write(data)
+        try:
+            stats = stats_cache('queue').update(name)
+        except ValueError as e:
+            os.remove(filename)
+            return HTTPError(400, "Invalid job: %s" % e)
+        response.set_header('ETag', file_etag(os.stat(filename)))
+        catalog.add(name, stats=stats)
+        log.info("File saved: %s", filename)
+        ret = '1'
     else:
         log.error("Save failed, invalid POST request")
     return ret
 
+
+def receive_job(stream, filename):
+    """Store a job uploaded as stream in filename, in the binary format.
+
+    The upload is spooled to disk as it arrives and moved in place, only
+    a ``.lsa`` JSON job is read back to be converted.
+    """
+    from . import jobfile
+    spool = tempfile.NamedTemporaryFile(dir=storage_dir(), prefix='.upload-',
+                                        delete=False)
+    try:
+        with spool:
+            shutil.copyfileobj(stream, spool)
+            spool.seek(0)
+            binary = jobfile.is_job(spool.read(4))
+            if not binary:
+                spool.seek(0)
+                data = jobfile.from_lsa(spool.read().decode('utf-8'))
+        if binary:
+            os.replace(spool.name, filename)
+        else:
+            with open(filename, 'wb') as fp:
+                fp.write(data)
+    finally:
+        if os.path.exists(spool.name):
+            os.remove(spool.name)
+
 @route('/queue/rm/:name')
 def queue_rm_handler(name):
     # delete queue item, on success return '1'
+    from .catalog import get_catalog, STARRED_SUFFIX
     ret = '0'
     filename = os.path.abspath(os.path.join(storage_dir(), name.strip('/\\')))
     if filename.startswith(storage_dir()):
         if os.path.exists(filename):
-            try:
-                os.remove(filename);
-                log.info("File deleted: %s", filename)
-                ret = '1'
-            finally:
-                pass
+            os.remove(filename)
+            name = os.path.basename(filename)
+            if name.endswith(STARRED_SUFFIX):
+                name = name[:-len(STARRED_SUFFIX)]
+            get_catalog(storage_dir()).remove(name)
+            stats_cache('queue').remove(name)
+            log.info("File deleted: %s", filename)
+            ret = '1'
     return ret
 
 @route('/queue/clear')
 def queue_clear_handler():
     # delete all queue items, on success return '1'
+    from .catalog import get_catalog
     ret = '0'
-    files = []
-    cwd_temp = os.getcwd()
-    try:
-        os.chdir(storage_dir())
-        files = list(filter(os.path.isfile, glob.glob("*")))
-        files.sort(key=lambda x: os.path.getmtime(x))
-    finally:
-        os.chdir(cwd_temp)
-    for filename in files:
-        if not filename.endswith('.starred'):
-            filename = os.path.join(storage_dir(), filename)
-            try:
-                os.remove(filename);
-                log.info("File deleted: %s", filename)
-                ret = '1'
-            finally:
-                pass
+    catalog = get_catalog(storage_dir())
+    for name in catalog.list(starred=False):
+        filename = catalog.filename(name)
+        if os.path.exists(filename):
+            os.remove(filename)
+            log.info("File deleted: %s", filename)
+            ret = '1'
+        catalog.remove(name)
+        stats_cache('queue').remove(name)
     return ret
 
+@route('/queue/stats/:name')
+def queue_stats_handler(name):
+    try:
+        return json.dumps(stats_cache('queue').stats(os.path.basename(name)))
+    except IOError:
+        return HTTPError(404, "File does not exist.")
+
+@route('/queue/thumbnail/:name')
+def queue_thumbnail_handler(name):
+    try:
+        filename = stats_cache('queue').thumbnail(os.path.basename(name))
+    except IOError:
+        return HTTPError(404, "File does not exist.")
+    return static_file(os.path.basename(filename),
+                       root=os.path.dirname(filename), mimetype='image/png')
+
 @route('/queue/star/:name')
 def queue_star_handler(name):
+    from .catalog import get_catalog, STARRED_SUFFIX
     ret = '0'
     filename = os.path.abspath(os.path.join(storage_dir(), name.strip('/\\')))
     if filename.startswith(storage_dir()):
         if os.path.exists(filename):
-            os.rename(filename, filename + '.starred')
+            os.rename(filename, filename + STARRED_SUFFIX)
+            get_catalog(storage_dir()).set_starred(os.path.basename(filename),
+                                                   True)
             ret = '1'
     return ret
 
 @route('/queue/unstar/:name')
 def queue_unstar_handler(name):
+    from .catalog import get_catalog, STARRED_SUFFIX
     ret = '0'
     filename = os.path.abspath(os.path.join(storage_dir(), name.strip('/\\')))
     if filename.startswith(storage_dir()):
-        if os.path.exists(filename + '.starred'):
-            os.rename(filename + '.starred', filename)
+        if os.path.exists(filename + STARRED_SUFFIX):
+            os.rename(filename + STARRED_SUFFIX, filename)
+            get_catalog(storage_dir()).set_starred(os.path.basename(filename),
+                                                   False)
             ret = '1'
     return ret
 
@@ -296,7 +716,8 @@ def queue_unstar_handler(name):
 @route('/index.html')
 @route('/app.html')
 def default_handler():
-    return static_file('app.html', root=os.path.join(resources_dir(), 'frontend') )
+    machine_serial_manager()
+    return serve_asset('app.html')
 
 
 @route('/stash_download', method='POST')
@@ -314,29 +735,38 @@ def stash_download():
 @route('/download/:filename/:dlname')
 def download(filename, dlname):
     log.info("Return requested file: %s", filename)
-    return static_file(filename, root=tempfile.gettempdir(), download=dlname)
+    return serve_file(os.path.join(tempfile.gettempdir(),
+                                   os.path.basename(filename)),
+                      download=dlname)
+
+
+@route('/machines')
+def machines_handler():
+    """Names, serial devices and connection state of the machines, the
+    default one first."""
+    return json.dumps([{'name': serial_manager.name,
+                        'port': serial_manager.port,
+                        'serial_connected': serial_manager.is_connected()}
+                       for serial_manager in serial_managers()])
 
 
 @route('/serial/:connect')
 def serial_handler(connect):
-    serial_manager = get_serial_manager()
+    serial_manager = machine_serial_manager()
     if connect == '1':
         log.debug('Client is asking to connect serial')
         if not serial_manager.is_connected():
             try:
-                global SERIAL_PORT, BITSPERSECOND, GUESS_PREFIX
-                if not SERIAL_PORT:
-                    SERIAL_PORT = serial_manager.match_device(GUESS_PREFIX,
-                                                              BITSPERSECOND)
-                serial_manager.connect(SERIAL_PORT, BITSPERSECOND)
-                ret = "Serial connected to %s:%d.<br>" % (SERIAL_PORT,
+                if not serial_manager.port:
+                    serial_manager.port = serial_manager.match_device(
+                        GUESS_PREFIX, BITSPERSECOND)
+                serial_manager.connect(serial_manager.port, BITSPERSECOND)
+                ret = "Serial connected to %s:%d.<br>" % (serial_manager.port,
                                                           BITSPERSECOND)
-                time.sleep(1.0) # allow some time to receive a prompt/welcome
-                serial_manager.flush_input()
-                serial_manager.flush_output()
+                serial_manager.handshake()
                 return ret
             except serial.SerialException:
-                SERIAL_PORT = None
+                serial_manager.port = None
                 log.exception("Failed to connect to serial.")
                 return ""
     elif connect == '0':
@@ -356,17 +786,24 @@ def serial_handler(connect):
 
 @route('/status')
 def get_status():
-    serial_manager = get_serial_manager()
+    serial_manager = machine_serial_manager()
     status = copy.deepcopy(serial_manager.get_hardware_status())
+    status['machine'] = serial_manager.name
     status['serial_connected'] = serial_manager.is_connected()
+    status['reconnecting'] = serial_manager.is_reconnecting()
     status['lasaurapp_version'] = VERSION
+    checkpoint = serial_manager.journal and serial_manager.journal.load()
+    if checkpoint and checkpoint['reason']:
+        status['resume_line'] = checkpoint['line']
+    else:
+        status['resume_line'] = None
     return json.dumps(status)
 
 
 @route('/pause/:flag')
 def set_pause(flag):
     """Returns pause status."""
-    serial_manager = get_serial_manager()
+    serial_manager = machine_serial_manager()
     if flag == '1':
         if serial_manager.set_pause(True):
             log.info("Pausing ...")
@@ -385,8 +822,8 @@ def set_pause(flag):
 @route('/flash_firmware')
 @route('/flash_firmware/:firmware_file')
 def flash_firmware_handler(firmware_file=FIRMWARE):
-    global SERIAL_PORT, GUESS_PREFIX
-    serial_manager = get_serial_manager()
+    from .flash import flash_upload
+    serial_manager = machine_serial_manager()
     return_code = 1
     if serial_manager.is_connected():
         serial_manager.close()
@@ -395,14 +832,14 @@ def flash_firmware_handler(firmware_file=FIRMWARE):
     if 'port' in list(request.GET.keys()):
         serial_port = request.GET['port']
         if serial_port[:3] == "COM" or serial_port[:4] == "tty.":
-            SERIAL_PORT = serial_port
+            serial_manager.port = serial_port
     # get serial port by enumeration method
     # currenty this works on windows only for updating the firmware
-    if not SERIAL_PORT:
-        SERIAL_PORT = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
+    if not serial_manager.port:
+        serial_manager.port = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
     # resort to brute force methode
     # find available com ports and try them all
-    if not SERIAL_PORT:
+    if not serial_manager.port:
         comport_list = serial_manager.list_devices(BITSPERSECOND)
         for port in comport_list:
             print("Trying com port: %s" % port)
@@ -410,13 +847,13 @@ def flash_firmware_handler(firmware_file=FIRMWARE):
                                        HARDWARE)
             if return_code == 0:
                 print("Success with com port: %s" % port)
-                SERIAL_PORT = port
+                serial_manager.port = port
                 break
     else:
-        return_code = flash_upload(SERIAL_PORT, resources_dir(), firmware_file,
+        return_code = flash_upload(serial_manager.port, resources_dir(), firmware_file,
                                    HARDWARE)
     ret = []
-    ret.append('Using com port: %s<br>' % (SERIAL_PORT))
+    ret.append('Using com port: %s<br>' % (serial_manager.port))
     ret.append('Using firmware: %s<br>' % (firmware_file))
     if return_code == 0:
         print("SUCCESS: Arduino appears to be flashed.")
@@ -441,6 +878,7 @@ def flash_firmware_handler(firmware_file=FIRMWARE):
 
 @route('/build_firmware')
 def build_firmware_handler():
+    from .build import build_firmware
     ret = []
     buildname = "LasaurGrbl_from_src"
     firmware_dir = os.path.join(resources_dir(), 'firmware')
@@ -460,13 +898,14 @@ def build_firmware_handler():
 
 @route('/reset_atmega')
 def reset_atmega_handler():
+    from .flash import reset_atmega
     reset_atmega(HARDWARE)
     return '1'
 
 
 @route('/gcode', method='POST')
 def job_submit_handler():
-    serial_manager = get_serial_manager()
+    serial_manager = machine_serial_manager()
     job_data = request.forms.get('job_data')
     if job_data and serial_manager.is_connected():
         serial_manager.queue_gcode(job_data)
@@ -475,18 +914,312 @@ def job_submit_handler():
         return "serial disconnected"
 
 
+@route('/gcode/upload', method='POST')
+def job_upload_handler():
+    """Stream an uploaded G-code file to the machine.
+
+    The file is either the raw request body or a 'job_file' form field,
+    read as it arrives, see `read_upload_request`. Lines are validated
+    and cleaned while being copied to a spool file, which is then queued
+    line by line as the serial buffer drains.
+    """
+    serial_manager = machine_serial_manager()
+    if not serial_manager.is_connected():
+        return "serial disconnected"
+    try:
+        params, infile = read_upload_request('job_file')
+    except UploadError as e:
+        return HTTPError(e.status, str(e))
+    if not hasattr(infile, 'read'):
+        return HTTPError(400, "G-code file missing.")
+    # kept until the job is done, so it can be resumed
+    spool = tempfile.NamedTemporaryFile(dir=storage_dir(), prefix='.upload-',
+                                        suffix='.ngc', delete=False)
+    size = 0
+    try:
+        for lineno, line in enumerate(infile, 1):
+            cleaned = clean_gcode_line(line)
+            if cleaned is None:
+                raise UploadError("invalid G-code in line %d: %s"
+                                  % (lineno, gcode_line_error(line)))
+            line = cleaned
+            if line:
+                spool.write(line + b'\n')
+                size += len(line) + 1
+    except UploadError as e:
+        spool.close()
+        os.remove(spool.name)
+        response.status = e.status
+        return str(e)
+    spool.seek(0)
+    log.info("Streaming uploaded G-code job, %d bytes", size)
+    serial_manager.journal.start({'type': 'upload', 'spool': spool.name,
+                                  'size': size})
+    serial_manager.queue_gcode_source(spool, size, resumable=True)
+    return "__ok__"
+
+
+def find_job(name):
+    """Returns the file name of a job in the queue or the library, or None."""
+    name = os.path.basename(name)
+    candidates = [os.path.join(storage_dir(), name),
+                  os.path.join(storage_dir(), name + '.starred'),
+                  os.path.join(resources_dir(), 'library', name)]
+    for filename in candidates:
+        if name and os.path.isfile(filename):
+            return filename
+    return None
+
+
+def job_source(job):
+    """Generate the G-code of a job described in the journal again.
+
+    Returns the lines and their expected size. Raises IOError if the job
+    is gone.
+    """
+    from .gcode import load_job, iter_gcode, estimate_size
+    if job['type'] == 'upload':
+        return open(job['spool'], 'rb'), job['size']
+    filename = find_job(job['name'])
+    if filename is None:
+        raise IOError("job not found: %s" % job['name'])
+    with open(filename, 'rb') as fp:
+        passes, paths_by_color = load_job(fp.read())
+    return (iter_gcode(paths_by_color, job['passes']),
+            estimate_size(paths_by_color, job['passes']))
+
+
+@route('/gcode/job', method='POST')
+def job_run_handler():
+    """Run a job from the queue or the library.
+
+    The job is referenced by 'job_name', G-code is generated on the fly.
+    Optionally 'passes' is a JSON list of passes overriding the ones stored
+    with the job and 'job_etag' the ETag of the job the client got, to
+    catch a stale reference, see `serve_job`.
+    """
+    from .gcode import load_job, iter_gcode, estimate_size, check_passes
+    serial_manager = machine_serial_manager()
+    if not serial_manager.is_connected():
+        return "serial disconnected"
+    name = os.path.basename(request.forms.get('job_name', ''))
+    filename = find_job(name)
+    if filename is None:
+        return "job not found"
+    job_etag = request.forms.get('job_etag')
+    if job_etag and job_etag != file_etag(os.stat(filename)):
+        return "job changed"
+    with open(filename, 'rb') as fp:
+        passes, paths_by_color = load_job(fp.read())
+    try:
+        if request.forms.get('passes'):
+            passes = json.loads(request.forms.get('passes'))
+        check_passes(passes)
+    except ValueError as e:
+        response.status = 400
+        return "invalid request: %s" % e
+    log.info("Running job %s with %d passes on machine %s", name, len(passes),
+             serial_manager.name)
+    job_stats = JOB_STATS[serial_manager.name] = {'name': name}
+    serial_manager.journal.start({'type': 'job', 'name': name,
+                                  'passes': passes})
+    serial_manager.queue_gcode_source(
+        iter_gcode(paths_by_color, passes, stats=job_stats),
+        estimate_size(paths_by_color, passes), resumable=True)
+    return "__ok__"
+
+
+@route('/gcode/checkpoint')
+def job_checkpoint_handler():
+    """The journal of the last resumable job, or null."""
+    return json.dumps(machine_serial_manager().journal.load())
+
+
+@route('/gcode/resume', method='POST')
+def job_resume_handler():
+    """Resume the last job from its checkpoint or from line 'line'.
+
+    The G-code is generated again, the state of the firmware before the
+    line is restored and the head moved to where the line starts before
+    the rest of the job is streamed. The firmware is taken out of stop
+    mode first if the job stopped in it.
+    """
+    from .planner import GcodeState
+    serial_manager = machine_serial_manager()
+    if not serial_manager.is_connected():
+        return "serial disconnected"
+    checkpoint = serial_manager.journal.load()
+    if checkpoint is None:
+        return "nothing to resume"
+    try:
+        line = int(request.forms.get('line') or checkpoint['line'])
+        if line < 0:
+            raise ValueError("negative line %d" % line)
+    except ValueError as e:
+        response.status = 400
+        return "invalid request: %s" % e
+    try:
+        lines, size = job_source(checkpoint['job'])
+    except IOError:
+        return "job not found"
+    lines = iter(lines)
+    skipped = 0
+    count = 0
+    if line == checkpoint['line'] and checkpoint['state'] is not None:
+        state = GcodeState.from_dict(checkpoint['state'])
+        for skipped_line in itertools.islice(lines, line):
+            skipped += len(skipped_line.strip()) + 1
+            count += 1
+    else:
+        # rebuild the state from the lines before
+        state = GcodeState()
+        for skipped_line in itertools.islice(lines, line):
+            skipped += len(skipped_line.strip()) + 1
+            count += 1
+            try:
+                state.execute(skipped_line)
+            except ValueError:
+                pass
+    if count < line:
+        if hasattr(lines, 'close'):
+            lines.close()
+        response.status = 400
+        return "invalid request: the job has only %d lines" % count
+    prefix = state.prefix()
+    if checkpoint['reason'] in STOP_REASONS:
+        # leave the stop mode, or the firmware ignores the lines
+        prefix.insert(0, b'~')
+
+    def resumed():
+        try:
+            for prefix_line in prefix:
+                yield prefix_line
+            for job_line in lines:
+                yield job_line
+        finally:
+            if hasattr(lines, 'close'):
+                lines.close()
+
+    log.info("Resuming job from line %d", line)
+    serial_manager.journal.checkpoint({}, None)  # running again
+    size = max(0, size - skipped) + sum(len(l) + 1 for l in prefix)
+    serial_manager.queue_gcode_source(resumed(), size, resumable=True,
+                                      first_line=line - len(prefix),
+                                      prefix_lines=len(prefix))
+    return "__ok__"
+
+
+@route('/raster/engrave', method='POST')
+def raster_engrave_handler():
+    """Engrave a PNG image.
+
+    The image is the raw request body, with the other parameters in the
+    query string, an 'image_file' part of a form, after the other fields,
+    or an 'image' data URI. 'pos' and 'size' are JSON lists in mm,
+    'feedrate' and 'intensity' as in a pass, optionally 'line_spacing' in
+    mm and 'mode' one of threshold, dither or gray. The upload is spooled
+    to disk as it arrives, rows are decoded and converted while being sent.
+    """
+    from .gcode import iter_gcode, check_passes
+    from .filereaders.png_reader import PNGReader
+    serial_manager = machine_serial_manager()
+    if not serial_manager.is_connected():
+        return "serial disconnected"
+    try:
+        params, upload = read_upload_request('image_file')
+        if upload is None or isinstance(upload, str):
+            upload = None
+            image = params.get('image')
+        else:
+            image = tempfile.TemporaryFile()
+            shutil.copyfileobj(upload, image)
+            image.seek(0)
+    except UploadError as e:
+        return HTTPError(e.status, str(e))
+    try:
+        pass_ = {'colors': [],
+                 'feedrate': params.get('feedrate'),
+                 'intensity': params.get('intensity'),
+                 'raster': {'image': image,
+                            'pos': json.loads(params.get('pos')),
+                            'size': json.loads(params.get('size')),
+                            'line_spacing': float(
+                                params.get('line_spacing') or 0.1),
+                            'mode': params.get('mode') or 'dither'}}
+        check_passes([pass_])
+        # the rows are decoded while the job is sent, make sure they can be
+        PNGReader(image).check()
+        if upload:
+            image.seek(0)
+    except (TypeError, ValueError) as e:
+        response.status = 400
+        return "invalid request: %s" % e
+    log.info("Engraving image, %s mm at %s mm", pass_['raster']['size'],
+             pass_['raster']['pos'])
+    serial_manager.queue_gcode_source(iter_gcode({}, [pass_]))
+    return "__ok__"
+
+
+@route('/gcode/stats')
+def job_stats_handler():
+    """Size of the G-code generated for the last job, once it is complete."""
+    serial_manager = machine_serial_manager()
+    return json.dumps(JOB_STATS.get(serial_manager.name, {}))
+
+
 @route('/queue_pct_done')
 def queue_pct_done_handler():
-    serial_manager = get_serial_manager()
+    serial_manager = machine_serial_manager()
     return serial_manager.get_queue_percentage_done()
 
 
+@route('/queue/progress')
+def queue_progress_handler():
+    """Lines sent and acknowledged and the time estimates of the job being
+    run, or null. ``active`` tells if lines are still to be sent."""
+    serial_manager = machine_serial_manager()
+    progress = serial_manager.get_progress()
+    if progress is not None:
+        progress['active'] = not serial_manager.is_queue_empty()
+    return json.dumps(progress)
+
+
+def read_upload_request(field):
+    """Returns the parameters and the data of the file uploaded as field.
+
+    The data is a binary stream read as it arrives, see `uploads`, or a
+    string for an url-encoded form, which bottle decodes as a whole. The
+    parameters are those of the query string and the form fields sent
+    before the file. Raises `UploadError`.
+    """
+    params = dict(request.query.decode())
+    if request.content_type.startswith('application/x-www-form-urlencoded'):
+        if request.content_length > MAX_UPLOAD_SIZE:
+            raise UploadError("Upload larger than %d bytes." % MAX_UPLOAD_SIZE,
+                              413)
+        params.update(request.forms.decode())
+        return params, params.pop(field, None)
+    fields, stream = read_upload(request.environ, field, MAX_UPLOAD_SIZE)
+    params.update(fields)
+    return params, stream
+
+
 @route('/file_reader', method='POST')
 def file_reader():
-    """Parse SVG string."""
-    filename = request.forms.get('filename')
-    filedata = request.forms.get('filedata')
-    dimensions = request.forms.get('dimensions')
+    """Parse SVG, DXF or G-code.
+
+    The file is the raw request body, with the other parameters in the
+    query string, or the 'filedata' field of a form. It is parsed while
+    it's uploaded. The paths are returned as JSON, or in the binary job
+    format with 'format' binary or when accepted, see
+    `binary_reader_result`, simplified for a preview with 'preview' 1.
+    """
+    try:
+        params, filedata = read_upload_request('filedata')
+    except UploadError as e:
+        return HTTPError(e.status, str(e))
+    filename = params.get('filename')
+    dimensions = params.get('dimensions')
     try:
         dimensions = json.loads(dimensions)
     except TypeError:
@@ -495,13 +1228,13 @@ def file_reader():
 
     dpi_forced = None
     try:
-        dpi_forced = float(request.forms.get('dpi'))
+        dpi_forced = float(params.get('dpi'))
     except:
         pass
 
     optimize = True
     try:
-        optimize = bool(int(request.forms.get('optimize')))
+        optimize = bool(int(params.get('optimize')))
     except:
         pass
     log.info('Start processing file: "%s"', filename)
@@ -509,16 +1242,29 @@ def file_reader():
               dimensions, dpi_forced, optimize)
 
     if filename and filedata:
-        log.debug("You uploaded %s (%d bytes)", filename, len(filedata))
-        if filename[-4:] in ['.dxf', '.DXF']:
-            res = read_dxf(filedata, TOLERANCE, optimize)
-        elif filename[-4:] in ['.svg', '.SVG']:
-            res = read_svg(filedata, dimensions, TOLERANCE, dpi_forced, optimize)
-        elif filename[-4:] in ['.ngc', '.NGC']:
-            res = read_ngc(filedata, TOLERANCE, optimize)
-        else:
-            log.error("Unsupported file format")
+        from .filereaders import read_svg, read_dxf, read_ngc
+        if isinstance(filedata, str):
+            log.debug("You uploaded %s (%d bytes)", filename, len(filedata))
+        try:
+            if filename[-4:] in ['.dxf', '.DXF']:
+                if not isinstance(filedata, str):
+                    filedata = text_lines(filedata)
+                res = read_dxf(filedata, TOLERANCE, optimize)
+            elif filename[-4:] in ['.svg', '.SVG']:
+                res = read_svg(filedata, dimensions, TOLERANCE, dpi_forced,
+                               optimize)
+            elif filename[-4:] in ['.ngc', '.NGC']:
+                if not isinstance(filedata, str):
+                    filedata = text_lines(filedata)
+                res = read_ngc(filedata, TOLERANCE, optimize)
+            else:
+                log.error("Unsupported file format")
+        except UploadError as e:
+            return HTTPError(e.status, str(e))
 
+        if (params.get('format') == 'binary' or
+                JOB_MIMETYPE in request.environ.get('HTTP_ACCEPT', '')):
+            return binary_reader_result(res, params.get('preview') == '1')
         jsondata = json.dumps(res)
         log.debug("Returning %d items as %d bytes", len(res['boundarys']),
                   len(jsondata))
@@ -526,6 +1272,104 @@ def file_reader():
     return "You missed a field."
 
 
+def binary_reader_result(res, preview=False):
+    """Send the result of a file reader in the binary format of `jobfile`.
+
+    The paths are float32 blocks, which the frontend uses as they are, the
+    other results go into the metadata. The response is gzip compressed if
+    the client accepts that.
+
+    With preview, paths of more than `PREVIEW_VERTICES` vertices are sent
+    simplified, see `stash_preview`. The metadata then has a 'preview'
+    entry with the 'token' to fetch the levels of detail with, their
+    'tolerances', level 0 being the full resolution, and the 'level' sent.
+    """
+    from . import jobfile
+    meta = dict((key, value) for key, value in res.items()
+                if key != 'boundarys')
+    boundarys = res['boundarys']
+    if preview:
+        from .filereaders.path_optimizers import preview_levels
+        levels = preview_levels(boundarys, TOLERANCE, PREVIEW_VERTICES)
+        if levels:
+            meta['preview'] = {
+                'token': stash_preview(boundarys, levels),
+                'tolerances': [TOLERANCE] + [level[0] for level in levels],
+                'level': len(levels)}
+            boundarys = levels[-1][1]
+    data = jobfile.dumps([], boundarys, meta=meta)
+    log.debug("Returning %d items as %d binary bytes", len(boundarys),
+              len(data))
+    headers = {'Content-Type': JOB_MIMETYPE, 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.environ.get('HTTP_ACCEPT_ENCODING', ''):
+        # a fast level, big imports are compressed once only
+        data = gzip.compress(data, 6)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Content-Length'] = str(len(data))
+    return HTTPResponse(data, **headers)
+
+
+def preview_dir():
+    """Where the levels of detail of imports are stashed."""
+    dirname = os.path.join(tempfile.gettempdir(), 'lasaurapp-previews')
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    return dirname
+
+
+def preview_filename(token, level):
+    return os.path.join(preview_dir(), '%s-%d.lsab' % (token, level))
+
+
+def stash_preview(boundarys, levels):
+    """Stash the paths of an import and their levels of detail, see
+    `path_optimizers.preview_levels`, as binary jobs.
+
+    Returns the token to fetch them with, level 0 being boundarys itself.
+    Stashes older than `PREVIEW_MAX_AGE` are removed.
+    """
+    from . import jobfile
+    dirname = preview_dir()
+    for name in os.listdir(dirname):
+        filename = os.path.join(dirname, name)
+        try:
+            if os.path.getmtime(filename) < time.time() - PREVIEW_MAX_AGE:
+                os.remove(filename)
+        except OSError:
+            pass
+    token = os.urandom(8).hex()
+    for level, paths in enumerate([boundarys] + [paths for tolerance, paths
+                                                 in levels]):
+        with open(preview_filename(token, level), 'wb') as fp:
+            fp.write(jobfile.dumps([], paths))
+    log.info("Import stashed with %d levels of detail", len(levels))
+    return token
+
+
+@route('/file_reader/preview/:token/:level')
+def file_reader_preview_handler(token, level):
+    """A level of detail of an import, see `binary_reader_result`."""
+    if not re_match_preview_token(token) or not level.isdigit():
+        return HTTPError(404, "File does not exist.")
+    return serve_file(preview_filename(token, int(level)), JOB_MIMETYPE)
+
+
+def job_from_preview(token, data):
+    """Returns a binary job of the preview of an import with the paths of
+    the full resolution import instead, for the colors in the preview.
+
+    Raises IOError if the import is gone.
+    """
+    from . import jobfile
+    if not re_match_preview_token(token):
+        raise IOError("invalid preview token")
+    passes, preview_paths = jobfile.loads(data)
+    with open(preview_filename(token, 0), 'rb') as fp:
+        paths_by_color = jobfile.loads(fp.read())[1]
+    return jobfile.dumps(passes, dict((color, paths_by_color.get(color, []))
+                                      for color in preview_paths))
+
+
 
 # def check_user_credentials(username, password):
 #     return username in allowed and allowed[username] == password
@@ -552,16 +1396,30 @@ def file_reader():
 
 
 def main(args):
-    global GUESS_PREFIX, SERIAL_PORT, NETWORK_PORT
+    global GUESS_PREFIX, NETWORK_PORT
+    # machines given as name=port, the first one is the default unless
+    # a serial port is given too
+    if args.port or not args.machines:
+        get_serial_manager(DEFAULT_MACHINE)
+    for machine in args.machines:
+        name, _, port = machine.partition('=')
+        if not re_match_machine_name(name) or not port:
+            print("ERROR: invalid machine '%s', expected name=port." % machine)
+            return
+        get_serial_manager(name).port = port
+    port_cache = PortCache(os.path.join(storage_dir(), PORT_CACHE_FILE))
+    for serial_manager in serial_managers():
+        serial_manager.port_cache = port_cache
     # setup argument parser
     serial_manager = get_serial_manager()
+    serial_port = serial_manager.port
 
     print("LasaurApp %s" % VERSION)
 
     if args.beaglebone:
         HARDWARE = 'beaglebone'
         NETWORK_PORT = 80
-        SERIAL_PORT = "/dev/ttyO1"
+        serial_port = "/dev/ttyO1"
 
         ### if running on beaglebone, setup (pin muxing) and use UART1
         # for details see: http://www.nathandumont.com/node/250
@@ -673,7 +1531,7 @@ def main(args):
     elif args.raspberrypi:
         HARDWARE = 'raspberrypi'
         NETWORK_PORT = 80
-        SERIAL_PORT = "/dev/ttyAMA0"
+        serial_port = "/dev/ttyAMA0"
         import RPi.GPIO as GPIO
         # GPIO.setwarnings(False) # surpress warnings
         GPIO.setmode(GPIO.BCM)  # use chip pin number
@@ -699,35 +1557,35 @@ def main(args):
     if args.list_serial_devices:
         serial_manager.list_devices(BITSPERSECOND)
     else:
-        if not SERIAL_PORT:
+        if not serial_port:
             if args.port:
                 # (1) get the serial device from the argument list
-                SERIAL_PORT = args.port
-                print("Using serial device '%s' from command line." % SERIAL_PORT)
+                serial_port = args.port
+                print("Using serial device '%s' from command line." % serial_port)
             else:
                 # (2) get the serial device from the config file
                 if os.path.isfile(CONFIG_FILE):
                     fp = open(CONFIG_FILE)
                     line = fp.readline().strip()
                     if len(line) > 3:
-                        SERIAL_PORT = line
-                        print("Using serial device '%s' from '%s'." % (SERIAL_PORT, CONFIG_FILE))
+                        serial_port = line
+                        print("Using serial device '%s' from '%s'." % (serial_port, CONFIG_FILE))
 
-        if not SERIAL_PORT:
+        if not serial_port:
             if args.match:
                 GUESS_PREFIX = args.match
-                SERIAL_PORT = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
-                if SERIAL_PORT:
-                    print("Using serial device '%s''" % str(SERIAL_PORT))
+                serial_port = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
+                if serial_port:
+                    print("Using serial device '%s''" % str(serial_port))
                     if os.name == 'posix':
                         # not for windows for now
                         print("(first device to match: %s)"  % args.match)
             else:
-                SERIAL_PORT = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
-                if SERIAL_PORT:
-                    print("Using serial device '%s' by best guess." % str(SERIAL_PORT))
+                serial_port = serial_manager.match_device(GUESS_PREFIX, BITSPERSECOND)
+                if serial_port:
+                    print("Using serial device '%s' by best guess." % str(serial_port))
 
-        if not SERIAL_PORT:
+        if not serial_port:
             print("-" * 77)
             print("WARNING: LasaurApp doesn't know what serial device to connect to!")
             print("Make sure the Lasersaur hardware is connectd to the USB interface.")
@@ -736,18 +1594,23 @@ def main(args):
                 print("See 'Installing Drivers': http://arduino.cc/en/Guide/Windows")
             print("-" * 77)
 
+        serial_manager.port = serial_port
+
         # run
         if args.debug:
             debug(True)
             if hasattr(sys, "_MEIPASS"):
                 print("Data root is: %s" % sys._MEIPASS)
         if args.flash:
-            return_code = flash_upload(SERIAL_PORT, resources_dir(), FIRMWARE, HARDWARE)
+            from .flash import flash_upload
+            return_code = flash_upload(serial_port, resources_dir(), FIRMWARE, HARDWARE)
             if return_code == 0:
                 print("SUCCESS: Arduino appears to be flashed.")
             else:
                 print("ERROR: Failed to flash Arduino.")
         elif args.build_flash:
+            from .build import build_firmware
+            from .flash import flash_upload
             # build
             buildname = "LasaurGrbl_from_src"
             firmware_dir = os.path.join(resources_dir(), 'firmware')
@@ -758,7 +1621,7 @@ def main(args):
             else:
                 print("SUCCESS: firmware built.")
                 # flash
-                return_code = flash_upload(SERIAL_PORT, resources_dir(), FIRMWARE, HARDWARE)
+                return_code = flash_upload(serial_port, resources_dir(), FIRMWARE, HARDWARE)
                 if return_code == 0:
                     print("SUCCESS: Arduino appears to be flashed.")
                 else:
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- static assets
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Static Assets
+-------------
+
+The files of the `frontend` are kept in memory with their gzip and, if the
+``brotli`` package is installed, brotli compressed versions, made once on
+first use. Files precompressed at build time next to the originals, see
+`main`, are used instead when they are up to date.
+
+Every file has a strong ETag, the hash of its content. The references of
+the HTML pages to the scripts, style sheets and images get the hash as a
+version query, so these can be cached by the browser for good.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+ENCODINGS = ('br', 'gzip')
+"""Content encodings offered, preferred first."""
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+"""Suffixes of the files precompressed at build time."""
+COMPRESSED_TYPES = ('text/', 'application/javascript', 'application/json',
+                    'image/svg+xml')
+"""Types worth compressing, images are compressed already."""
+BROTLI_QUALITY = 9
+"""Brotli quality used when serving, the best one (11) is used at build
+time as it is much slower."""
+
+re_sub_references = re.compile(
+    r'''((?:src|href)=")(/(?:css|js|img)/[^"?#]+)(")''').sub
+
+
+def compress(data, encoding, best=False):
+    """Returns data compressed with encoding, or None if it's not
+    available."""
+    if encoding == 'gzip':
+        return gzip.compress(data, 9, mtime=0)
+    elif encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return None
+
+
+def is_compressed_type(mimetype):
+    return mimetype is not None and mimetype.startswith(COMPRESSED_TYPES)
+
+
+class Asset:
+    """A file of the frontend, data is its content as served."""
+
+    def __init__(self, filename, stat, data, dependencies=None):
+        self.filename = filename
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.data = data
+        self.mimetype = mimetypes.guess_type(filename)[0]
+        self.etag = hashlib.sha1(data).hexdigest()[:16]
+        self.dependencies = dependencies or {}
+        """ETag of the assets referenced, by path."""
+        self._encoded = {}
+
+
+    def encoded(self, encoding):
+        """Returns the data compressed with encoding, or None if that's not
+        smaller."""
+        if encoding not in self._encoded:
+            data = None
+            if is_compressed_type(self.mimetype):
+                data = self._precompressed(encoding)
+                if data is None:
+                    data = compress(self.data, encoding)
+            if data is not None and len(data) >= len(self.data):
+                data = None
+            self._encoded[encoding] = data
+        return self._encoded[encoding]
+
+
+    def _precompressed(self, encoding):
+        if self.dependencies:
+            # the content is rewritten, see AssetCache.load
+            return None
+        filename = self.filename + SUFFIXES[encoding]
+        try:
+            if os.path.getmtime(filename) < self.mtime:
+                return None
+            with open(filename, 'rb') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return None
+
+
+    def representation(self, accept_encoding):
+        """Returns the encoding, the data and the ETag to send to a client
+        accepting accept_encoding, the value of its header."""
+        accepted = [token.split(';')[0].strip()
+                    for token in accept_encoding.lower().split(',')]
+        for encoding in ENCODINGS:
+            if encoding in accepted:
+                data = self.encoded(encoding)
+                if data is not None:
+                    return encoding, data, '"%s-%s"' % (self.etag, encoding)
+        return None, self.data, '"%s"' % self.etag
+
+
+    def matches(self, if_none_match):
+        """Tell if the If-None-Match header matches any representation."""
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-')[0] == self.etag:
+                return True
+        return False
+
+
+class AssetCache:
+    """The files below root, loaded again when they change."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.assets = {}
+
+
+    def get(self, path):
+        """Returns the `Asset` of path, relative to the root, or None."""
+        filename = os.path.abspath(os.path.join(self.root, path))
+        if not filename.startswith(self.root + os.sep):
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        asset = self.assets.get(path)
+        if (asset is None or asset.mtime != stat.st_mtime or
+                asset.size != stat.st_size or not self._fresh(asset)):
+            if not os.path.isfile(filename):
+                return None
+            asset = self.assets[path] = self.load(filename, stat)
+        return asset
+
+
+    def _fresh(self, asset):
+        for path, etag in asset.dependencies.items():
+            dependency = self.get(path)
+            if dependency is None or dependency.etag != etag:
+                return False
+        return True
+
+
+    def load(self, filename, stat):
+        """Load a file, HTML pages get a version query added to the
+        references to other assets."""
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+        dependencies = {}
+        if filename.endswith('.html'):
+            def versioned(match):
+                path = match.group(2).lstrip('/')
+                asset = self.get(path)
+                if asset is None:
+                    return match.group(0)
+                dependencies[path] = asset.etag
+                return '%s%s?v=%s%s' % (match.group(1), match.group(2),
+                                        asset.etag, match.group(3))
+            data = re_sub_references(versioned,
+                                     data.decode('utf-8')).encode('utf-8')
+        log.debug("Asset %s loaded", filename)
+        return Asset(filename, stat, data, dependencies)
+
+
+def main(argv):
+    """Precompress the assets below a directory: assets.py [directory]
+
+    Writes ``.gz`` and, if brotli is available, ``.br`` files next to the
+    files worth compressing.
+    """
+    root = argv[0] if argv else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            if (name.endswith(tuple(SUFFIXES.values())) or
+                    name.endswith('.html') or
+                    not is_compressed_type(mimetypes.guess_type(name)[0])):
+                continue
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+            for encoding in ENCODINGS:
+                compressed = compress(data, encoding, best=True)
+                if compressed is None:
+                    continue
+                with open(filename + SUFFIXES[encoding], 'wb') as fp:
+                    fp.write(compressed)
+            print(filename)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
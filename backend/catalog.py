@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- job queue catalog
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Job Catalog
+-----------
+
+An SQLite index of the jobs saved in a directory, so the queue can be listed
+and paginated with a single query instead of scanning the directory and
+reading the modification time of every file.
+
+Starred jobs keep the ``.starred`` suffix on disk, the catalog stores the
+plain name with a flag. The catalog is reconciled with the directory when
+opened, so files added or removed behind its back are picked up on the next
+start. That only takes a ``stat`` per file. The bounding box and the length
+of a job are recorded when it's saved, those of a file picked up by `sync`
+once its statistics are first asked for, see `set_stats`.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+CATALOG_FILE = '.catalog.sqlite'
+STARRED_SUFFIX = '.starred'
+
+CATALOGS = {}
+
+
+class JobCatalog:
+    """Catalog of the jobs in directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, CATALOG_FILE),
+                                   check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                name TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                starred INTEGER,
+                bbox TEXT,
+                length REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_mtime ON jobs (mtime);
+        """)
+        self.sync()
+
+
+    def filename(self, name, starred=False):
+        return os.path.join(self.directory,
+                            name + (STARRED_SUFFIX if starred else ''))
+
+
+    def sync(self):
+        """Reconcile the catalog with the files in the directory."""
+        on_disk = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            name = entry.name
+            starred = name.endswith(STARRED_SUFFIX)
+            if starred:
+                name = name[:-len(STARRED_SUFFIX)]
+            on_disk[name] = (stat.st_size, stat.st_mtime, int(starred))
+        with self._lock:
+            known = {row[0]: tuple(row[1:]) for row in self._db.execute(
+                "SELECT name, size, mtime, starred FROM jobs")}
+        stale = [name for name in known if name not in on_disk]
+        changed = [name for name, info in on_disk.items()
+                   if known.get(name) != info]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM jobs WHERE name = ?",
+                                 [(name,) for name in stale])
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, NULL)",
+                [(name,) + on_disk[name] for name in changed])
+        if stale or changed:
+            log.info("Job catalog synced, %d added or changed, %d removed",
+                     len(changed), len(stale))
+
+
+    def add(self, name, starred=False, stats=None):
+        """Add or update the entry of the job file name.
+
+        stats are the `jobstats.compute_stats` of the job, if known.
+        """
+        stat = os.stat(self.filename(name, starred))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL, NULL)",
+                (name, stat.st_size, stat.st_mtime, int(starred)))
+        if stats is not None:
+            self.set_stats(name, stats)
+
+
+    def set_stats(self, name, stats):
+        """Record the bounding box and length from the
+        `jobstats.compute_stats` of a job."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET bbox = ?, length = ? WHERE name = ?",
+                (json.dumps(stats['bbox']), stats['cut_length'], name))
+
+
+    def remove(self, name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM jobs WHERE name = ?", (name,))
+
+
+    def set_starred(self, name, starred):
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET starred = ? WHERE name = ?",
+                             (int(starred), name))
+
+
+    def get(self, name):
+        """Returns the entry of name as a dictionary or None.
+
+        The bbox and length are None until the stats are known.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, size, mtime, starred, bbox, length FROM jobs "
+                "WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return {'name': row[0], 'size': row[1], 'mtime': row[2],
+                'starred': bool(row[3]),
+                'bbox': json.loads(row[4]) if row[4] is not None else None,
+                'length': row[5]}
+
+
+    def list(self, offset=0, limit=-1, starred=None):
+        """List file names, oldest first.
+
+        With starred True or False only starred or not starred jobs are
+        listed.
+        """
+        query = "SELECT name, starred FROM jobs"
+        args = []
+        if starred is not None:
+            query += " WHERE starred = ?"
+            args.append(int(starred))
+        query += " ORDER BY mtime, name LIMIT ? OFFSET ?"
+        args.extend((limit, offset))
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [name + (STARRED_SUFFIX if starred else '')
+                for name, starred in rows]
+
+
+
+def get_catalog(directory):
+    """Returns the catalog of directory, opened once."""
+    catalog = CATALOGS.get(directory)
+    if catalog is None:
+        catalog = CATALOGS[directory] = JobCatalog(directory)
+    return catalog
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- job checkpoints
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Job Checkpoints
+---------------
+
+The journal of the job being run: what the job is, so its `GCODE` can be
+generated again, the line the machine got to and the state of the
+firmware before that line, see `progress.JobProgress.checkpoint`. It is
+written regularly while the job runs and whenever the job is stopped or
+the serial connection lost, so a job can be resumed instead of being run
+again from the start, even after a restart of the app.
+"""
+
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class Journal:
+    """A checkpoint journal kept in filename.
+
+    The job is a dictionary describing how to generate the job again, it
+    is up to the app. A ``spool`` key names a file holding the job, which
+    is removed with the journal.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+    def load(self):
+        """Returns the journal as a dictionary with the keys ``job``,
+        ``line``, ``state`` and ``reason``, or None."""
+        try:
+            with open(self.filename) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+
+    def _write(self, entry):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_filename, self.filename)
+
+
+    def start(self, job):
+        """Start the journal of a new job."""
+        previous = self.load()
+        if previous is not None and previous['job'].get('spool') != job.get('spool'):
+            self._remove_spool(previous)
+        self._write({'job': job, 'line': 0, 'state': None, 'reason': None})
+
+
+    def checkpoint(self, checkpoint, reason=None):
+        """Record a `JobProgress.checkpoint`, reason tells why the job
+        stopped, if it did."""
+        entry = self.load()
+        if entry is None:
+            return
+        entry.update(checkpoint)
+        entry['reason'] = reason
+        self._write(entry)
+        if reason:
+            log.info("Job checkpoint at line %d, %s", entry['line'], reason)
+
+
+    def clear(self):
+        """Forget the job, it is done."""
+        entry = self.load()
+        if entry is not None:
+            self._remove_spool(entry)
+            os.remove(self.filename)
+
+
+    def _remove_spool(self, entry):
+        spool = entry['job'].get('spool')
+        if spool and os.path.exists(spool):
+            os.remove(spool)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- serial device discovery
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Device Discovery
+----------------
+
+Finds the serial port a Lasersaur is connected to. The port that worked
+last time is remembered with its hardware id, see `PortCache`, so it is
+found again at once, even if the system gave it another name.
+
+Otherwise the candidate ports are probed all at the same time, each for at
+most `PROBE_TIMEOUT` seconds: the `ATmega` resets when its port is opened
+and the firmware greets with the ``LASAURGRBL_FIRST_STRING`` banner once it
+booted.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+
+import serial
+from serial.tools import list_ports
+
+log = logging.getLogger(__name__)
+
+BANNER = b"LasaurGrbl"
+"""String the firmware sends when it starts, see `probe_port`."""
+PROBE_TIMEOUT = 3.0
+"""Seconds a port is given to send the banner, the bootloader of the
+`ATmega` runs for about a second before the firmware starts."""
+WINDOWS_PORTS = ['COM%d' % i for i in range(1, 25)]
+"""Ports probed on Windows when no port is known by its description."""
+
+
+def list_port_infos(search_regex=None):
+    """Returns the serial ports as sorted (port, description, hwid) tuples,
+    only those matching search_regex if given."""
+    if search_regex:
+        infos = list_ports.grep(search_regex)
+    else:
+        infos = list_ports.comports()
+    return sorted(tuple(info)[:3] for info in infos)
+
+
+def port_hwid(port):
+    """Returns the hardware id of a port, or None."""
+    for device, desc, hwid in list_port_infos():
+        if device == port:
+            return hwid
+    return None
+
+
+def find_hardware(port, hwid, infos=None):
+    """Returns the port the hardware with hwid last seen on port is on now,
+    or None if it's gone.
+
+    That is port if it still has the same hardware, or another port if the
+    hardware can be told apart. infos are the `list_port_infos` to look in.
+    """
+    if infos is None:
+        infos = list_port_infos()
+    for device, desc, device_hwid in infos:
+        if device == port and device_hwid == hwid:
+            return device
+    for device, desc, device_hwid in infos:
+        if device_hwid == hwid and hwid not in (None, '', 'n/a'):
+            return device
+    return None
+
+
+def probe_port(port, baudrate, deadline, cancelled=None):
+    """Tell if the firmware greets on port before the time deadline.
+
+    Gives up early when the cancelled `threading.Event` is set.
+    """
+    try:
+        device = serial.Serial(port, baudrate, timeout=0)
+    except (serial.SerialException, OSError, ValueError):
+        return False
+    try:
+        received = bytearray()
+        while time.time() < deadline:
+            if cancelled is not None and cancelled.is_set():
+                return False
+            chars = device.read(64)
+            if chars:
+                received += chars
+                if BANNER in received:
+                    return True
+            else:
+                time.sleep(0.01)
+        return False
+    except (serial.SerialException, OSError):
+        return False
+    finally:
+        device.close()
+
+
+def probe_ports(ports, baudrate, timeout=PROBE_TIMEOUT):
+    """Probe ports concurrently, returns the first one the firmware greets
+    on, or None after timeout seconds at most."""
+    if not ports:
+        return None
+    deadline = time.time() + timeout
+    cancelled = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(len(ports)) as executor:
+        futures = {executor.submit(probe_port, port, baudrate, deadline,
+                                   cancelled): port
+                   for port in ports}
+        for future in concurrent.futures.as_completed(futures):
+            if future.result():
+                cancelled.set()
+                log.debug("Firmware found on %s", futures[future])
+                return futures[future]
+    return None
+
+
+def open_ports(ports, baudrate):
+    """Returns the ports that can be opened, trying them concurrently."""
+    def try_open(port):
+        try:
+            serial.Serial(port, baudrate).close()
+            return True
+        except (serial.SerialException, OSError, ValueError):
+            return False
+    if not ports:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(len(ports)) as executor:
+        return [port for port, available in zip(ports, executor.map(try_open,
+                                                                    ports))
+                if available]
+
+
+def find_device(search_regex, baudrate, cache=None, name=None, exclude=()):
+    """Find the port of a Lasersaur.
+
+    The port remembered in cache for the machine name comes first, if its
+    hardware is still there. Otherwise the port is one of those matching
+    search_regex: the only one, or the first the firmware greets on. On
+    Windows all the COM ports are probed if none matches. Ports in exclude
+    are in use by other machines. Returns None if nothing is found.
+    """
+    infos = [info for info in list_port_infos() if info[0] not in exclude]
+    if cache is not None:
+        cached = cache.get(name)
+        if cached is not None:
+            port = find_hardware(cached['port'], cached['hwid'], infos)
+            if port is not None:
+                log.debug("Using serial port %s of the cached hardware", port)
+                return port
+    matched = [info[0] for info in list_port_infos(search_regex)
+               if info[0] not in exclude]
+    if len(matched) == 1:
+        return matched[0]
+    if not matched and os.name == 'nt':
+        # USB serial ports may not be described as such
+        matched = [port for port in WINDOWS_PORTS if port not in exclude]
+    elif not matched:
+        log.debug("No serial port match for anything like: %s", search_regex)
+        return None
+    log.info("Trying to find Controller on %d ports ...", len(matched))
+    port = probe_ports(matched, baudrate)
+    if port is None and os.name != 'nt':
+        # the first match, as a best guess
+        port = matched[0]
+    return port
+
+
+class PortCache:
+    """The last port each machine worked on, with its hardware id, kept in
+    filename as JSON."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+    def _load(self):
+        try:
+            with open(self.filename) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+    def get(self, name):
+        """Returns a dictionary with the ``port`` and ``hwid`` of machine
+        name, or None."""
+        return self._load().get(name)
+
+
+    def remember(self, name, port):
+        """Remember that machine name worked on port."""
+        ports = self._load()
+        entry = {'port': port, 'hwid': port_hwid(port)}
+        if ports.get(name) == entry:
+            return
+        ports[name] = entry
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            json.dump(ports, fp)
+        os.replace(tmp_filename, self.filename)
@@ -6,13 +6,16 @@ File Reader Module
 __author__ = 'Stefan Hechenberger <stefan@nortd.com>'
 
 
-from .svg_reader import SVGReader
-from .dxf_reader import DXFReader
-from .ngc_reader import NGCReader
-from .path_optimizers import optimize_all
+# the readers are imported on first use, the SVG one and its color tables
+# take a while to load on small boards
+
+# the file data is a string or, to parse it while it's uploaded, a binary
+# file for SVG and an iterable of lines for DXF and G-code
 
 
 def read_svg(svg_string, target_size, tolerance, forced_dpi=None, optimize=True):
+    from .svg_reader import SVGReader
+    from .path_optimizers import optimize_all
     svgReader = SVGReader(tolerance, target_size)
     parse_results = svgReader.parse(svg_string, forced_dpi)
     if optimize:
@@ -22,6 +25,8 @@ def read_svg(svg_string, target_size, tolerance, forced_dpi=None, optimize=True)
 
 
 def read_dxf(dxf_string, tolerance, optimize=True):
+    from .dxf_reader import DXFReader
+    from .path_optimizers import optimize_all
     dxfReader = DXFReader(tolerance)
     parse_results = dxfReader.parse(dxf_string)
     if optimize:
@@ -35,6 +40,7 @@ def read_dxf(dxf_string, tolerance, optimize=True):
 
 
 def read_ngc(ngc_string, tolerance, optimize=True):
+    from .ngc_reader import NGCReader
     ngcReader = NGCReader(tolerance)
     parse_results = ngcReader.parse(ngc_string)
     # if optimize:
@@ -7,13 +7,107 @@ __author__ = 'David S. Touretzky, Stefan Hechenberger <stefan@nortd.com>'
 
 
 import math
-import io
 
+from .utilities import matrixMult, matrixApply
 
 
 
+
+def dxf_entities(dxfstring):
+    """Split DXF data in bulk and generate (name, codes, values) by entity.
+
+    Codes are converted to integers, values are left as raw strings
+    (float() and int() don't mind the padding), entity names are
+    stripped. All the group pairs before the first entity are grouped
+    under name None. Anything after the EOF entity is ignored.
+    """
+    lines = dxfstring.splitlines()
+    if len(lines) % 2:
+        lines.append('')
+    try:
+        codes = list(map(int, lines[0::2]))
+    except ValueError:
+        # blank lines or other junk after the end of the file
+        lines = lines[:_eof_index(lines)]
+        codes = list(map(int, lines[0::2]))
+    values = lines[1::2]
+    del lines
+    start = 0
+    end = len(codes)
+    while start < end:
+        try:
+            stop = codes.index(0, start + 1)
+        except ValueError:
+            stop = end
+        if codes[start] == 0:
+            yield (values[start].strip(), codes[start+1:stop],
+                   values[start+1:stop])
+        else:
+            yield None, codes[start:stop], values[start:stop]
+        start = stop
+
+
+def _eof_index(lines):
+    # index of the line after the EOF entity, len(lines) if there is none
+    for index in range(1, len(lines), 2):
+        if lines[index].strip() == 'EOF' and lines[index-1].strip() == '0':
+            return index + 1
+    return len(lines)
+
+
+def iter_dxf_entities(lines):
+    """Generate (name, codes, values) by entity from an iterable of lines.
+
+    Use this over dxf_entities for huge files that should not be loaded
+    into memory at once, e.g. an open file object. Stops at the EOF
+    entity.
+    """
+    lines = iter(lines)
+    name = None
+    codes = []
+    values = []
+    for code in lines:
+        value = next(lines, '')
+        code = int(code)
+        if code == 0:
+            if name is not None or codes:
+                yield name, codes, values
+            name = value.strip()
+            codes = []
+            values = []
+            if name == 'EOF':
+                break
+        else:
+            codes.append(code)
+            values.append(value)
+    if name is not None or codes:
+        yield name, codes, values
+
+
+def group_floats(codes, values, *wanted):
+    """Get the float values of the wanted group codes, 0.0 when missing."""
+    floats = []
+    for code in wanted:
+        try:
+            floats.append(float(values[codes.index(code)]))
+        except ValueError:
+            floats.append(0.0)
+    return floats
+
+
+def group_string(codes, values, code):
+    """Get the stripped string value of a group code, '' when missing."""
+    try:
+        return values[codes.index(code)].strip()
+    except ValueError:
+        return ''
+
+
 class DXFReader:
-    """Parse very simple DXF files with lines, arcs, and lwpolyline.
+    """Parse simple DXF files.
+
+    Supported entities are LINE, CIRCLE, ARC, ELLIPSE, LWPOLYLINE and
+    POLYLINE (with bulges), SPLINE and INSERT of blocks.
 
     Usage:
     reader = DXFReader(0.08)
@@ -32,16 +126,43 @@ class DXFReader:
         self.black_boundarys = self.boundarys['#000000']
 
         self.metricflag = 1
-        self.linecount = 0
-        self.line = ''
-        self.dxfcode = ''
-
-
 
-    def parse(self, dxfstring):
-        self.linecount = 0
-        self.line = ""
-        self.infile = io.StringIO(dxfstring)
+        # block definitions by name, (base point, entities)
+        self._blocks = {}
+        # flattened blocks
+        # {(name, scale_octave): [path0, path1, ..]}
+        self._block_paths = {}
+        self._inserting = set()
+        # scale of the geometry currently flattened, relative to world
+        self._scale = 1.0
+        # current POLYLINE, collecting the following VERTEX entities
+        self._polyline = None
+        # unsupported entities already complained about
+        self._ignored = set()
+
+        # entity handlers by entity name, each one gets the group codes
+        # and values of the entity and the list of paths to append to
+        self._handlers = {
+            'LINE': self.do_line,
+            'CIRCLE': self.do_circle,
+            'ARC': self.do_arc,
+            'ELLIPSE': self.do_ellipse,
+            'LWPOLYLINE': self.do_lwpolyline,
+            'POLYLINE': self.do_polyline,
+            'VERTEX': self.do_vertex,
+            'SEQEND': self.do_seqend,
+            'SPLINE': self.do_spline,
+            'INSERT': self.do_insert
+        }
+
+
+
+    def parse(self, dxfdata):
+        """Parse DXF data, either a string or an iterable of lines."""
+        if isinstance(dxfdata, str):
+            entities = dxf_entities(dxfdata)
+        else:
+            entities = iter_dxf_entities(dxfdata)
 
         # assume metric file for now
         # self.readtosection(9, "$MEASUREMENT")
@@ -55,72 +176,58 @@ class DXFReader:
         #         self.metricflag = 1
         self.metricflag = 1
 
-        self.readtosection(2, "ENTITIES")
-        while 1:
-            self.readtocode(0)
-            if self.line == "LINE": self.do_line()
-            elif self.line == "CIRCLE": self.do_circle()
-            elif self.line == "ARC": self.do_arc()
-            elif self.line == "LWPOLYLINE": self.do_lwpolyline()
-            elif self.line == "SPLINE": self.complain_spline()
-            elif self.line == "ENDSEC": break
-            else: self.complain_invalid()
-
-        self.infile.close()
+        self._blocks = {}
+        self._block_paths = {}
+        section = None
+        block = None
+        for name, codes, values in entities:
+            if name == "SECTION":
+                section = values[0].strip() if values else None
+            elif name == "ENDSEC":
+                if section == "ENTITIES":
+                    break
+                section = None
+            elif section == "BLOCKS":
+                # collect block definitions, flattened on first INSERT
+                if name == "BLOCK":
+                    x, y = group_floats(codes, values, 10, 20)
+                    block = ([x, y], [])
+                    self._blocks[group_string(codes, values, 2)] = block
+                elif name == "ENDBLK":
+                    block = None
+                elif block is not None:
+                    block[1].append((name, codes, values))
+            elif section == "ENTITIES":
+                self.do_entity(name, codes, values, self.black_boundarys)
+        else:
+            self.complain_premature_end()
+
         print("Done!")
         return {'boundarys':self.boundarys}
 
 
     ################
-    # Routines to read entries from the DXF file
-
-    def readtosection(self, codeval, stringval):
-        self.dxfcode = None
-        while (self.dxfcode != codeval) or (self.line != stringval):
-            self.readonepair()
-
-    def readonepair(self):
-        self.readoneline()
-        self.dxfcode = int(self.line)
-        self.readoneline()
-
-    def readoneline(self):
-        self.linecount += 1
-        self.line = self.infile.readline()
-        if not self.line:
-            print("Premature end of file!")
-            print("Something is wrong. Sorry!")
-            raise ValueError
-        self.line = self.line.rstrip()
-
-    def readtocode(self, val):
-        self.dxfcode = None
-        while self.dxfcode != val:
-            self.readonepair()
-
-    def readgroup(self, codeval):
-        self.readtocode(codeval)
-        return self.line
-
-    ################
-    # Translate each type of entity (line, circle, arc, lwpolyline)
-
-    def do_line(self):
-        x1 = float(self.readgroup(10))
-        y1 = float(self.readgroup(20))
-        x2 = float(self.readgroup(11))
-        y2 = float(self.readgroup(21))
+    # Translate each type of entity
+
+    def do_entity(self, name, codes, values, paths):
+        handler = self._handlers.get(name)
+        if handler is not None:
+            handler(codes, values, paths)
+        elif name not in self._ignored:
+            self._ignored.add(name)
+            self.complain_invalid(name)
+
+    def do_line(self, codes, values, paths):
+        x1, y1, x2, y2 = group_floats(codes, values, 10, 20, 11, 21)
         if self.metricflag == 0:
             x1 = x1*25.4
             y1 = y1*25.4
             x2 = x2*25.4
             y2 = y2*25.4
-        self.black_boundarys.append([[x1,y1],[x2,y2]])
+        paths.append([[x1,y1],[x2,y2]])
 
-    def do_circle(self):
-        cx = float(self.readgroup(10))
-        cy = float(self.readgroup(20))
-        r = float(self.readgroup(40))
+    def do_circle(self, codes, values, paths):
+        cx, cy, r = group_floats(codes, values, 10, 20, 40)
         if self.metricflag == 0:
             cx = cx*25.4
             cy = cy*25.4
@@ -130,18 +237,15 @@ class DXFReader:
         self.addArc(path, cx, cy+r, r, r, 0, 0, 0, cx+r, cy)
         self.addArc(path, cx+r, cy, r, r, 0, 0, 0, cx, cy-r)
         self.addArc(path, cx, cy-r, r, r, 0, 0, 0, cx-r, cy)
-        self.black_boundarys.append(path)
+        paths.append(path)
 
-    def do_arc(self):
-        cx = float(self.readgroup(10))
-        cy = float(self.readgroup(20))
-        r = float(self.readgroup(40))
+    def do_arc(self, codes, values, paths):
+        cx, cy, r = group_floats(codes, values, 10, 20, 40)
         if self.metricflag == 0:
             cx = cx*25.4
             cy = cy*25.4
             r = r*25.4
-        theta1deg = float(self.readgroup(50))
-        theta2deg = float(self.readgroup(51))
+        theta1deg, theta2deg = group_floats(codes, values, 50, 51)
         thetadiff = theta2deg-theta1deg
         if thetadiff < 0 : thetadiff = thetadiff + 360
         large_arc_flag = int(thetadiff >= 180)
@@ -154,30 +258,255 @@ class DXFReader:
         y2 = cy + r*math.sin(theta2)
         path = []
         self.addArc(path, x1, y1, r, r, 0, large_arc_flag, sweep_flag, x2, y2)
-        self.black_boundarys.append(path)
+        paths.append(path)
 
-    def do_lwpolyline(self):
-        numverts = int(self.readgroup(90))
+    def do_ellipse(self, codes, values, paths):
+        cx, cy, mx, my, ratio, start, end = group_floats(
+            codes, values, 10, 20, 11, 21, 40, 41, 42)
+        if self.metricflag == 0:
+            cx = cx*25.4
+            cy = cy*25.4
+            mx = mx*25.4
+            my = my*25.4
+        if 42 not in codes or end <= start:
+            # full ellipse or crossing the zero parameter
+            end += 2*math.pi
+
+        def _getVertex(t):
+            ct = math.cos(t)
+            st = ratio*math.sin(t)
+            return [cx + mx*ct - my*st, cy + my*ct + mx*st]
+
+        # flatten by quarters at most, so the midpoint test can't be fooled
+        # by symmetric parameter ranges
         path = []
-        self.black_boundarys.append(path)
-        for i in range(0,numverts):
-            x = float(self.readgroup(10))
-            y = float(self.readgroup(20))
-            if self.metricflag == 0:
-                x = x*25.4
-                y = y*25.4
-            path.append([x,y])
-
-    def complain_spline(self):
-        print("Encountered a SPLINE at line", self.linecount)
-        print("This program cannot handle splines at present.")
-        print("Convert the spline to an LWPOLYLINE using Save As options in"
-              " SolidWorks.")
-        raise ValueError
-
-    def complain_invalid(self):
-        print("Invalid element '%s' on line" % self.line, self.linecount)
-        print("Can't process this DXF file. Sorry!")
+        steps = int(math.ceil((end-start) / (0.5*math.pi)))
+        for i in range(steps):
+            t1 = start + (end-start)*i/steps
+            t2 = start + (end-start)*(i+1)/steps
+            self.addCurve(path, _getVertex, t1, t2)
+        paths.append(path)
+
+    def do_lwpolyline(self, codes, values, paths):
+        # vertices are [x, y, bulge]
+        vertices = []
+        flags = 0
+        for code, value in zip(codes, values):
+            if code == 10:
+                vertices.append([float(value), 0.0, 0.0])
+            elif code == 20 and vertices:
+                vertices[-1][1] = float(value)
+            elif code == 42 and vertices:
+                vertices[-1][2] = float(value)
+            elif code == 70:
+                flags = int(value)
+        if vertices:
+            paths.append(self.bulge_path(vertices, flags & 1))
+
+    def do_polyline(self, codes, values, paths):
+        flags = 0
+        if 70 in codes:
+            flags = int(values[codes.index(70)])
+        if flags & (16|64):
+            # polygon and polyface meshes
+            self.complain_invalid("POLYLINE mesh")
+            flags = None
+        # vertices follow as VERTEX entities up to a SEQEND
+        self._polyline = (paths, flags, [])
+
+    def do_vertex(self, codes, values, paths):
+        if self._polyline is None or self._polyline[1] is None:
+            return
+        flags = 0
+        if 70 in codes:
+            flags = int(values[codes.index(70)])
+        if not flags & 16:  # skip spline frame control points
+            self._polyline[2].append(group_floats(codes, values, 10, 20, 42))
+
+    def do_seqend(self, codes, values, paths):
+        if self._polyline is not None:
+            paths, flags, vertices = self._polyline
+            self._polyline = None
+            if vertices:
+                paths.append(self.bulge_path(vertices, flags & 1))
+
+    def do_spline(self, codes, values, paths):
+        degree = 3
+        flags = 0
+        knots = []
+        weights = []
+        controls = []
+        fits = []
+        for code, value in zip(codes, values):
+            if code == 10:
+                controls.append([float(value), 0.0])
+            elif code == 20 and controls:
+                controls[-1][1] = float(value)
+            elif code == 11:
+                fits.append([float(value), 0.0])
+            elif code == 21 and fits:
+                fits[-1][1] = float(value)
+            elif code == 40:
+                knots.append(float(value))
+            elif code == 41:
+                weights.append(float(value))
+            elif code == 70:
+                flags = int(value)
+            elif code == 71:
+                degree = int(value)
+        if self.metricflag == 0:
+            for vertex in controls + fits:
+                vertex[0] *= 25.4
+                vertex[1] *= 25.4
+
+        n = len(controls)
+        if n <= degree or len(knots) != n + degree + 1:
+            if len(fits) > 1:
+                # no usable control net, fall back to the fit points
+                path = fits
+                if flags & 1:
+                    path.append(list(path[0]))
+                paths.append(path)
+            else:
+                print("Invalid SPLINE skipped")
+            return
+        if len(weights) != n:
+            weights = [1.0]*n
+        # homogeneous control points
+        hcontrols = [(x*w, y*w, w) for (x, y), w in zip(controls, weights)]
+
+        def _getVertex(t, k):
+            # de Boor's algorithm on knot span k
+            d = [list(hcontrols[j+k-degree]) for j in range(degree+1)]
+            for r in range(1, degree+1):
+                for j in range(degree, r-1, -1):
+                    left = knots[j+k-degree]
+                    alpha = (t - left) / (knots[j+1+k-r] - left)
+                    dj = d[j]
+                    dj1 = d[j-1]
+                    dj[0] = (1.0-alpha)*dj1[0] + alpha*dj[0]
+                    dj[1] = (1.0-alpha)*dj1[1] + alpha*dj[1]
+                    dj[2] = (1.0-alpha)*dj1[2] + alpha*dj[2]
+            x, y, w = d[degree]
+            return [x/w, y/w]
+
+        # flatten span by span, the curve is smooth within every span
+        path = []
+        for k in range(degree, n):
+            t1 = knots[k]
+            t2 = knots[k+1]
+            if t2 > t1:
+                self.addCurve(path, lambda t, k=k: _getVertex(t, k), t1, t2)
+        paths.append(path)
+
+    def do_insert(self, codes, values, paths):
+        name = group_string(codes, values, 2)
+        if name not in self._blocks:
+            print("INSERT of unknown block '%s' skipped" % name)
+            return
+        if name in self._inserting:
+            print("Recursive INSERT of block '%s' skipped" % name)
+            return
+        x, y, rotation, colspacing, rowspacing = group_floats(
+            codes, values, 10, 20, 50, 44, 45)
+        sx = sy = 1.0
+        columns = rows = 1
+        for code, value in zip(codes, values):
+            if code == 41:
+                sx = float(value)
+            elif code == 42:
+                sy = float(value)
+            elif code == 70:
+                columns = max(1, int(value))
+            elif code == 71:
+                rows = max(1, int(value))
+        base, entities = self._blocks[name]
+        bx, by = base
+        if self.metricflag == 0:
+            x = x*25.4
+            y = y*25.4
+            bx = bx*25.4
+            by = by*25.4
+            colspacing = colspacing*25.4
+            rowspacing = rowspacing*25.4
+
+        # Blocks are flattened once for every scale octave, rounding up
+        # to the next power of two tessellates at least as fine as needed
+        # by any insert in the same octave.
+        scale = self._scale * max(abs(sx), abs(sy))
+        octave = 0
+        if scale > 0:
+            octave = int(math.ceil(math.log(scale, 2)))
+        key = (name, octave)
+        template = self._block_paths.get(key)
+        if template is None:
+            template = []
+            saved = (self._scale, self.tolerance2, self._polyline)
+            self._scale = 2.0**octave
+            self.tolerance2 = (self.tolerance/self._scale)**2
+            self._polyline = None
+            self._inserting.add(name)
+            try:
+                for entity in entities:
+                    self.do_entity(entity[0], entity[1], entity[2], template)
+            finally:
+                self._scale, self.tolerance2, self._polyline = saved
+                self._inserting.discard(name)
+            self._block_paths[key] = template
+
+        angle = rotation/180.0 * math.pi
+        ca = math.cos(angle)
+        sa = math.sin(angle)
+        rotate = [ca, sa, -sa, ca, 0, 0]
+        block_to_insert = [sx, 0, 0, sy, -sx*bx, -sy*by]
+        for column in range(columns):
+            for row in range(rows):
+                xform = matrixMult(
+                    matrixMult([1, 0, 0, 1, x, y], rotate),
+                    matrixMult([1, 0, 0, 1, column*colspacing, row*rowspacing],
+                               block_to_insert))
+                for path in template:
+                    instance_path = []
+                    for vert in path:
+                        vert = [vert[0], vert[1]]
+                        matrixApply(xform, vert)
+                        instance_path.append(vert)
+                    paths.append(instance_path)
+
+    def bulge_path(self, vertices, closed):
+        """Build a path from [x, y, bulge] vertices.
+
+        The bulge of a vertex is the tangent of a quarter of the included
+        angle of the arc to the next vertex, negative when clockwise.
+        """
+        scale = 25.4 if self.metricflag == 0 else 1.0
+        path = []
+        count = len(vertices)
+        segments = count if closed else count-1
+        for i in range(segments):
+            x1, y1, bulge = vertices[i]
+            x2, y2 = vertices[(i+1) % count][:2]
+            x1, y1, x2, y2 = x1*scale, y1*scale, x2*scale, y2*scale
+            chord = math.sqrt((x2-x1)**2 + (y2-y1)**2)
+            if bulge and chord > 0:
+                theta = 4.0*math.atan(abs(bulge))
+                r = 0.5*chord / math.sin(0.5*theta)
+                arc = []
+                self.addArc(arc, x1, y1, r, r, 0, int(abs(bulge) > 1),
+                            int(bulge > 0), x2, y2)
+                path.extend(arc[:-1])
+            else:
+                path.append([x1, y1])
+        x, y = vertices[segments % count][:2]
+        path.append([x*scale, y*scale])
+        return path
+
+    def complain_invalid(self, name):
+        print("Unsupported element '%s' skipped" % name)
+
+    def complain_premature_end(self):
+        print("Premature end of file!")
+        print("Something is wrong. Sorry!")
         raise ValueError
 
     def addArc(self, path, x1, y1, rx, ry, phi, large_arc, sweep, x2, y2):
@@ -224,8 +553,17 @@ class DXFReader:
             st = math.sin(theta)
             return [cp*rx*ct-sp*ry*st+cx, sp*rx*ct+cp*ry*st+cy]
 
+        self.addCurve(path, _getVertex, 0.0, 1.0)
+
+    def addCurve(self, path, getVertex, t1Init, t2Init):
+        """Flatten a parametric curve from t1Init to t2Init into path.
+
+        The parameter range gets recursively halved until the curve
+        deviates less than tolerance from the chords. Both end vertices
+        are added.
+        """
         # let the recursive fun begin
-        def _recursiveArc(t1, t2, c1, c5, level, tolerance2):
+        def _recursiveCurve(t1, t2, c1, c5, level, tolerance2):
             def _vertexDistanceSquared(v1, v2):
                 return (v2[0]-v1[0])**2 + (v2[1]-v1[1])**2
 
@@ -239,19 +577,17 @@ class DXFReader:
 
             tRange = t2-t1
             tHalf = t1 + 0.5*tRange
-            c2 = _getVertex(t1 + 0.25*tRange)
-            c3 = _getVertex(tHalf)
-            c4 = _getVertex(t1 + 0.75*tRange)
+            c2 = getVertex(t1 + 0.25*tRange)
+            c3 = getVertex(tHalf)
+            c4 = getVertex(t1 + 0.75*tRange)
             if _vertexDistanceSquared(c2, _vertexMiddle(c1,c3)) > tolerance2:
-                _recursiveArc(t1, tHalf, c1, c3, level+1, tolerance2)
+                _recursiveCurve(t1, tHalf, c1, c3, level+1, tolerance2)
             path.append(c3)
             if _vertexDistanceSquared(c4, _vertexMiddle(c3,c5)) > tolerance2:
-                _recursiveArc(tHalf, t2, c3, c5, level+1, tolerance2)
+                _recursiveCurve(tHalf, t2, c3, c5, level+1, tolerance2)
 
-        t1Init = 0.0
-        t2Init = 1.0
-        c1Init = _getVertex(t1Init)
-        c5Init = _getVertex(t2Init)
+        c1Init = getVertex(t1Init)
+        c5Init = getVertex(t2Init)
         path.append(c1Init)
-        _recursiveArc(t1Init, t2Init, c1Init, c5Init, 0, self.tolerance2)
+        _recursiveCurve(t1Init, t2Init, c1Init, c5Init, 0, self.tolerance2)
         path.append(c5Init)
@@ -1,13 +1,41 @@
 __author__ = 'Stefan Hechenberger <stefan@nortd.com>'
 
+import io
+import math
 import re
+import logging
+
+log = logging.getLogger("ngc_reader")
+
+
+re_sub_comments = re.compile('\([^)]*\)|;.*').sub
+re_findall_words = re.compile('([A-Z])\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))').findall
 
 
 class NGCReader:
-    """Parse subset of G-Code.
-    TODO!!
+    """Streaming interpreter for the G-Code subset relevant to a laser.
+
+    Understood are G0, G1 (linear motion), G2, G3 (arcs in the XY plane,
+    with I, J center offsets or R radius), G20, G21 (inch, mm), G90, G91
+    (absolute, relative distance), G90.1, G91.1 (absolute, relative arc
+    centers), F, S, comments and line numbers. Dwells, plane selection
+    and M codes are accepted and have no effect on the geometry.
+
+    Feed motions (G1, G2, G3) become paths, arcs are flattened according
+    to tolerance. Paths are sorted by color, one for every distinct
+    combination of feedrate and intensity, which are reported as
+    lasertags.
+
+    Usage:
+    reader = NGCReader(0.08)
+    boundarys = reader.parse(open('filename'))
     """
 
+    # colors assigned to cut settings, in order of appearance
+    COLORS = ['#000000', '#ff0000', '#00ff00', '#0000ff', '#ffff00',
+              '#ff00ff', '#00ffff', '#800000', '#008000', '#000080',
+              '#808000', '#800080', '#008080', '#808080']
+
     def __init__(self, tolerance):
         # tolerance settings, used in tessalation, path simplification, etc
         self.tolerance = tolerance
@@ -17,68 +45,166 @@ class NGCReader:
         # {'#ff0000': [[path0, path1, ..], [path0, ..], ..]}
         # Each path is a list of vertices which is a list of two floats.
         self.boundarys = {'#000000':[]}
-        self.black_boundarys = self.boundarys['#000000']
 
+        # (feedrate, intensity) -> color
+        self._settings = {}
 
-    def parse(self, ngcstring):
-        """This is a total super quick HACK!!!!
-            Pretty much only parses the old example files.
-        """
 
-        paths = []
-        current_path = []
-        re_findall_attribs = re.compile('(S|F|X|Y|Z)(-?[0-9]+\.?[0-9]*(?:e-?[0-9]*)?)').findall
+    def parse(self, ngcdata):
+        """Parse G-Code, either a string or an iterable of lines."""
+        if isinstance(ngcdata, str):
+            ngcdata = io.StringIO(ngcdata)
 
-        intensity = 0.0
+        self.boundarys = {}
+        self._settings = {}
+        unsupported = set()
+
+        # modal state
+        motion = 0
+        absolute = True
+        arc_absolute = False
+        unit = 1.0
         feedrate = 1000.0
-        target = [0.0, 0.0, 0.0]
-        prev_motion_was_seek = True
-
-
-        lines = ngcstring.split('\n')
-        for line in lines:
-            line = line.replace(' ', '')
-            if line.startswith('G0'):
-                attribs = re_findall_attribs(line[2:])
-                for attr in attribs:
-                    if attr[0] == 'X':
-                        target[0] = float(attr[1])
-                        prev_motion_was_seek = True
-                    elif attr[0] == 'Y':
-                        target[1] = float(attr[1])
-                        prev_motion_was_seek = True
-                    elif attr[0] == 'Z':
-                        target[2] = float(attr[1])
-                        prev_motion_was_seek = True
-            elif line.startswith('G1'):
-                if prev_motion_was_seek:
-                    # new path
-                    paths.append([[target[0], target[1], target[2]]])
-                    current_path = paths[-1]
-                    prev_motion_was_seek = False
-                # new target
-                attribs = re_findall_attribs(line[2:])
-                for attr in attribs:
-                    if attr[0] == 'X':
-                        target[0] = float(attr[1])
-                    elif attr[0] == 'Y':
-                        target[1] = float(attr[1])
-                    elif attr[0] == 'Z':
-                        target[2] = float(attr[1])
-                    elif attr[0] == 'S':
-                        intensity = float(attr[1])
-                    elif attr[0] == 'F':
-                        feedrate = float(attr[1])
-                current_path.append([target[0], target[1], target[2]])
-            elif line.startswith('S'):
-                attribs = re_findall_attribs(line)
-                for attr in attribs:
-                    if attr[0] == 'S':
-                        intensity = float(attr[1])
+        intensity = 0.0
+        x = 0.0
+        y = 0.0
+        path = None
+
+        for line in ngcdata:
+            line = re_sub_comments('', line.upper())
+            words = re_findall_words(line)
+            if not words:
+                continue
+            target = {}
+            for letter, value in words:
+                if letter == 'G':
+                    if value in ('0', '00'):
+                        motion = 0
+                    elif value in ('1', '01'):
+                        motion = 1
+                    elif value in ('2', '02'):
+                        motion = 2
+                    elif value in ('3', '03'):
+                        motion = 3
+                    elif value == '90':
+                        absolute = True
+                    elif value == '91':
+                        absolute = False
+                    elif value == '90.1':
+                        arc_absolute = True
+                    elif value == '91.1':
+                        arc_absolute = False
+                    elif value == '20':
+                        unit = 25.4
+                    elif value == '21':
+                        unit = 1.0
+                    elif value in ('4', '04', '17', '40', '49', '54', '94'):
+                        pass  # no effect on geometry
+                    elif value not in unsupported:
+                        unsupported.add(value)
+                        log.warn("Unsupported G-Code G%s ignored" % value)
+                elif letter == 'F':
+                    feedrate = float(value) * unit
+                elif letter == 'S':
+                    intensity = float(value)
+                elif letter in 'XYIJR':
+                    target[letter] = float(value) * unit
+                # M, N, P, Z words have no effect on the geometry
+
+            if 'X' not in target and 'Y' not in target:
+                continue
+            if absolute:
+                x2 = target.get('X', x)
+                y2 = target.get('Y', y)
+            else:
+                x2 = x + target.get('X', 0.0)
+                y2 = y + target.get('Y', 0.0)
+
+            if motion == 0:
+                path = None
+            else:
+                paths = self.boundarys[self._get_color(feedrate, intensity)]
+                if path is None or not paths or path is not paths[-1]:
+                    # new path on seek or change of cut settings
+                    path = [[x, y]]
+                    paths.append(path)
+                if motion == 1:
+                    path.append([x2, y2])
+                else:
+                    if 'R' in target:
+                        center = self._center_from_radius(
+                            x, y, x2, y2, target['R'], motion == 2)
+                    elif arc_absolute:
+                        center = (target.get('I', x), target.get('J', y))
+                    else:
+                        center = (x + target.get('I', 0.0),
+                                  y + target.get('J', 0.0))
+                    self.add_arc(path, x, y, x2, y2, center, motion == 2)
+            x = x2
+            y = y2
+
+        if not self.boundarys:
+            self.boundarys = {'#000000':[]}
+        parse_results = {'boundarys':self.boundarys}
+        if self._settings:
+            # (pass#, feedrate, unit, intensity, unit, color1, .., color6)
+            lasertags = []
+            for (feedrate, intensity), color in self._settings.items():
+                lasertags.append([len(lasertags)+1, int(round(feedrate)), '',
+                                  int(round(intensity/2.55)), '%', color,
+                                  '', '', '', '', ''])
+            parse_results['lasertags'] = lasertags
+        return parse_results
+
+
+    def _get_color(self, feedrate, intensity):
+        key = (feedrate, intensity)
+        color = self._settings.get(key)
+        if color is None:
+            index = len(self._settings)
+            if index < len(self.COLORS):
+                color = self.COLORS[index]
             else:
-                print("Warning: Unsupported Gcode")
+                color = '#%06x' % (index * 0x10101 % 0x1000000)
+            self._settings[key] = color
+            self.boundarys[color] = []
+        return color
+
+
+    def _center_from_radius(self, x1, y1, x2, y2, r, clockwise):
+        # R format, a negative radius selects the arc larger than 180 deg
+        dx = x2 - x1
+        dy = y2 - y1
+        chord = math.sqrt(dx*dx + dy*dy)
+        if chord == 0:
+            return (x1, y1)
+        h2 = r*r - 0.25*chord*chord
+        h = math.sqrt(h2) if h2 > 0 else 0.0
+        if clockwise == (r > 0):
+            h = -h
+        return (x1 + 0.5*dx - h*dy/chord, y1 + 0.5*dy + h*dx/chord)
+
 
-        print("Done!")
-        self.boundarys = {'#000000':paths}
-        pass_ = ['1', feedrate, '', intensity, '', '#000000']
-        return {'boundarys':self.boundarys}
+    def add_arc(self, path, x1, y1, x2, y2, center, clockwise):
+        """Flatten an arc around center into path, start is not added."""
+        cx, cy = center
+        r = math.sqrt((x1-cx)**2 + (y1-cy)**2)
+        a1 = math.atan2(y1-cy, x1-cx)
+        a2 = math.atan2(y2-cy, x2-cx)
+        if clockwise:
+            if a2 >= a1:
+                a2 -= 2*math.pi
+        else:
+            if a2 <= a1:
+                a2 += 2*math.pi
+        sweep = a2 - a1
+        # largest angle step keeping the chord within tolerance
+        if r > 0.5*self.tolerance:
+            step = 2*math.acos(1 - self.tolerance/r)
+            segments = max(1, int(math.ceil(abs(sweep) / step)))
+        else:
+            segments = 1
+        for i in range(1, segments):
+            angle = a1 + sweep*i/segments
+            path.append([cx + r*math.cos(angle), cy + r*math.sin(angle)])
+        path.append([x2, y2])
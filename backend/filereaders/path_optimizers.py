@@ -218,3 +218,58 @@ def optimize_all(boundarys, tolerance):
         connect_segments(boundarys[color], epsilon2)
         simplify_all(boundarys[color], tolerance2)
         sort_by_seektime(boundarys[color])
+
+
+
+def count_vertices(boundarys):
+    return sum(len(pathseg) for path in boundarys.values() for pathseg in path)
+
+
+
+def simplify_preview(boundarys, tolerance):
+    """
+    Simplified copy of boundarys for drawing at a resolution of tolerance.
+
+    Path segments smaller than tolerance are reduced to their end points,
+    and only one of them is kept per grid cell of that size, so the amount
+    of data is bounded by the area covered, whatever the number of tiny
+    details.
+    """
+    tolerance2 = tolerance**2
+    preview = {}
+    for color, path in boundarys.items():
+        cells = set()
+        preview_path = []
+        for pathseg in path:
+            pathseg = simplify(pathseg, tolerance2)
+            if not pathseg:
+                continue
+            if all(d2(vertex, pathseg[0]) < tolerance2 for vertex in pathseg):
+                cell = (int(pathseg[0][0]//tolerance),
+                        int(pathseg[0][1]//tolerance))
+                if cell in cells:
+                    continue
+                cells.add(cell)
+                pathseg = [pathseg[0], pathseg[-1]]
+            preview_path.append(pathseg)
+        preview[color] = preview_path
+    return preview
+
+
+
+def preview_levels(boundarys, tolerance, max_vertices, factor=4, max_levels=8):
+    """
+    Levels of detail of boundarys for previews.
+
+    Each level is simplified from the one before with a tolerance factor
+    times larger, starting at tolerance, until at most max_vertices are
+    left. Returns a list of (tolerance, boundarys), the finest first,
+    empty if boundarys is small enough already.
+    """
+    levels = []
+    while (count_vertices(boundarys) > max_vertices and
+           len(levels) < max_levels):
+        tolerance *= factor
+        boundarys = simplify_preview(boundarys, tolerance)
+        levels.append((tolerance, boundarys))
+    return levels
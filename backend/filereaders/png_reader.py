@@ -0,0 +1,261 @@
+__author__ = 'Stefan Hechenberger <stefan@nortd.com>'
+
+import base64
+import io
+import struct
+import zlib
+import logging
+
+log = logging.getLogger("png_reader")
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PNGReader:
+    """Streaming PNG decoder producing grayscale rows.
+
+    Only the image data needed for the next row is decompressed, so large
+    images can be processed with memory for about two rows. All color
+    types and bit depths are supported, colors are converted to luminance
+    and transparent pixels are composited over white. Interlaced images
+    are not supported.
+
+    Usage:
+    reader = PNGReader(open('filename', 'rb'))
+    for row in reader.iter_rows():
+        # row is a bytearray of reader.width values, 0 is black
+    """
+
+    # channels per color type
+    CHANNELS = {0:1, 2:3, 3:1, 4:2, 6:4}
+
+    def __init__(self, source):
+        """source is a binary file-like object, bytes or a data URI."""
+        if isinstance(source, str):
+            source = decode_data_uri(source)
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        self._fp = source
+        if self._fp.read(8) != PNG_SIGNATURE:
+            raise ValueError("not a PNG image")
+        self.palette = None
+        self.transparency = None
+        ctype, data = self._read_chunk()
+        if ctype != b'IHDR':
+            raise ValueError("invalid PNG, IHDR chunk missing")
+        (self.width, self.height, self.bitdepth, self.colortype,
+         compression, filtering, interlace) = struct.unpack('>IIBBBBB', data)
+        if self.colortype not in self.CHANNELS:
+            raise ValueError("invalid PNG color type %d" % self.colortype)
+        if interlace:
+            raise ValueError("interlaced PNG images are not supported")
+        self.channels = self.CHANNELS[self.colortype]
+        # bytes per complete pixel, at least one, used by the filters
+        self._bpp = max(1, self.channels*self.bitdepth // 8)
+        self._stride = (self.width*self.channels*self.bitdepth + 7) // 8
+        # read ancillary chunks up to the image data
+        while True:
+            ctype, data = self._read_chunk()
+            if ctype == b'PLTE':
+                self.palette = data
+            elif ctype == b'tRNS':
+                self.transparency = data
+            elif ctype == b'IDAT':
+                self._idat = data
+                break
+            elif ctype == b'IEND':
+                raise ValueError("invalid PNG, no image data")
+
+
+    def _read_chunk(self):
+        header = self._fp.read(8)
+        if len(header) < 8:
+            raise ValueError("invalid PNG, premature end")
+        length, ctype = struct.unpack('>I4s', header)
+        data = self._fp.read(length)
+        self._fp.read(4)  # crc
+        return ctype, data
+
+
+    def _iter_idat(self):
+        yield self._idat
+        self._idat = None
+        while True:
+            ctype, data = self._read_chunk()
+            if ctype == b'IDAT':
+                yield data
+            elif ctype == b'IEND':
+                return
+
+
+    def iter_raw_rows(self):
+        """Iterate over the unfiltered rows as packed bytes."""
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        rowsize = self._stride + 1
+        prior = bytearray(self._stride)
+        rows = 0
+        for data in self._iter_idat():
+            try:
+                pending += decompressor.decompress(data)
+            except zlib.error as e:
+                raise ValueError("invalid PNG image data, %s" % e)
+            while len(pending) >= rowsize and rows < self.height:
+                row = self._unfilter(pending[0], pending[1:rowsize], prior)
+                del pending[:rowsize]
+                prior = row
+                rows += 1
+                yield row
+            if rows >= self.height:
+                return
+        raise ValueError("invalid PNG, image data truncated")
+
+
+    def check(self):
+        """Raise ValueError unless the image data holds all the rows.
+
+        The data is decompressed a piece at a time and thrown away, the
+        rows are not unfiltered. Reads the source to the end of the image
+        data, the reader can't be used afterwards.
+        """
+        decompressor = zlib.decompressobj()
+        rowsize = self._stride + 1
+        needed = self.height*rowsize
+        size = 0
+        for data in self._iter_idat():
+            while data and size < needed:
+                try:
+                    chunk = decompressor.decompress(data, 65536)
+                except zlib.error as e:
+                    raise ValueError("invalid PNG image data, %s" % e)
+                data = decompressor.unconsumed_tail
+                # the first byte of every row is its filter type
+                for i in range(-size % rowsize, min(len(chunk), needed - size),
+                               rowsize):
+                    if chunk[i] > 4:
+                        raise ValueError("invalid PNG filter type %d"
+                                         % chunk[i])
+                size += len(chunk)
+            if size >= needed:
+                return
+        raise ValueError("invalid PNG, image data truncated")
+
+
+    def _unfilter(self, filtertype, row, prior):
+        bpp = self._bpp
+        if filtertype == 0:
+            pass
+        elif filtertype == 1:  # sub
+            for i in range(bpp, len(row)):
+                row[i] = (row[i] + row[i-bpp]) & 0xff
+        elif filtertype == 2:  # up
+            for i in range(len(row)):
+                row[i] = (row[i] + prior[i]) & 0xff
+        elif filtertype == 3:  # average
+            for i in range(bpp):
+                row[i] = (row[i] + (prior[i] >> 1)) & 0xff
+            for i in range(bpp, len(row)):
+                row[i] = (row[i] + ((row[i-bpp] + prior[i]) >> 1)) & 0xff
+        elif filtertype == 4:  # paeth
+            for i in range(len(row)):
+                a = row[i-bpp] if i >= bpp else 0
+                b = prior[i]
+                c = prior[i-bpp] if i >= bpp else 0
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    predictor = a
+                elif pb <= pc:
+                    predictor = b
+                else:
+                    predictor = c
+                row[i] = (row[i] + predictor) & 0xff
+        else:
+            raise ValueError("invalid PNG filter type %d" % filtertype)
+        return row
+
+
+    def _samples(self, row):
+        # unpack a row into a list of 8 bit samples
+        depth = self.bitdepth
+        if depth == 8:
+            return row
+        if depth == 16:
+            return row[0::2]
+        count = self.width*self.channels
+        mask = (1 << depth) - 1
+        samples = []
+        for byte in row:
+            for shift in range(8 - depth, -1, -depth):
+                samples.append((byte >> shift) & mask)
+        del samples[count:]
+        if self.colortype != 3:
+            # scale gray levels to 8 bit, palette indices stay
+            scale = 255 // mask
+            samples = [s*scale for s in samples]
+        return samples
+
+
+    def iter_rows(self):
+        """Iterate over the rows as grayscale, one bytearray per row."""
+        ctype = self.colortype
+        if ctype == 3:
+            lut = self._palette_lut()
+        for row in self.iter_raw_rows():
+            samples = self._samples(row)
+            if ctype == 0:
+                if self.transparency and self.bitdepth <= 8:
+                    key = struct.unpack('>H', self.transparency[:2])[0]
+                    key = key*(255 // ((1 << self.bitdepth) - 1))
+                    gray = bytearray(255 if s == key else s for s in samples)
+                else:
+                    gray = bytearray(samples)
+            elif ctype == 3:
+                gray = bytearray(lut[s] for s in samples)
+            elif ctype == 4:
+                gray = bytearray(over_white(samples[i], samples[i+1])
+                                 for i in range(0, len(samples), 2))
+            else:
+                step = self.channels
+                gray = bytearray()
+                for i in range(0, len(samples), step):
+                    value = luminance(samples[i], samples[i+1], samples[i+2])
+                    if step == 4:
+                        value = over_white(value, samples[i+3])
+                    gray.append(value)
+            yield gray
+
+
+    def _palette_lut(self):
+        palette = self.palette or b''
+        alpha = self.transparency or b''
+        lut = bytearray(256)
+        for index in range(len(palette) // 3):
+            r, g, b = palette[3*index:3*index+3]
+            value = luminance(r, g, b)
+            if index < len(alpha):
+                value = over_white(value, alpha[index])
+            lut[index] = value
+        return lut
+
+
+
+def luminance(r, g, b):
+    return (299*r + 587*g + 114*b + 500) // 1000
+
+
+def over_white(value, alpha):
+    return (value*alpha + 255*(255 - alpha) + 127) // 255
+
+
+def decode_data_uri(uri):
+    """Return the bytes of a base64 encoded data URI."""
+    header, sep, data = uri.partition(',')
+    if not sep or not header.startswith('data:'):
+        raise ValueError("not a data URI")
+    if not header.endswith(';base64'):
+        raise ValueError("only base64 encoded data URIs are supported")
+    return base64.b64decode(data)
@@ -44,7 +44,9 @@ class SVGAttributeReader:
             'y2': self.dimensionAttrib,
             'r': self.dimensionAttrib,
             'cx': self.dimensionAttrib,
-            'cy': self.dimensionAttrib
+            'cy': self.dimensionAttrib,
+            'href': self.hrefAttrib,                # linking
+            '{http://www.w3.org/1999/xlink}href': self.hrefAttrib
         }
 
         self.re_findall_transforms = re.compile('(([a-z]+)\s*\(([^)]*)\))', re.IGNORECASE).findall
@@ -77,6 +79,20 @@ class SVGAttributeReader:
                 log.warn("invalid opacity, default to 1.0")
                 node[attr] = 1.0
 
+    def hrefAttrib(self, node, attr, value):
+        """Read a (xlink:)href attribute, only local references and data
+        URIs."""
+        # http://www.w3.org/TR/SVG11/struct.html#UseElementHrefAttribute
+        value = value.strip()
+        if not value:
+            log.warn("empty reference, ignored")
+        elif value.startswith('#'):
+            node['href'] = value[1:]
+        elif value.startswith('data:'):
+            node['href'] = value
+        else:
+            log.warn("external references are not supported, ignored")
+
     def dimensionAttrib(self, node, attr, value):
         """Read a dimension attribute."""
         node[attr] = self._parseUnit(value)
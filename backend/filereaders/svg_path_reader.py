@@ -3,6 +3,8 @@ __author__ = 'Stefan Hechenberger <stefan@nortd.com>'
 import math
 import logging
 
+from .utilities import matrixExtractScale
+
 log = logging.getLogger("svg_reader")
 
 
@@ -30,19 +32,9 @@ class SVGPathReader:
         """
         # http://www.w3.org/TR/SVG11/paths.html#PathData
 
-        def _matrixExtractScale(mat):
-            # extract absolute scale from matrix
-            sx = math.sqrt(mat[0]*mat[0] + mat[1]*mat[1])
-            sy = math.sqrt(mat[2]*mat[2] + mat[3]*mat[3])
-            # return dominant axis
-            if sx > sy:
-                return sx
-            else:
-                return sy
-
         # adjust tolerance for possible transforms
         self._tolerance2 = self.svgreader.tolerance2
-        totalMaxScale = _matrixExtractScale(node['xformToWorld'])
+        totalMaxScale = matrixExtractScale(node['xformToWorld'])
         if totalMaxScale != 0 and totalMaxScale != 1.0:
             self._tolerance2 /= (totalMaxScale)**2
 
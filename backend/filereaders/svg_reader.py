@@ -1,8 +1,9 @@
 __author__ = 'Stefan Hechenberger <stefan@nortd.com>'
 
 import logging
+import math
 
-from .utilities import matrixApply
+from .utilities import matrixApply, matrixMult, matrixExtractScale
 from .utilities import vertexScale, parseFloats, parseScalar
 from .svg_tag_reader import SVGTagReader
 
@@ -41,6 +42,7 @@ except ImportError:
 #   * non-pixel units (cm, mm, in, pt, pc)
 #   * 'style' attribute and presentation attributes
 #   * curves, arcs, cirles, ellipses tesellated according to tolerance
+#   * 'use' instancing of elements and symbols, tesellated once per scale
 #
 # Intentinally not Supported:
 #   * markers
@@ -91,12 +93,30 @@ class SVGReader:
         # value is the actual value to use
         self.lasertags = []
 
-        # # tags that should not be further traversed
-        # self.ignore_tags = {'defs':None, 'pattern':None, 'clipPath':None}
+        # embedded bitmaps, placed in mm
+        # [{'image':data_uri, 'pos':[x,y], 'size':[w,h]}, ..]
+        self.rasters = []
+
+        # tags whose children are only rendered when referenced by 'use'
+        self.ignore_tags = {'defs':None, 'symbol':None}
+
+        # attributes a node inherits from its parent
+        self._inherited_attribs = ('display', 'visibility', 'fill', 'stroke',
+                                   'color', 'fill-opacity', 'stroke-opacity',
+                                   'opacity')
+
+        # elements by id, targets of 'use' references
+        self._id_map = {}
+
+        # flattened 'use' targets
+        # {(id, scale_octave, inherited_attribs): [(color, path), ..]}
+        self._instances = {}
+        self._instancing = set()
 
 
     def parse(self, svgstring, force_dpi=None):
-        """ Parse a SVG document.
+        """ Parse a SVG document, either a string or a binary file, which
+        is fed to the XML parser as it is read.
 
         This traverses through the document tree and collects all path
         data and converts it to polylines of the requested tolerance.
@@ -137,6 +157,7 @@ class SVGReader:
         """
         self.px2mm = None
         self.boundarys = {}
+        self.rasters = []
 
         vb_x = None
         vb_y = None
@@ -144,13 +165,26 @@ class SVGReader:
         vb_h = None
 
         # parse xml
-        svgRootElement = ET.fromstring(svgstring)
+        if hasattr(svgstring, 'read'):
+            svgRootElement, svghead = self._parse_file(svgstring)
+        else:
+            svgRootElement = ET.fromstring(svgstring)
+            svghead = svgstring[0:400]
         tagName = self._tagReader._get_tag(svgRootElement)
 
         if tagName != 'svg':
             log.error("Invalid file, no 'svg' tag found.")
             return self.boundarys
 
+        # index elements that may be instanced by 'use'
+        self._id_map = {}
+        self._instances = {}
+        self._instancing = set()
+        for element in svgRootElement.iter():
+            element_id = element.get('id')
+            if element_id:
+                self._id_map[element_id] = element
+
         # 1. Get px2mm from argument
         if force_dpi is not None:
             self.px2mm = 25.4/force_dpi
@@ -212,7 +246,6 @@ class SVGReader:
                     # no physical units in file
                     # we have to interpret user (px) units
                     # 3. For some apps we can make a good guess.
-                    svghead = svgstring[0:400]
                     if 'Inkscape' in svghead:
                         self.px2mm *= 25.4/90.0
                         log.info("SVG exported with Inkscape -> 90dpi.")
@@ -279,30 +312,41 @@ class SVGReader:
         parse_results = {'boundarys':self.boundarys, 'dpi':round(25.4/self.px2mm)}
         if self.lasertags:
             parse_results['lasertags'] = self.lasertags
+        if self.rasters:
+            parse_results['rasters'] = self.rasters
 
         return parse_results
 
 
 
-    def parse_children(self, domNode, parentNode):
+    def _parse_file(self, fp, chunk_size=65536):
+        """Returns the root element and the head of a SVG file."""
+        parser = ET.XMLParser()
+        head = b''
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            if len(head) < 400:
+                head += chunk[:400-len(head)]
+            parser.feed(chunk)
+        return parser.close(), head.decode('utf-8', 'replace')
+
+
+    def parse_children(self, domNode, parentNode, collect=None):
+        """Recursively parse the children of domNode.
+
+        Paths end up in self.boundarys in mm units. If collect is a list
+        (color, path) tuples are appended to it instead and the vertices are
+        left in the world coordinates of parentNode, this is used to
+        flatten 'use' targets.
+        """
         for child in domNode:
             # log.debug("considering tag: " + child.tag)
             if self._tagReader.has_handler(child):
                 # 1. setup a new node
                 # and inherit from parent
-                node = {
-                    'paths': [],
-                    'xform': [1,0,0,1,0,0],
-                    'xformToWorld': parentNode['xformToWorld'],
-                    'display': parentNode.get('display'),
-                    'visibility': parentNode.get('visibility'),
-                    'fill': parentNode.get('fill'),
-                    'stroke': parentNode.get('stroke'),
-                    'color': parentNode.get('color'),
-                    'fill-opacity': parentNode.get('fill-opacity'),
-                    'stroke-opacity': parentNode.get('stroke-opacity'),
-                    'opacity': parentNode.get('opacity')
-                }
+                node = self._inherit_node(parentNode)
 
                 # 2. parse child
                 # with current attributes and transformation
@@ -311,24 +355,106 @@ class SVGReader:
                 # 3. compile boundarys + conversions
                 for path in node['paths']:
                     if path:  # skip if empty subpath
-                        # 3a.) convert to world coordinates and then to mm units
+                        # 3a.) convert to world coordinates
                         for vert in path:
                             # print isinstance(vert[0],float) and isinstance(vert[1],float)
                             matrixApply(node['xformToWorld'], vert)
-                            vertexScale(vert, self.px2mm)
                         # 3b.) sort output by color
-                        hexcolor = node['stroke']
-                        if hexcolor in self.boundarys:
-                            self.boundarys[hexcolor].append(path)
-                        else:
-                            self.boundarys[hexcolor] = [path]
+                        self._add_path(node['stroke'], path, collect)
+                # instanced paths are already in world coordinates
+                for hexcolor, path in node.get('colored_paths', ()):
+                    self._add_path(hexcolor, path, collect)
 
                 # 4. any lasertags (cut settings)?
                 if 'lasertags' in node:
                     self.lasertags.extend(node['lasertags'])
 
                 # recursive call
-                self.parse_children(child, node)
+                if self._tagReader._get_tag(child) not in self.ignore_tags:
+                    self.parse_children(child, node, collect)
+
+
+    def instantiate(self, href, node):
+        """Flatten the element referenced by a 'use' tag.
+
+        The target is flattened once for every scale octave and inherited
+        style and the resulting vertices are reused for all the instances
+        sharing them. Rounding the scale up to the next power of two
+        tessellates at least as fine as any of these instances need, any
+        other scale gets flattened again.
+
+        Returns a list of (color, path) tuples in the world coordinates of
+        node.
+        """
+        element = self._id_map.get(href)
+        if element is None:
+            log.warn("'use' references unknown id '%s', ignored" % href)
+            return []
+        if href in self._instancing:
+            log.error("circular 'use' reference to '%s', ignored" % href)
+            return []
+
+        scale = matrixExtractScale(node['xformToWorld'])
+        octave = 0
+        if scale > 0:
+            octave = math.ceil(math.log(scale, 2))
+        inherited = tuple(node.get(attr) for attr in self._inherited_attribs)
+        key = (href, octave, inherited)
+        template = self._instances.get(key)
+        if template is None:
+            bucket = 2.0**octave
+            root = dict(zip(self._inherited_attribs, inherited))
+            root['xformToWorld'] = [bucket,0,0,bucket,0,0]
+            template = []
+            self._instancing.add(href)
+            try:
+                if self._tagReader._get_tag(element) == 'symbol':
+                    # only the content of a symbol is rendered
+                    symbolNode = self._inherit_node(root)
+                    self._tagReader.read_tag(element, symbolNode)
+                    self.parse_children(element, symbolNode, template)
+                else:
+                    self.parse_children([element], root, template)
+            finally:
+                self._instancing.discard(href)
+            self._instances[key] = template
+
+        # from the scaled template space to the world of the instance
+        xform = matrixMult(node['xformToWorld'],
+                           [2.0**-octave,0,0,2.0**-octave,0,0])
+        colored_paths = []
+        for hexcolor, path in template:
+            instance_path = []
+            for vert in path:
+                vert = [vert[0], vert[1]]
+                matrixApply(xform, vert)
+                instance_path.append(vert)
+            colored_paths.append((hexcolor, instance_path))
+        return colored_paths
+
+
+    def _inherit_node(self, parentNode):
+        node = {
+            'paths': [],
+            'xform': [1,0,0,1,0,0],
+            'xformToWorld': parentNode['xformToWorld']
+        }
+        for attr in self._inherited_attribs:
+            node[attr] = parentNode.get(attr)
+        return node
+
+
+    def _add_path(self, hexcolor, path, collect=None):
+        if collect is not None:
+            collect.append((hexcolor, path))
+            return
+        # convert to mm units
+        for vert in path:
+            vertexScale(vert, self.px2mm)
+        if hexcolor in self.boundarys:
+            self.boundarys[hexcolor].append(path)
+        else:
+            self.boundarys[hexcolor] = [path]
 
 
 
@@ -3,7 +3,7 @@ __author__ = 'Stefan Hechenberger <stefan@nortd.com>'
 import re
 import logging
 
-from .utilities import matrixMult
+from .utilities import matrixMult, matrixApply
 
 from .svg_attribute_reader import SVGAttributeReader
 from .svg_path_reader import SVGPathReader
@@ -14,6 +14,7 @@ log = logging.getLogger("svg_reader")
 class SVGTagReader:
 
     def __init__(self, svgreader):
+        self.svgreader = svgreader
 
         # init helper for attribute reading
         self._attribReader = SVGAttributeReader(svgreader)
@@ -31,6 +32,8 @@ class SVGTagReader:
             'ellipse': self.ellipse,
             'image': self.image,
             'defs': self.defs,
+            'symbol': self.symbol,
+            'use': self.use,
             'style': self.style,
             'text': True  # text is special, see read_tag func
         }
@@ -190,16 +193,63 @@ class SVGTagReader:
 
 
     def image(self, node):
-        # not supported
+        # http://www.w3.org/TR/SVG11/struct.html#ImageElement
         # has transform and style attributes
-        log.warn("'image' tag is not supported, ignored")
+        # only embedded PNG images are supported, they are not rotated
+        href = node.get('href') or ''
+        if not href.startswith('data:image/png;base64,'):
+            log.warn("'image' tag without embedded PNG data, ignored")
+            return
+        if self.svgreader._instancing:
+            log.warn("'image' tag in a 'use' target, ignored")
+            return
+        xform = node['xformToWorld']
+        if xform[1] or xform[2]:
+            log.warn("'image' tag is rotated or skewed, placed unrotated")
+        x = node.get('x') or 0.0
+        y = node.get('y') or 0.0
+        w = node.get('width') or 0.0
+        h = node.get('height') or 0.0
+        corner1 = [x, y]
+        corner2 = [x + w, y + h]
+        matrixApply(xform, corner1)
+        matrixApply(xform, corner2)
+        px2mm = self.svgreader.px2mm
+        x1, x2 = sorted((corner1[0]*px2mm, corner2[0]*px2mm))
+        y1, y2 = sorted((corner1[1]*px2mm, corner2[1]*px2mm))
+        if x2 > x1 and y2 > y1:
+            self.svgreader.rasters.append({'image': href, 'pos': [x1, y1],
+                                           'size': [x2 - x1, y2 - y1]})
 
 
     def defs(self, node):
-        # not supported
         # http://www.w3.org/TR/SVG11/struct.html#Head
         # has transform and style attributes
-        log.warn("'defs' tag is not supported, ignored")
+        # content is only rendered when referenced by a 'use' tag
+        pass
+
+
+    def symbol(self, node):
+        # http://www.w3.org/TR/SVG11/struct.html#SymbolElement
+        # has style attributes, viewBox is not supported
+        # content is only rendered when referenced by a 'use' tag
+        pass
+
+
+    def use(self, node):
+        # http://www.w3.org/TR/SVG11/struct.html#UseElement
+        # has transform and style attributes
+        # x, y are an additional translation applied after transform
+        x = node.get('x') or 0.0
+        y = node.get('y') or 0.0
+        if x or y:
+            node['xformToWorld'] = matrixMult(node['xformToWorld'],
+                                              [1,0,0,1,x,y])
+        href = node.get('href')
+        if href:
+            node['colored_paths'] = self.svgreader.instantiate(href, node)
+        else:
+            log.warn("'use' tag without reference, ignored")
 
     def style(self, node):
         # not supported: embedded style sheets
@@ -1,3 +1,4 @@
+import math
 import re
 
 
@@ -31,6 +32,16 @@ def matrixMult(mA, mB):
                      mA[1]*mB[4] + mA[3]*mB[5] + mA[5] ]
 
 
+def matrixExtractScale(mat):
+    """Extract the absolute scale of the dominant axis from a matrix."""
+    sx = math.sqrt(mat[0]*mat[0] + mat[1]*mat[1])
+    sy = math.sqrt(mat[2]*mat[2] + mat[3]*mat[3])
+    if sx > sy:
+        return sx
+    else:
+        return sy
+
+
 def matrixApply(mat, vec):
     vec0 = mat[0]*vec[0] + mat[2]*vec[1] + mat[4]
     vec[1] = mat[1]*vec[0] + mat[3]*vec[1] + mat[5]
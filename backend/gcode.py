@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- G-code generation
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+G-code Emitter
+--------------
+
+Turns a job, the ``boundarys`` produced by the `filereaders` sorted by color
+plus a list of passes, into the `GCODE` the firmware understands. This is the
+same output ``DataHandler.getGcode`` builds in the frontend, but produced
+lazily one line at a time so it can be fed to
+`SerialManager.queue_gcode_source` without ever holding the whole program.
+
+A pass is a mapping with the keys ``colors``, ``feedrate`` and
+``intensity``, as found in the ``.lsa`` job files, and optionally ``fill``
+or ``raster``.
+"""
+
+import json
+import logging
+import math
+
+from . import jobfile, raster
+
+log = logging.getLogger(__name__)
+
+SEEKRATE = 8000
+"""Feedrate for the seek moves, matches ``max_seek_speed`` of the frontend."""
+NUM_DIGITS = 2
+LINE_SPACING = 0.1
+"""Default distance of raster lines, in mm."""
+MAX_SEGMENT_LENGTH = 5.0
+"""Feed moves longer than this are split, so a pause takes effect sooner."""
+FEEDRATE_MIN = 0.1
+FEEDRATE_MAX = 24000
+
+
+def constrain_feedrate(rate):
+    rate = int(float(rate))
+    if rate < FEEDRATE_MIN:
+        log.warn("Feedrate constrained to %s", FEEDRATE_MIN)
+        rate = FEEDRATE_MIN
+    elif rate > FEEDRATE_MAX:
+        log.warn("Feedrate constrained to %s", FEEDRATE_MAX)
+        rate = FEEDRATE_MAX
+    return rate
+
+
+def constrain_intensity(intensity):
+    """Clamp a 0-100 intensity and map it to the 0-255 range of the firmware."""
+    intensity = int(float(intensity))
+    if intensity < 0:
+        log.warn("Intensity constrained to 0")
+        intensity = 0
+    elif intensity > 100:
+        log.warn("Intensity constrained to 100")
+        intensity = 100
+    return int(intensity * 2.55 + 0.5)
+
+
+def _check_number(pass_, key):
+    try:
+        value = float(pass_.get(key))
+    except (TypeError, ValueError):
+        raise ValueError("%s of pass is not a number" % key)
+    if not math.isfinite(value):
+        raise ValueError("%s of pass is not a number" % key)
+    return value
+
+
+def check_passes(passes):
+    """Raise ValueError unless passes is a list of passes `iter_gcode` can
+    run.
+
+    The G-code is generated while the job is sent, so a malformed pass has
+    to be caught before the job is queued.
+    """
+    if not isinstance(passes, list):
+        raise ValueError("passes is not a list")
+    for pass_ in passes:
+        if not isinstance(pass_, dict):
+            raise ValueError("pass is not an object")
+        colors = pass_.get('colors')
+        if (not isinstance(colors, list) or
+                not all(isinstance(color, str) for color in colors)):
+            raise ValueError("colors of pass is not a list of colors")
+        _check_number(pass_, 'feedrate')
+        _check_number(pass_, 'intensity')
+        if pass_.get('fill'):
+            raster.check_line_spacing(_check_number(pass_, 'fill'))
+        if pass_.get('raster'):
+            bitmap = pass_['raster']
+            if not isinstance(bitmap, dict) or not bitmap.get('image'):
+                raise ValueError("raster of pass without an image")
+            for key in ('pos', 'size'):
+                value = bitmap.get(key)
+                if (not isinstance(value, list) or len(value) != 2 or
+                        not all(isinstance(v, (int, float)) and
+                                math.isfinite(v) for v in value)):
+                    raise ValueError("%s of raster is not a pair of numbers"
+                                     % key)
+            if min(bitmap['size']) <= 0:
+                raise ValueError("size of raster is not positive")
+            line_spacing = LINE_SPACING
+            if 'line_spacing' in bitmap:
+                line_spacing = _check_number(bitmap, 'line_spacing')
+            raster.check_line_spacing(line_spacing, max(bitmap['size']))
+
+
+def segmentize(path, max_length):
+    """Iterate over the vertices of path, splitting long lines.
+
+    Lines longer than max_length are divided into equal parts no longer
+    than max_length. The extra vertices are produced on the fly and never
+    stored.
+    """
+    max_length2 = max_length*max_length
+    x_prev, y_prev = path[0][:2]
+    yield x_prev, y_prev
+    for vertex in path[1:]:
+        x, y = vertex[:2]
+        dx = x - x_prev
+        dy = y - y_prev
+        d2 = dx*dx + dy*dy
+        if d2 > max_length2:
+            n = int(math.ceil(math.sqrt(d2) / max_length))
+            for i in range(1, n):
+                t = i / n
+                yield x_prev + dx*t, y_prev + dy*t
+        yield x, y
+        x_prev = x
+        y_prev = y
+
+
+def load_job(jobdata):
+    """Parse a job in the ``.lsa`` format or the binary format of `jobfile`,
+    returns (passes, paths_by_color)."""
+    if not isinstance(jobdata, str):
+        if jobfile.is_job(jobdata):
+            return jobfile.loads(jobdata)
+        jobdata = jobdata.decode('utf-8')
+    job = json.loads(jobdata)
+    return job.get('passes', []), job.get('paths_by_color', {})
+
+
+def format_number(text):
+    """Strip trailing zeros and a dangling point off a formatted number."""
+    if b'.' in text:
+        text = text.rstrip(b'0').rstrip(b'.')
+        if text == b'-0':
+            text = b'0'
+    return text
+
+
+def iter_gcode(paths_by_color, passes, seekrate=SEEKRATE,
+               num_digits=NUM_DIGITS, max_segment_length=MAX_SEGMENT_LENGTH,
+               compact=True, stats=None):
+    """Generate the `GCODE` of a job, one line as bytes at a time.
+
+    Feed moves are split with `segmentize` unless max_segment_length is
+    ``None``. With compact numbers lose their trailing zeros, axis words
+    repeating the current position are left out and so are feedrate and
+    intensity words that do not change between passes. The firmware only
+    moves on lines with a G0 or G1, so those are always written.
+
+    A pass with a ``fill`` key engraves the area enclosed by the paths of
+    its colors instead of following them, with raster lines ``fill`` mm
+    apart, see `raster.fill_moves`. A pass with a ``raster`` key engraves a
+    bitmap, a mapping with the keys ``image``, ``pos``, ``size`` and
+    optionally ``line_spacing`` and ``mode``, see `raster.bitmap_moves`.
+
+    If given, the stats dictionary is updated with the number of ``bytes``
+    generated and the ``bytes_verbose`` the uncompacted output would have.
+    Its ``pass_offsets`` list gets the byte offset of every pass appended
+    before the first line of the pass is generated.
+    """
+    fmt = ('%.' + str(num_digits) + 'f').encode('ascii')
+    seekrate = int(seekrate)
+    emitted = 0
+    verbose = 0
+    last_x = last_y = None
+
+    def motion_line(motion, x, y, extra=b''):
+        # returns the line moving to x, y, None if already there
+        nonlocal last_x, last_y, verbose
+        x = fmt % x
+        y = fmt % y
+        verbose += len(x) + len(y) + len(extra) + 5
+        if not compact:
+            return motion + b'X' + x + b'Y' + y + extra
+        x = format_number(x)
+        y = format_number(y)
+        line = motion
+        if x != last_x:
+            line += b'X' + x
+        if y != last_y:
+            line += b'Y' + y
+        last_x = x
+        last_y = y
+        if len(line) == 2:
+            return None
+        return line + extra
+
+    # header
+    for line in (b'G90', b'M80', b'G0F%d' % seekrate):
+        emitted += len(line) + 1
+        yield line
+    verbose = emitted
+    last_feedrate = last_intensity = None
+    # passes
+    for pass_ in passes:
+        if stats is not None:
+            stats.setdefault('pass_offsets', []).append(emitted)
+        feedrate = constrain_feedrate(pass_['feedrate'])
+        intensity = b'%d' % constrain_intensity(pass_['intensity'])
+        feedword = str(feedrate).encode('ascii')
+        verbose += len(feedword) + len(intensity) + 6
+        if not compact or feedword != last_feedrate:
+            emitted += len(feedword) + 4
+            yield b'G1F' + feedword
+        if not compact or intensity != last_intensity:
+            emitted += len(intensity) + 2
+            yield b'S' + intensity
+        last_feedrate = feedword
+        last_intensity = intensity
+        if pass_.get('fill') or pass_.get('raster'):
+            overscan = raster.overscan_for(feedrate)
+            if pass_.get('raster'):
+                bitmap = pass_['raster']
+                moves = raster.bitmap_moves(
+                    bitmap['image'], bitmap['pos'], bitmap['size'],
+                    float(bitmap.get('line_spacing', LINE_SPACING)), overscan,
+                    bitmap.get('mode', 'dither'))
+            else:
+                paths = [path for color in pass_['colors']
+                         for path in paths_by_color.get(color, ())]
+                moves = raster.fill_moves(paths, float(pass_['fill']),
+                                          overscan)
+            # the laser is switched with an S word on the move it applies to
+            full_power = constrain_intensity(pass_['intensity'])
+            for x, y, power in moves:
+                if power is None:
+                    line = motion_line(b'G0', x, y)
+                else:
+                    power = b'%d' % int(full_power*power + 0.5)
+                    if power != last_intensity:
+                        line = motion_line(b'G1', x, y, b'S' + power)
+                        if line is not None:
+                            last_intensity = power
+                    else:
+                        line = motion_line(b'G1', x, y)
+                if line is not None:
+                    emitted += len(line) + 1
+                    yield line
+            continue
+        for color in pass_['colors']:
+            for path in paths_by_color.get(color, ()):
+                if not path:
+                    continue
+                if max_segment_length:
+                    vertices = segmentize(path, max_segment_length)
+                else:
+                    vertices = (vertex[:2] for vertex in path)
+                motion = b'G0'
+                for x, y in vertices:
+                    line = motion_line(motion, x, y)
+                    motion = b'G1'
+                    if line is not None:
+                        emitted += len(line) + 1
+                        yield line
+    # footer
+    for line in (b'M81', b'S0', b'G0X0Y0F%d' % seekrate):
+        emitted += len(line) + 1
+        verbose += len(line) + 1
+        yield line
+    if verbose:
+        log.info("Generated %d bytes of G-code, saved %d bytes (%.1f%%)",
+                 emitted, verbose - emitted, 100.0*(verbose - emitted)/verbose)
+    if stats is not None:
+        stats['bytes'] = emitted
+        stats['bytes_verbose'] = verbose
+
+
+def estimate_size(paths_by_color, passes, num_digits=NUM_DIGITS,
+                  compact=True):
+    """Rough number of bytes `iter_gcode` produces, for progress reporting."""
+    vertices = 0
+    for pass_ in passes:
+        for color in pass_['colors']:
+            for path in paths_by_color.get(color, ()):
+                vertices += len(path)
+    # G1X123.45Y123.45 and a newline, about a digit less when compact
+    line_size = 2*num_digits + 12
+    if compact:
+        line_size -= 2
+    return vertices * line_size + 40*(len(passes) + 1)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- binary job files
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Binary Job Files
+----------------
+
+A compact alternative to the ``.lsa`` JSON job format. All values are little
+endian. A job file starts with a header:
+
+- the magic ``LSAB``
+- the format version, an unsigned short
+- flags, an unsigned short, see `FLAG_ZLIB` and `FLAG_QUANTIZED`
+- the size of the metadata, an unsigned int
+- the metadata, JSON encoded, padded with spaces to a multiple of 4 bytes
+
+The metadata holds the passes and, for every color, the number of paths
+and vertices and the offset and size of its data block, and possibly other
+entries, see `dumps`. A block is an
+array of ``paths + 1`` unsigned ints, the index of the first vertex of every
+path plus the total, followed by the x, y coordinates of all vertices,
+either float32 or int32 in units of 1/`QUANTIZE_SCALE` mm. Blocks start at
+offsets that are multiples of 4 and may be zlib compressed individually, so
+any color can be read without touching the others.
+"""
+
+import array
+import json
+import struct
+import sys
+import zlib
+
+MAGIC = b'LSAB'
+VERSION = 1
+FLAG_ZLIB = 1
+"""Color blocks are zlib compressed."""
+FLAG_QUANTIZED = 2
+"""Coordinates are stored as int32, see `QUANTIZE_SCALE`."""
+QUANTIZE_SCALE = 1000.0
+
+_header = struct.Struct('<4sHHI')
+
+
+def is_job(data):
+    """Tell if data, bytes, starts like a binary job file."""
+    return data[:4] == MAGIC
+
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def dumps(passes, paths_by_color, compress=False, quantize=False, meta=None):
+    """Encode a job, returns bytes.
+
+    meta is a dictionary of more entries to store in the metadata.
+    """
+    flags = (FLAG_ZLIB if compress else 0) | (FLAG_QUANTIZED if quantize else 0)
+    colors = []
+    blocks = []
+    offset = 0
+    for color, paths in paths_by_color.items():
+        starts = array.array('I', [0])
+        coords = array.array('i' if quantize else 'f')
+        for path in paths:
+            for vertex in path:
+                if quantize:
+                    coords.append(int(round(vertex[0]*QUANTIZE_SCALE)))
+                    coords.append(int(round(vertex[1]*QUANTIZE_SCALE)))
+                else:
+                    coords.append(vertex[0])
+                    coords.append(vertex[1])
+            starts.append(len(coords) // 2)
+        vertices = len(coords) // 2
+        block = (_to_little_endian(starts).tobytes() +
+                 _to_little_endian(coords).tobytes())
+        if compress:
+            block = zlib.compress(block)
+        padding = -len(block) % 4
+        colors.append({'color': color, 'paths': len(paths),
+                       'vertices': vertices, 'offset': offset,
+                       'size': len(block)})
+        blocks.append(block + b'\0'*padding)
+        offset += len(block) + padding
+    meta = dict(meta or {}, passes=passes, colors=colors)
+    meta = json.dumps(meta).encode('utf-8')
+    meta += b' '*(-len(meta) % 4)
+    return (_header.pack(MAGIC, VERSION, flags, len(meta)) + meta +
+            b''.join(blocks))
+
+
+def read_header(data):
+    """Returns the flags, the metadata and the offset of the first block."""
+    if len(data) < _header.size:
+        raise ValueError("truncated job file")
+    magic, version, flags, meta_size = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a binary job file")
+    if version > VERSION:
+        raise ValueError("unsupported job file version %d" % version)
+    start = _header.size
+    if len(data) < start + meta_size:
+        raise ValueError("truncated job file")
+    meta = json.loads(bytes(data[start:start + meta_size]).decode('utf-8'))
+    return flags, meta, start + meta_size
+
+
+def read_color(data, flags, entry, base):
+    """Decode the paths of one color entry of the metadata."""
+    block = data[base + entry['offset']:base + entry['offset'] + entry['size']]
+    if len(block) < entry['size']:
+        raise ValueError("truncated job file")
+    if flags & FLAG_ZLIB:
+        try:
+            block = zlib.decompress(block)
+        except zlib.error as e:
+            raise ValueError("corrupt job file: %s" % e)
+    num_starts = entry['paths'] + 1
+    if len(block) < 4*num_starts + 8*entry['vertices']:
+        raise ValueError("truncated color block %s" % entry['color'])
+    starts = array.array('I')
+    starts.frombytes(bytes(block[:4*num_starts]))
+    coords = array.array('i' if flags & FLAG_QUANTIZED else 'f')
+    coords.frombytes(bytes(block[4*num_starts:4*num_starts +
+                                 8*entry['vertices']]))
+    if sys.byteorder != 'little':
+        starts.byteswap()
+        coords.byteswap()
+    if starts[-1] != entry['vertices']:
+        raise ValueError("corrupt color block %s" % entry['color'])
+    if flags & FLAG_QUANTIZED:
+        coords = [value / QUANTIZE_SCALE for value in coords]
+    else:
+        coords = coords.tolist()
+    paths = []
+    for i in range(entry['paths']):
+        path = coords[2*starts[i]:2*starts[i+1]]
+        paths.append([path[k:k+2] for k in range(0, len(path), 2)])
+    return paths
+
+
+def loads(data):
+    """Decode a job from bytes or a memory map, returns (passes,
+    paths_by_color)."""
+    flags, meta, base = read_header(data)
+    paths_by_color = {}
+    for entry in meta['colors']:
+        paths_by_color[entry['color']] = read_color(data, flags, entry, base)
+    return meta['passes'], paths_by_color
+
+
+def from_lsa(jobdata, compress=False, quantize=False):
+    """Convert a ``.lsa`` JSON job to the binary format."""
+    job = json.loads(jobdata)
+    return dumps(job.get('passes', []), job.get('paths_by_color', {}),
+                 compress, quantize)
+
+
+def to_lsa(data):
+    """Convert a binary job to the ``.lsa`` JSON format.
+
+    Coordinates are written with 9 significant digits, the fewest that
+    map back to the same float32 in every case.
+    """
+    passes, paths_by_color = loads(data)
+    for paths in paths_by_color.values():
+        for path in paths:
+            for vertex in path:
+                vertex[0] = float('%.9g' % vertex[0])
+                vertex[1] = float('%.9g' % vertex[1])
+    return json.dumps({'passes': passes, 'paths_by_color': paths_by_color})
+
+
+def main(argv):
+    """Convert between job formats: jobfile.py [-z] [-q] input output
+
+    The output format is the opposite of the input format, -z compresses
+    and -q quantizes the binary output.
+    """
+    args = [arg for arg in argv if not arg.startswith('-')]
+    if len(args) != 2:
+        print(main.__doc__)
+        return 1
+    with open(args[0], 'rb') as fp:
+        data = fp.read()
+    if is_job(data):
+        output = to_lsa(data).encode('utf-8')
+    else:
+        output = from_lsa(data.decode('utf-8'), '-z' in argv, '-q' in argv)
+    with open(args[1], 'wb') as fp:
+        fp.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
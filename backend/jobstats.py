@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- job statistics
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Job Statistics
+--------------
+
+Per-color statistics of a job, bounding box, cut and seek length and vertex
+count, an estimate of the run time and a small thumbnail image. These are
+computed once and cached next to the job, so the queue and library can show
+them without loading the job.
+"""
+
+import json
+import logging
+import math
+import os
+import struct
+import zlib
+
+from .gcode import SEEKRATE, load_job
+from .planner import estimate_job
+
+log = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 128
+"""Width and height of the thumbnails, in pixels."""
+
+
+def compute_stats(passes, paths_by_color, seekrate=SEEKRATE):
+    """Compute the statistics of a job.
+
+    Returns a dictionary with the keys ``bbox`` ([xmin, ymin, xmax, ymax] or
+    None for an empty job), ``cut_length``, ``seek_length``, ``vertices`` and
+    ``paths`` for the whole job and the same keys per color in ``colors``.
+    Seek lengths are measured from the origin through the paths of a color.
+    ``time`` is the estimated run time in seconds of the passes and
+    ``pass_times`` that of every pass, see `planner.estimate_job`.
+    """
+    colors = {}
+    for color, paths in paths_by_color.items():
+        xmin = ymin = float('inf')
+        xmax = ymax = float('-inf')
+        cut = seek = 0.0
+        vertices = 0
+        x_prev = y_prev = 0.0
+        for path in paths:
+            if not path:
+                continue
+            vertices += len(path)
+            x, y = path[0][:2]
+            seek += math.hypot(x - x_prev, y - y_prev)
+            x_prev = x
+            y_prev = y
+            for vertex in path:
+                x, y = vertex[:2]
+                cut += math.hypot(x - x_prev, y - y_prev)
+                x_prev = x
+                y_prev = y
+                if x < xmin: xmin = x
+                if x > xmax: xmax = x
+                if y < ymin: ymin = y
+                if y > ymax: ymax = y
+        bbox = [xmin, ymin, xmax, ymax] if vertices else None
+        colors[color] = {'bbox': bbox,
+                         'cut_length': cut, 'seek_length': seek,
+                         'vertices': vertices, 'paths': len(paths)}
+    stats = {'colors': colors,
+             'bbox': merge_bboxes(c['bbox'] for c in colors.values()),
+             'cut_length': sum(c['cut_length'] for c in colors.values()),
+             'seek_length': sum(c['seek_length'] for c in colors.values()),
+             'vertices': sum(c['vertices'] for c in colors.values()),
+             'paths': sum(c['paths'] for c in colors.values())}
+    estimate = estimate_job(paths_by_color, passes, seekrate)
+    stats['time'] = estimate['time']
+    stats['pass_times'] = estimate['pass_times']
+    return stats
+
+
+def merge_bboxes(bboxes):
+    merged = None
+    for bbox in bboxes:
+        if bbox is None:
+            continue
+        if merged is None:
+            merged = list(bbox)
+        else:
+            merged = [min(merged[0], bbox[0]), min(merged[1], bbox[1]),
+                      max(merged[2], bbox[2]), max(merged[3], bbox[3])]
+    return merged
+
+
+def render_thumbnail(paths_by_color, bbox, size=THUMBNAIL_SIZE):
+    """Render the paths into a grayscale PNG of size by size pixels.
+
+    The job is scaled to fit, keeping its aspect ratio. Returns the PNG as
+    bytes.
+    """
+    pixels = bytearray(b'\xff'*(size*size))
+    if bbox is not None:
+        margin = 2
+        extent = max(bbox[2] - bbox[0], bbox[3] - bbox[1]) or 1.0
+        scale = (size - 2*margin - 1) / extent
+        # center the job
+        inner = size - 2*margin - 1
+        x_offset = margin + 0.5*(inner - (bbox[2] - bbox[0])*scale)
+        y_offset = margin + 0.5*(inner - (bbox[3] - bbox[1])*scale)
+        for paths in paths_by_color.values():
+            for path in paths:
+                points = [((vertex[0] - bbox[0])*scale + x_offset,
+                           (vertex[1] - bbox[1])*scale + y_offset)
+                          for vertex in path]
+                for (x0, y0), (x1, y1) in zip(points, points[1:] or points):
+                    _draw_line(pixels, size, x0, y0, x1, y1)
+    return encode_png(size, size, pixels)
+
+
+def _draw_line(pixels, size, x0, y0, x1, y1):
+    steps = int(max(abs(x1 - x0), abs(y1 - y0))) + 1
+    for i in range(steps + 1):
+        t = i / steps
+        x = int(x0 + (x1 - x0)*t + 0.5)
+        y = int(y0 + (y1 - y0)*t + 0.5)
+        if 0 <= x < size and 0 <= y < size:
+            pixels[y*size + x] = 0
+
+
+def encode_png(width, height, pixels):
+    """Encode 8 bit grayscale pixels, row after row, as a PNG."""
+    def chunk(ctype, data):
+        return (struct.pack('>I', len(data)) + ctype + data +
+                struct.pack('>I', zlib.crc32(ctype + data) & 0xffffffff))
+    raw = b''.join(b'\0' + bytes(pixels[y*width:(y + 1)*width])
+                   for y in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0,
+                                       0)) +
+            chunk(b'IDAT', zlib.compress(raw, 9)) +
+            chunk(b'IEND', b''))
+
+
+class StatsCache:
+    """Statistics and thumbnails of the jobs of a directory.
+
+    They are stored in cache_dir as ``<name>.json`` and ``<name>.png`` and
+    recomputed when the job file is newer. Stats of a starred job are found
+    by its plain name. The stats computed are recorded in catalog, a
+    `catalog.JobCatalog` of job_dir, if given.
+    """
+
+    def __init__(self, job_dir, cache_dir, catalog=None):
+        self.job_dir = job_dir
+        self.cache_dir = cache_dir
+        self.catalog = catalog
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+
+    def _paths(self, name):
+        job_file = os.path.join(self.job_dir, name)
+        if not os.path.exists(job_file):
+            # starred jobs are renamed
+            job_file += '.starred'
+        return (job_file,
+                os.path.join(self.cache_dir, name + '.json'),
+                os.path.join(self.cache_dir, name + '.png'))
+
+
+    def update(self, name, data=None):
+        """Compute and store the statistics and thumbnail of a job."""
+        job_file, stats_file, thumbnail_file = self._paths(name)
+        if data is None:
+            with open(job_file, 'rb') as fp:
+                data = fp.read()
+        passes, paths_by_color = load_job(data)
+        stats = compute_stats(passes, paths_by_color)
+        with open(stats_file, 'w') as fp:
+            json.dump(stats, fp)
+        with open(thumbnail_file, 'wb') as fp:
+            fp.write(render_thumbnail(paths_by_color, stats['bbox']))
+        if self.catalog is not None:
+            self.catalog.set_stats(name, stats)
+        log.debug("Stats of job %s cached", name)
+        return stats
+
+
+    def _fresh(self, name):
+        job_file, stats_file, thumbnail_file = self._paths(name)
+        if not os.path.isfile(job_file):
+            raise IOError("no such job: %s" % name)
+        try:
+            return (os.path.getmtime(stats_file) >= os.path.getmtime(job_file)
+                    and os.path.exists(thumbnail_file))
+        except OSError:
+            return False
+
+
+    def stats(self, name):
+        """Returns the statistics of a job, computing them if needed."""
+        if not self._fresh(name):
+            return self.update(name)
+        with open(self._paths(name)[1]) as fp:
+            return json.load(fp)
+
+
+    def thumbnail(self, name):
+        """Returns the file name of the thumbnail of a job."""
+        if not self._fresh(name):
+            self.update(name)
+        return self._paths(name)[2]
+
+
+    def remove(self, name):
+        for filename in self._paths(name)[1:]:
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- run time estimation
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Run Time Estimation
+-------------------
+
+A model of the motion planner of LasaurGrbl, see ``firmware/src/planner.c``,
+to estimate how long the machine takes to run a job. Moves are turned into
+blocks the way ``planner_line`` does it, junction speeds are limited by the
+junction deviation and every block runs a trapezoidal speed profile.
+
+The firmware plans with a look-ahead of `BLOCK_BUFFER_SIZE` blocks, the
+last one in the buffer always ending at standstill. Instead of replaying
+the ring buffer, the entry speeds are found with one backward and one
+forward pass over all blocks: the entry speed of a block planned with
+the full look-ahead is further limited by having to stop at the end of
+the blocks in the buffer, which only depends on their total length.
+"""
+
+import array
+import itertools
+import math
+
+from .gcode import format_number, iter_gcode
+
+ACCELERATION = 1800000.0
+"""``CONFIG_ACCELERATION`` of the firmware, in mm/min^2."""
+JUNCTION_DEVIATION = 0.006
+"""``CONFIG_JUNCTION_DEVIATION`` of the firmware, in mm."""
+FEEDRATE = 8000.0
+SEEKRATE = 8000.0
+"""Default feedrate and seekrate of the firmware, in mm/min."""
+STEPS_PER_MM = (88.88888888, 90.90909090, 33.33333333)
+"""Steps per mm of the X, Y and Z axes."""
+ORIGIN_OFFSET = (5.0, 5.0, 0.0)
+"""Offset of the table origin from home, the default of the G54 and G55
+coordinate systems, in mm."""
+ZERO_SPEED = 0.0
+MINIMUM_SPEED = 1600 / STEPS_PER_MM[0]
+"""The steppers never run slower than ``MINIMUM_STEPS_PER_MINUTE``, in
+mm/min."""
+BLOCK_BUFFER_SIZE = 16
+LOOKAHEAD = BLOCK_BUFFER_SIZE - 2
+"""Number of blocks planned ahead when a block is started, the ring buffer
+keeps one slot free and the block running is not replanned."""
+MM_PER_INCH = 25.4
+
+
+def parse_words(line):
+    """Split a line of `GCODE` into a list of (letter, value) tuples.
+
+    line may be bytes or str. Raises ValueError for malformed numbers.
+    """
+    if isinstance(line, bytes):
+        line = line.decode('ascii', 'replace')
+    line = ''.join(line.split('%', 1)[0].split(';', 1)[0].split()).upper()
+    words = []
+    i = 0
+    length = len(line)
+    while i < length:
+        letter = line[i]
+        j = i + 1
+        while j < length and (line[j].isdigit() or line[j] in '.-+'):
+            j += 1
+        words.append((letter, float(line[i+1:j])))
+        i = j
+    return words
+
+
+class GcodeState:
+    """Modal state of the `GCODE` interpreter of the firmware, see
+    ``gcode.c``.
+
+    Lengths and rates are kept in mm whatever the units of the G-code.
+    """
+
+    def __init__(self):
+        self.absolute_mode = True
+        self.inches_mode = False
+        self.seek_mode = True
+        self.feed_rate = FEEDRATE
+        self.seek_rate = SEEKRATE
+        self.intensity = 0.0
+        self.air_assist = False
+        self.aux1_assist = False
+        self.target = [0.0, 0.0, 0.0]
+        """Position in the current coordinate system."""
+        self.offsets = [list(ORIGIN_OFFSET), list(ORIGIN_OFFSET)]
+        self.offselect = 0
+
+
+    def execute(self, line):
+        """Interpret a line like ``gcode_execute_line``.
+
+        Returns None or, for a line moving the machine, a tuple of the kind
+        of move, 'seek', 'feed' or 'homing', the target in machine
+        coordinates and the rate. Raises ValueError for malformed numbers.
+        """
+        words = parse_words(line)
+        action = None
+        for letter, value in words:
+            if letter == 'G':
+                value = int(value)
+                if value == 0:
+                    self.seek_mode = True
+                    action = 'seek'
+                elif value == 1:
+                    self.seek_mode = False
+                    action = 'feed'
+                elif value == 10:
+                    action = 'offset'
+                elif value == 20:
+                    self.inches_mode = True
+                elif value == 21:
+                    self.inches_mode = False
+                elif value == 30:
+                    action = 'homing'
+                elif value in (54, 55):
+                    self.offselect = value - 54
+                elif value == 90:
+                    self.absolute_mode = True
+                elif value == 91:
+                    self.absolute_mode = False
+            elif letter == 'M':
+                value = int(value)
+                if value in (80, 81):
+                    self.air_assist = value == 80
+                elif value in (82, 83):
+                    self.aux1_assist = value == 82
+        target = list(self.target)
+        got_line = False
+        cs = l = 0
+        for letter, value in words:
+            if letter == 'P':
+                cs = int(value)
+                continue
+            elif letter == 'L':
+                l = int(value)
+                continue
+            elif letter == 'S':
+                self.intensity = value
+                continue
+            if self.inches_mode:
+                value *= MM_PER_INCH
+            if letter == 'F' and value > 0:
+                if self.seek_mode:
+                    self.seek_rate = value
+                else:
+                    self.feed_rate = value
+            elif letter in 'XYZ':
+                axis = 'XYZ'.index(letter)
+                if self.absolute_mode:
+                    target[axis] = value
+                else:
+                    target[axis] += value
+                got_line = True
+        move = None
+        offset = self.offsets[self.offselect]
+        if action in ('seek', 'feed') and got_line:
+            move = (action, [target[i] + offset[i] for i in range(3)],
+                    self.seek_rate if action == 'seek' else self.feed_rate)
+        elif action == 'homing':
+            self.offselect = 0
+            target = [0.0, 0.0, 0.0]
+            move = (action, list(self.offsets[0]), self.seek_rate)
+        elif action == 'offset' and cs in (0, 1):
+            if l == 2:
+                self.offsets[cs] = target
+                target = [self.target[i] + offset[i] - target[i]
+                          for i in range(3)]
+            elif l == 20:
+                self.offsets[cs] = [self.target[i] + offset[i]
+                                    for i in range(3)]
+                target = [0.0, 0.0, 0.0]
+        self.target = target
+        return move
+
+
+    def prefix(self):
+        """Returns the lines bringing the firmware into this state.
+
+        The head is moved to the current position with the laser off.
+        """
+        def number(value):
+            return format_number(b'%.3f' % value)
+        lines = [b'G21', b'G90']
+        for cs, offset in enumerate(self.offsets):
+            if offset != list(ORIGIN_OFFSET):
+                lines.append(b'G10L2P%dX%sY%sZ%s' % (cs, number(offset[0]),
+                                                     number(offset[1]),
+                                                     number(offset[2])))
+        lines.append(b'G54' if self.offselect == 0 else b'G55')
+        lines.append(b'M80' if self.air_assist else b'M81')
+        lines.append(b'M82' if self.aux1_assist else b'M83')
+        lines.append(b'G1F' + number(self.feed_rate))
+        lines.append(b'G0F' + number(self.seek_rate))
+        move = b'G0X%sY%s' % (number(self.target[0]), number(self.target[1]))
+        if self.target[2]:
+            move += b'Z' + number(self.target[2])
+        lines.append(move)
+        lines.append(b'S' + number(self.intensity))
+        if not self.absolute_mode:
+            lines.append(b'G91')
+        if self.inches_mode:
+            lines.append(b'G20')
+        if not self.seek_mode:
+            # F words apply to the last motion mode
+            lines.append(b'G1')
+        return lines
+
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.__dict__.update(data)
+        return state
+
+
+
+class Planner:
+    """Collects the moves of a job and estimates their duration.
+
+    Moves are added with `line` or as `GCODE` with `execute`, then
+    `plan` computes the time at which every block ends. Blocks can be added
+    and planned as they come, as a job is streamed.
+    """
+
+    def __init__(self, acceleration=ACCELERATION,
+                 junction_deviation=JUNCTION_DEVIATION,
+                 lookahead=LOOKAHEAD, steps_per_mm=STEPS_PER_MM):
+        self.acceleration = acceleration
+        self.junction_deviation = junction_deviation
+        self.lookahead = lookahead
+        self.steps_per_mm = steps_per_mm
+        # per block: length, nominal speed and maximum junction speed
+        self.lengths = array.array('d')
+        self.speeds = array.array('d')
+        self.junctions = array.array('d')
+        self.xs = array.array('d')
+        self.ys = array.array('d')
+        """Position at the end of every block, in mm."""
+        self.times = array.array('d')
+        """Elapsed time at the end of every block timed by `plan`, in
+        seconds."""
+        self.base = 0
+        """Number of blocks dropped by `forget`, the arrays start with
+        block base."""
+        self.base_time = 0.0
+        """Elapsed time at the end of the blocks dropped, in seconds."""
+        self._entry_speed = ZERO_SPEED  # of the first block not timed
+        self.position = [int(round(value*steps)) for value, steps
+                         in zip(ORIGIN_OFFSET, steps_per_mm)]  # in steps
+        self._previous_unit_vec = (0.0, 0.0, 0.0)
+        self._previous_speed = 0.0
+        self.state = GcodeState()
+
+
+    def __len__(self):
+        return self.base + len(self.lengths)
+
+
+    def set_position(self, x, y, z=0.0):
+        """Set the current position in mm, resets the junction speed."""
+        self.position = [int(round(value*steps))
+                         for value, steps in zip((x, y, z), self.steps_per_mm)]
+        self._previous_speed = 0.0
+        self._previous_unit_vec = (0.0, 0.0, 0.0)
+
+
+    def line(self, x, y, z, feed_rate):
+        """Add a move to x, y, z in mm, see ``planner_line``.
+
+        Moves too short to make a step are dropped. Returns True if a block
+        was added.
+        """
+        target = [int(round(value*steps))
+                  for value, steps in zip((x, y, z), self.steps_per_mm)]
+        if target == self.position:
+            return False
+        dx, dy, dz = [(t - p) / steps for t, p, steps
+                      in zip(target, self.position, self.steps_per_mm)]
+        self.position = target
+        millimeters = math.sqrt(dx*dx + dy*dy + dz*dz)
+        unit_vec = (dx/millimeters, dy/millimeters, dz/millimeters)
+        nominal_speed = feed_rate
+        vmax_junction = ZERO_SPEED
+        if self._previous_speed > 0.0:
+            previous = self._previous_unit_vec
+            cos_theta = -(previous[0]*unit_vec[0] + previous[1]*unit_vec[1] +
+                          previous[2]*unit_vec[2])
+            if cos_theta < 0.95:
+                vmax_junction = min(self._previous_speed, nominal_speed)
+                if cos_theta > -0.95:
+                    sin_theta_d2 = math.sqrt(0.5*(1.0 - cos_theta))
+                    vmax_junction = min(vmax_junction, math.sqrt(
+                        self.acceleration*self.junction_deviation *
+                        sin_theta_d2/(1.0 - sin_theta_d2)))
+        self.lengths.append(millimeters)
+        self.speeds.append(nominal_speed)
+        self.junctions.append(vmax_junction)
+        self.xs.append(target[0] / self.steps_per_mm[0])
+        self.ys.append(target[1] / self.steps_per_mm[1])
+        self._previous_unit_vec = unit_vec
+        self._previous_speed = nominal_speed
+        return True
+
+
+    def execute(self, line):
+        """Interpret a line of `GCODE`, see `GcodeState.execute`.
+
+        Returns the number of blocks added.
+        """
+        move = self.state.execute(line)
+        if move is None:
+            return 0
+        action, target, rate = move
+        if action == 'homing':
+            # the homing cycle itself is not timed
+            self.set_position(0.0, 0.0, 0.0)
+        return int(self.line(target[0], target[1], target[2], rate))
+
+
+    def plan(self, final=False):
+        """Time the blocks whose speed profile is settled.
+
+        A block is settled once the blocks the firmware plans it with are
+        known, so the last `lookahead` blocks are left for later unless
+        final is true. Then the last block is taken to end at standstill,
+        as the firmware does when it runs out of blocks. Extends `times`.
+        """
+        acceleration2 = 2.0*self.acceleration
+        lengths = self.lengths
+        junctions = self.junctions
+        start = len(self.times)
+        num_blocks = len(lengths) - start
+        end = num_blocks if final else num_blocks - self.lookahead
+        if end <= 0:
+            return
+        lookahead = self.lookahead
+        # distance from the start of every block not timed yet
+        ends = [0.0]
+        ends.extend(itertools.accumulate(lengths[start:]))
+        # backward pass, every block can be left at the entry speed of the
+        # next, the last block ends at standstill and no block enters
+        # faster than it can stop within the blocks planned with it
+        speeds = [ZERO_SPEED]*(end + 1)
+        exit_speed = ZERO_SPEED
+        for i in range(num_blocks - 1, -1, -1):
+            speed = math.sqrt(exit_speed*exit_speed +
+                              acceleration2*lengths[start + i])
+            if junctions[start + i] < speed:
+                speed = junctions[start + i]
+            exit_speed = speed
+            if i <= end:
+                window = ends[min(i + lookahead, num_blocks)] - ends[i]
+                speed_stop = math.sqrt(acceleration2*window)
+                speeds[i] = speed if speed < speed_stop else speed_stop
+        # forward pass, no block enters faster than the one before can
+        # accelerate to, then the trapezoid of every block
+        speeds[0] = self._entry_speed
+        elapsed = self.times[-1] if self.times else self.base_time
+        for i in range(end):
+            entry = speeds[i]
+            length = lengths[start + i]
+            speed = math.sqrt(entry*entry + acceleration2*length)
+            if speed < speeds[i+1]:
+                speeds[i+1] = speed
+            elapsed += block_time(length, self.speeds[start + i], entry,
+                                  speeds[i+1], self.acceleration)
+            self.times.append(elapsed)
+        self._entry_speed = speeds[end]
+        if final:
+            self._previous_speed = 0.0
+
+
+    def elapsed(self, blocks):
+        """Time at the end of the first blocks that are timed, in seconds.
+
+        For blocks dropped by `forget` this is the time at the end of all
+        of them.
+        """
+        blocks = min(blocks - self.base, len(self.times))
+        return self.times[blocks - 1] if blocks > 0 else self.base_time
+
+
+    def forget(self, blocks):
+        """Drop what is kept of the first blocks that are timed, numbers
+        of blocks stay the same.
+
+        Keeps the memory bounded while a long job is streamed.
+        """
+        count = min(blocks - self.base, len(self.times))
+        if count <= 0:
+            return
+        self.base_time = self.times[count - 1]
+        for values in (self.lengths, self.speeds, self.junctions, self.xs,
+                       self.ys, self.times):
+            del values[:count]
+        self.base += count
+
+
+    def total_time(self):
+        """Duration of all the blocks, in seconds."""
+        self.plan(final=True)
+        return self.elapsed(len(self))
+
+
+
+def block_time(length, nominal, entry, exit, acceleration=ACCELERATION):
+    """Time the trapezoidal speed profile of a block takes, in seconds.
+
+    Speeds are in mm/min, the steppers never go slower than
+    `MINIMUM_SPEED`.
+    """
+    nominal = max(nominal, MINIMUM_SPEED)
+    entry = max(entry, MINIMUM_SPEED)
+    exit = max(exit, MINIMUM_SPEED)
+    accelerate = (nominal*nominal - entry*entry) / (2*acceleration)
+    decelerate = (nominal*nominal - exit*exit) / (2*acceleration)
+    plateau = length - accelerate - decelerate
+    if plateau >= 0:
+        minutes = ((nominal - entry)/acceleration +
+                   (nominal - exit)/acceleration + plateau/nominal)
+    else:
+        # triangle profile, accelerate to the speed where the deceleration
+        # has to start
+        peak = math.sqrt(acceleration*length + 0.5*(entry*entry + exit*exit))
+        peak = max(peak, entry, exit)
+        minutes = (peak - entry)/acceleration + (peak - exit)/acceleration
+    return 60.0*minutes
+
+
+
+def timeline(lines, planner=None):
+    """Estimate the time at which every line of `GCODE` is completed.
+
+    Returns an array with the elapsed time in seconds, one item per line.
+    Lines that are not understood are taken not to move the machine.
+    """
+    if planner is None:
+        planner = Planner()
+    blocks = array.array('l')
+    for line in lines:
+        try:
+            planner.execute(line)
+        except ValueError:
+            pass
+        blocks.append(len(planner))
+    planner.plan(final=True)
+    return array.array('d', [planner.elapsed(count) for count in blocks])
+
+
+def estimate_gcode(lines):
+    """Estimate how long the machine takes to run lines of `GCODE`, in
+    seconds."""
+    planner = Planner()
+    for line in lines:
+        try:
+            planner.execute(line)
+        except ValueError:
+            pass
+    return planner.total_time()
+
+
+def estimate_job(paths_by_color, passes, seekrate=SEEKRATE):
+    """Estimate how long the machine takes to run a job.
+
+    The job is run through `gcode.iter_gcode` so the moves are exactly those
+    sent to the machine. Returns a dictionary with the total ``time`` and
+    the ``pass_times`` in seconds, the return to the origin at the end
+    counts towards the last pass.
+    """
+    planner = Planner()
+    stats = {}
+    pass_blocks = []
+    for line in iter_gcode(paths_by_color, passes, seekrate, stats=stats):
+        while len(pass_blocks) < len(stats.get('pass_offsets', ())):
+            pass_blocks.append(len(planner))
+        planner.execute(line)
+    planner.plan(final=True)
+    pass_blocks.append(len(planner))
+    pass_times = [planner.elapsed(end) - planner.elapsed(start)
+                  for start, end in zip(pass_blocks, pass_blocks[1:])]
+    if pass_times:
+        # the seek to the first pass
+        pass_times[0] += planner.elapsed(pass_blocks[0])
+    return {'time': planner.elapsed(len(planner)), 'pass_times': pass_times}
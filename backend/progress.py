@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- job progress
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Job Progress
+------------
+
+Tracks how far the machine got with a job in terms of time rather than
+bytes sent. Every line of `GCODE` queued is run through a
+`planner.Planner`, so the time at which the machine finishes a line is
+known in advance.
+
+The firmware replies to every line it has parsed, the line is then in its
+planner and the machine is at most `planner.BLOCK_BUFFER_SIZE` blocks
+behind. Between these bounds the time done advances with the clock. The
+positions in the status reports pin it down further: the head is on one
+of the blocks still in the firmware's buffer.
+
+The same estimate tells from which line a stopped job can be resumed, see
+`JobProgress.checkpoint`.
+
+Only the blocks and lines the machine may still be at are kept, so the
+memory used depends on the look-ahead of the firmware rather than on the
+length of the job.
+"""
+
+import array
+import bisect
+import collections
+import math
+import time
+
+from .planner import BLOCK_BUFFER_SIZE, GcodeState, Planner
+
+PLAN_INTERVAL = 256
+"""Number of blocks added between two runs of the planner."""
+POSITION_TOLERANCE = 1.0
+"""A reported position farther than this from the planned path is ignored,
+in mm."""
+
+
+class JobProgress:
+    """Progress of the lines of `GCODE` queued since the last job ended.
+
+    The `SerialManager` calls `add_line` for every line queued and counts
+    the ``lines_sent`` and the ``lines_acked``, the lines the firmware
+    replied to. ``complete`` is set once the last line of the job is
+    queued. position is where the head is at the start, in mm.
+
+    When a job is resumed, first_line is the number of its first line
+    queued, counting prefix_lines lines restoring the state of the
+    firmware. Only a resumable job keeps the lines needed for a
+    `checkpoint`.
+    """
+
+    def __init__(self, position=None, first_line=0, prefix_lines=0,
+                 resumable=False):
+        self.planner = Planner()
+        if position is not None:
+            self.planner.set_position(*position)
+        self.first_line = first_line
+        self.prefix_lines = prefix_lines
+        self.resumable = resumable
+        self.line_blocks = array.array('l')
+        """Number of blocks planned after every line, from line
+        line_base."""
+        self.line_base = 0
+        self.lines_sent = 0
+        self.lines_acked = 0
+        self.complete = False
+        self.time_done = 0.0
+        self.started = self._updated = time.time()
+        # state after the lines done, and the lines queued after them
+        self.state = GcodeState()
+        self._lines_done = 0
+        self._pending = collections.deque()
+
+
+    def add_line(self, line):
+        try:
+            self.planner.execute(line)
+        except ValueError:
+            pass
+        self.line_blocks.append(len(self.planner))
+        if self.resumable:
+            self._pending.append(line)
+        planner = self.planner
+        if len(planner.lengths) - len(planner.times) >= PLAN_INTERVAL:
+            self.update()
+
+
+    def lines_queued(self):
+        return self.line_base + len(self.line_blocks)
+
+
+    def is_finished(self):
+        """Tell if the firmware got all the lines of the job."""
+        return self.complete and self.lines_acked >= self.lines_queued()
+
+
+    def _acked_blocks(self):
+        if self.lines_acked <= 0:
+            return 0
+        line = min(self.lines_acked, self.lines_queued()) - 1
+        return self.line_blocks[line - self.line_base]
+
+
+    def _forget(self):
+        # the head can't be put back further than the buffer of the
+        # firmware, see position_report
+        planner = self.planner
+        blocks = (planner.base +
+                  bisect.bisect_right(planner.times, self.time_done) -
+                  BLOCK_BUFFER_SIZE - 1)
+        if blocks - planner.base < PLAN_INTERVAL:
+            return
+        planner.forget(blocks)
+        lines = bisect.bisect_right(self.line_blocks, blocks)
+        del self.line_blocks[:lines]
+        self.line_base += lines
+
+
+    def update(self):
+        """Advance the time done with the clock, within the bounds set by
+        the lines acknowledged."""
+        now = time.time()
+        self.planner.plan(final=self.complete)
+        blocks = self._acked_blocks()
+        lower = self.planner.elapsed(blocks - BLOCK_BUFFER_SIZE + 1)
+        upper = self.planner.elapsed(blocks)
+        self.time_done = min(max(self.time_done + now - self._updated, lower),
+                             upper)
+        self._updated = now
+        self._forget()
+
+
+    def position_report(self, x, y):
+        """Correct the time done with the reported position of the head.
+
+        The report is taken to be made when the firmware parsed the last
+        line acknowledged.
+        """
+        planner = self.planner
+        planner.plan(final=self.complete)
+        base = planner.base
+        last = min(self._acked_blocks(), base + len(planner.times))
+        best = None
+        for block in range(max(base, last - BLOCK_BUFFER_SIZE), last):
+            x1 = planner.xs[block - base]
+            y1 = planner.ys[block - base]
+            if block > base:
+                x0 = planner.xs[block - base - 1]
+                y0 = planner.ys[block - base - 1]
+            else:
+                x0 = x1
+                y0 = y1
+            dx = x1 - x0
+            dy = y1 - y0
+            length2 = dx*dx + dy*dy
+            t = 1.0
+            if length2 > 0:
+                t = min(1.0, max(0.0, ((x - x0)*dx + (y - y0)*dy) / length2))
+            distance = math.hypot(x0 + t*dx - x, y0 + t*dy - y)
+            if best is None or distance < best[0]:
+                best = (distance, block, t)
+        if best is None or best[0] > POSITION_TOLERANCE:
+            return
+        distance, block, t = best
+        start = planner.elapsed(block)
+        self.time_done = start + t*(planner.elapsed(block + 1) - start)
+        self._updated = time.time()
+
+
+    def lines_done(self):
+        """Number of lines the machine is done with, by the estimate."""
+        planner = self.planner
+        blocks = planner.base + bisect.bisect_right(planner.times,
+                                                    self.time_done)
+        lines = self.line_base + bisect.bisect_right(self.line_blocks, blocks)
+        return min(lines, self.lines_acked)
+
+
+    def checkpoint(self):
+        """Returns the line to resume the job from and the `GcodeState`
+        before it as a dictionary, or None if the lines restoring the state
+        are not done yet.
+
+        The line the machine is at is run again from its start. Only
+        available for a resumable job.
+        """
+        if not self.resumable:
+            return None
+        self.update()
+        done = self.lines_done()
+        if done < self.prefix_lines:
+            return None
+        while self._lines_done < done:
+            try:
+                self.state.execute(self._pending.popleft())
+            except ValueError:
+                pass
+            self._lines_done += 1
+        return {'line': self.first_line + done,
+                'state': self.state.to_dict(),
+                'time_done': self.time_done}
+
+
+    def report(self, fraction_queued=None):
+        """Returns the progress as a dictionary.
+
+        fraction_queued is the part of the job queued so far, if known,
+        used to extrapolate the total time while a job is streamed.
+        """
+        self.update()
+        time_queued = self.planner.elapsed(len(self.planner))
+        time_total = time_queued
+        if not self.complete and fraction_queued:
+            time_total = time_queued / fraction_queued
+        remaining = max(0.0, time_total - self.time_done)
+        if time_total > 0:
+            percentage = 100.0*self.time_done / time_total
+        else:
+            percentage = 100.0 if self.is_finished() else 0.0
+        return {'lines_queued': self.lines_queued(),
+                'lines_sent': self.lines_sent,
+                'lines_acked': self.lines_acked,
+                'complete': self.complete,
+                'time_done': self.time_done,
+                'time_total': time_total,
+                'time_remaining': remaining,
+                'eta': self._updated + remaining,
+                'elapsed': self._updated - self.started,
+                'percentage': percentage}
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- raster fill
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Raster Fill
+-----------
+
+Computes the horizontal raster lines needed to engrave the area enclosed
+by closed paths. Areas follow the even-odd rule, so holes are left out as
+expected. The scanlines are computed with an edge table and an active edge
+list: every edge is looked at only for the raster lines it crosses.
+
+Bitmaps are engraved the same way. Their rows are resampled to the line
+spacing, thresholded, dithered or quantized to gray levels and run-length
+encoded into spans of constant laser power. Rows are processed one at a
+time, memory use only depends on the width of the image.
+
+Raster lines are extended by an overscan on both sides, with the laser off,
+so the head is at full speed when it reaches the area to engrave.
+"""
+
+import itertools
+
+from .filereaders.png_reader import PNGReader
+
+ACCELERATION = 1800000.0
+"""Acceleration of the machine in mm/min^2, ``CONFIG_ACCELERATION`` of the
+firmware."""
+GRAY_LEVELS = 16
+"""Number of laser powers used to engrave grayscale images."""
+MIN_LINE_SPACING = 0.01
+"""Smallest distance of raster lines, in mm."""
+MAX_LINES = 200000
+"""Largest number of raster lines, or pixels in a row of a bitmap."""
+
+
+def overscan_for(feedrate, acceleration=ACCELERATION):
+    """Distance needed to get from standstill to feedrate, in mm."""
+    return feedrate*feedrate / (2.0*acceleration)
+
+
+def check_line_spacing(line_spacing, extent=0.0):
+    """Raise ValueError unless line_spacing is at least MIN_LINE_SPACING and
+    covers extent, in mm, with at most MAX_LINES lines."""
+    if not line_spacing >= MIN_LINE_SPACING:
+        raise ValueError("line spacing %s below %s mm"
+                         % (line_spacing, MIN_LINE_SPACING))
+    if extent / line_spacing > MAX_LINES:
+        raise ValueError("line spacing %s too small for %s mm"
+                         % (line_spacing, extent))
+
+
+def fill_spans(paths, line_spacing):
+    """Iterate over the raster lines filling the area enclosed by paths.
+
+    Every path is taken as closed. Yields tuples of (y, spans) from bottom to
+    top, spans being a list of (x_start, x_end) tuples sorted by x, empty
+    raster lines are skipped. Raster lines are centered in their band, the
+    first one is half a line spacing above the lowest point. Raises
+    ValueError if the line spacing is out of bounds, see
+    `check_line_spacing`.
+    """
+    # edge table, one entry (y_low, y_high, x_at_y_low, dx/dy) per edge,
+    # horizontal edges never cross a raster line and are left out
+    edges = []
+    for path in paths:
+        if len(path) < 3:
+            continue
+        x0, y0 = path[-1][:2]
+        for vertex in path:
+            x1, y1 = vertex[:2]
+            if y0 < y1:
+                edges.append((y0, y1, x0, (x1 - x0)/(y1 - y0)))
+            elif y1 < y0:
+                edges.append((y1, y0, x1, (x0 - x1)/(y0 - y1)))
+            x0 = x1
+            y0 = y1
+    if not edges:
+        return
+    edges.sort()
+    y_min = edges[0][0]
+    y_max = max(edge[1] for edge in edges)
+    check_line_spacing(line_spacing, y_max - y_min)
+
+    active = []
+    next_edge = 0
+    num_edges = len(edges)
+    line = 0
+    y = y_min + 0.5*line_spacing
+    while y < y_max:
+        # edges are active in [y_low, y_high), so a vertex shared by two
+        # edges is only counted once
+        while next_edge < num_edges and edges[next_edge][0] <= y:
+            active.append(edges[next_edge])
+            next_edge += 1
+        active = [edge for edge in active if edge[1] > y]
+        xs = sorted([x + (y - y_low)*slope for y_low, y_high, x, slope in active])
+        spans = [(xs[i], xs[i+1]) for i in range(0, len(xs) - 1, 2)
+                 if xs[i+1] > xs[i]]
+        if spans:
+            yield y, spans
+        line += 1
+        y = y_min + (line + 0.5)*line_spacing
+
+
+def fill_moves(paths, line_spacing, overscan, bidirectional=True):
+    """Iterate over the moves engraving the area enclosed by paths.
+
+    Yields tuples of (x, y, laser) where laser is ``None`` for a seek, 0 for
+    a feed with the laser off and 1 for a feed with the laser on. With
+    bidirectional every other raster line is engraved right to left. The
+    overscan is not clipped to the work area.
+    """
+    reverse = False
+    for y, spans in fill_spans(paths, line_spacing):
+        if reverse:
+            spans = [(x1, x0) for x0, x1 in reversed(spans)]
+            direction = -1
+        else:
+            direction = 1
+        yield spans[0][0] - direction*overscan, y, None
+        for x0, x1 in spans:
+            yield x0, y, 0
+            yield x1, y, 1
+        yield spans[-1][1] + direction*overscan, y, 0
+        if bidirectional:
+            reverse = not reverse
+
+
+def _box_ranges(size, out_size):
+    # source index range [start, end) averaged for every output index
+    ranges = []
+    for i in range(out_size):
+        start = i*size // out_size
+        end = max(start + 1, (i + 1)*size // out_size)
+        ranges.append((start, end))
+    return ranges
+
+
+def resample_rows(rows, width, height, out_width, out_height):
+    """Resample rows of gray values with a box filter.
+
+    Iterates over out_height lists of out_width values. Only the source rows
+    of the current output row are kept in memory.
+    """
+    columns = _box_ranges(width, out_width)
+    rows = iter(rows)
+    index = 0
+    window = []  # (index, horizontally resampled row)
+    for start, end in _box_ranges(height, out_height):
+        window = [item for item in window if item[0] >= start]
+        while index < end:
+            row = next(rows)
+            if index >= start:
+                sums = [0]
+                sums.extend(itertools.accumulate(row))
+                window.append((index, [(sums[b] - sums[a]) / (b - a)
+                                       for a, b in columns]))
+            index += 1
+        if len(window) == 1:
+            yield window[0][1]
+        else:
+            yield [sum(values) / len(window)
+                   for values in zip(*[row for i, row in window])]
+
+
+def threshold_rows(rows, level=128):
+    """Iterate over rows of laser powers, full below level, off otherwise."""
+    for row in rows:
+        yield [1 if value < level else 0 for value in row]
+
+
+def dither_rows(rows):
+    """Iterate over rows of laser powers, Floyd-Steinberg dithered."""
+    errors = None
+    for row in rows:
+        width = len(row)
+        if errors is None:
+            errors = [0.0]*(width + 2)
+        next_errors = [0.0]*(width + 2)
+        powers = []
+        for i in range(width):
+            value = row[i] + errors[i+1]
+            if value < 128:
+                powers.append(1)
+                error = value
+            else:
+                powers.append(0)
+                error = value - 255
+            errors[i+2] += error*7/16
+            next_errors[i] += error*3/16
+            next_errors[i+1] += error*5/16
+            next_errors[i+2] += error/16
+        errors = next_errors
+        yield powers
+
+
+def gray_rows(rows, levels=GRAY_LEVELS):
+    """Iterate over rows of laser powers quantized to levels, white is off."""
+    scale = (levels - 1) / 255.0
+    for row in rows:
+        yield [int((255 - value)*scale + 0.5) / (levels - 1) for value in row]
+
+
+def row_runs(powers):
+    """Run-length encode a row of laser powers.
+
+    Returns a list of (start, end, power) tuples, one for every run of
+    pixels with the same power, runs with the laser off are left out.
+    """
+    runs = []
+    start = 0
+    for power, group in itertools.groupby(powers):
+        end = start + sum(1 for _ in group)
+        if power:
+            runs.append((start, end, power))
+        start = end
+    return runs
+
+
+def bitmap_moves(image, pos, size, line_spacing, overscan, mode='dither',
+                 bidirectional=True):
+    """Iterate over the moves engraving a bitmap image.
+
+    image is a PNG as bytes, data URI or binary file object. It is placed
+    with its top left corner at pos and scaled to size, in mm. Pixels are
+    resampled to line_spacing in both directions. mode is one of
+    'threshold', 'dither' or 'gray'. Yields the same tuples as `fill_moves`
+    except the laser power is a fraction between 0 and 1. Raises ValueError
+    if the line spacing is out of bounds, see `check_line_spacing`.
+    """
+    check_line_spacing(line_spacing, max(size))
+    reader = PNGReader(image)
+    out_width = max(1, int(round(size[0] / line_spacing)))
+    out_height = max(1, int(round(size[1] / line_spacing)))
+    pixel_width = size[0] / out_width
+    pixel_height = size[1] / out_height
+    rows = resample_rows(reader.iter_rows(), reader.width, reader.height,
+                         out_width, out_height)
+    if mode == 'threshold':
+        rows = threshold_rows(rows)
+    elif mode == 'gray':
+        rows = gray_rows(rows)
+    else:
+        rows = dither_rows(rows)
+    x0, y0 = pos
+    reverse = False
+    for line, powers in enumerate(rows):
+        runs = row_runs(powers)
+        if not runs:
+            continue
+        y = y0 + (line + 0.5)*pixel_height
+        spans = [(x0 + start*pixel_width, x0 + end*pixel_width, power)
+                 for start, end, power in runs]
+        if reverse:
+            spans = [(end, start, power)
+                     for start, end, power in reversed(spans)]
+            direction = -1
+        else:
+            direction = 1
+        yield spans[0][0] - direction*overscan, y, None
+        x_prev = None
+        for x_start, x_end, power in spans:
+            if x_start != x_prev:
+                yield x_start, y, 0
+            yield x_end, y, power
+            x_prev = x_end
+        yield spans[-1][1] + direction*overscan, y, 0
+        if bidirectional:
+            reverse = not reverse
@@ -19,8 +19,14 @@ Its primary functions are those of sending `GCODE` commands to te
 microcontroller and read back status information about the just executed
 operation and the various subsystems and sensors.
 
+There is one instance per machine driven, kept in a registry by name, see
+`get_serial_manager`, and `send_queues_as_ready` polls them all from the
+same loop.
+
 The main stuff is in `SerialManager.queue_gcode` which is the entry point
-from the frontend logic that enqueues new commands to be sent.
+from the frontend logic that enqueues new commands to be sent. Big jobs can
+be streamed instead with `SerialManager.queue_gcode_source`, which pulls
+lines from an iterable as the transmit buffer drains.
 
 The other interesting code is in `SerialManager.send_queue_as_ready` method
 which polls the serial line for statuses and send new commands if there are any
@@ -39,12 +45,16 @@ error correction line is added to the bytes to be sent.
 """
 
 import collections
+import itertools
 import logging
 import os
+import re
 import time
 
 import serial
-from serial.tools import list_ports
+
+from .discovery import (find_device, find_hardware, list_port_infos,
+                        open_ports, port_hwid, WINDOWS_PORTS)
 
 log = logging.getLogger(__name__)
 
@@ -65,7 +75,84 @@ ERROR_CORRECTION
   Every sent line is doubled enabling some kind of error correction.
 """
 
-SERIAL_MANAGER = None
+SERIAL_MANAGERS = collections.OrderedDict()
+"""Registry of the `SerialManager` of every machine, by name."""
+DEFAULT_MACHINE = 'default'
+"""Name of the machine used when none is configured."""
+
+STOP_REASONS = ('stop', 'limit hit', 'power off', 'transmission error')
+"""Reasons for stopping that leave the firmware in stop mode, which only a
+``~`` ends, see `process_status_line`."""
+
+GCODE_LINE_SIZE = 76
+"""Longest `GCODE` line accepted, the firmware line buffer holds 80 chars
+including the FEC prefix and the terminator.
+"""
+GCODE_G_WORDS = frozenset((0, 1, 4, 10, 20, 21, 30, 54, 55, 90, 91))
+GCODE_M_WORDS = frozenset((80, 81, 82, 83, 84, 85))
+"""G and M codes the firmware understands, see ``gcode_execute_line``."""
+
+re_sub_gcode_comments = re.compile(rb'\([^)]*\)|;.*|\s+').sub
+re_sub_gcode_line_number = re.compile(rb'^N[0-9]+').sub
+re_match_gcode_line = re.compile(
+    rb'([GMFXYZPSL][-+]?([0-9]+\.?[0-9]*|\.[0-9]+))+$').match
+re_findall_gcode_codes = re.compile(rb'([GM])([-+.0-9]+)').findall
+re_findall_gcode_words = re.compile(rb'[A-Z][^A-Z]*|[^A-Z]+').findall
+
+
+def _unsupported_code(line):
+    for letter, value in re_findall_gcode_codes(line):
+        codes = GCODE_G_WORDS if letter == b'G' else GCODE_M_WORDS
+        if int(float(value)) not in codes:
+            return (letter + value).decode('ascii')
+    return None
+
+
+def clean_gcode_line(line):
+    """Normalize a line of `GCODE` as the firmware expects it.
+
+    Comments, whitespace and line numbers are stripped and letters
+    uppercased. Returns the cleaned bytes, an empty bytes object for lines
+    with nothing to send or `None` if the line is not something the
+    firmware understands, see `gcode_line_error`. Control characters like
+    ``!`` are not valid in a job either.
+    """
+    if isinstance(line, str):
+        line = line.encode('ascii', errors='replace')
+    line = re_sub_gcode_line_number(b'',
+                                    re_sub_gcode_comments(b'', line).upper())
+    if line == b'' or line.startswith(b'%'):
+        return b''
+    if (len(line) > GCODE_LINE_SIZE or not re_match_gcode_line(line) or
+            _unsupported_code(line)):
+        return None
+    return line
+
+
+def gcode_line_error(line):
+    """Tell why `clean_gcode_line` rejects line, returns None if it
+    doesn't."""
+    if isinstance(line, str):
+        line = line.encode('ascii', errors='replace')
+    line = re_sub_gcode_line_number(b'',
+                                    re_sub_gcode_comments(b'', line).upper())
+    if line == b'' or line.startswith(b'%'):
+        return None
+    words = re_findall_gcode_words(line)
+    for word in words:
+        if (word[:1] == b'G' and re_match_gcode_line(word) and
+                int(float(word[1:])) in (2, 3)):
+            return ("unsupported word %s, import the file as .ngc to have its "
+                    "arcs converted to lines" % word.decode('ascii'))
+    if len(line) > GCODE_LINE_SIZE:
+        return "longer than %d characters" % GCODE_LINE_SIZE
+    for word in words:
+        if not re_match_gcode_line(word):
+            return "unsupported word %s" % word.decode('ascii', 'replace')
+    code = _unsupported_code(line)
+    if code is not None:
+        return "unsupported word %s" % code
+    return None
 
 
 class SerialManager:
@@ -89,18 +176,82 @@ class SerialManager:
     """Character sent by this code to the `ATmega` to be sure that the other other
     side is still functional, it like a ping in a ping-pong protocol.
     """
-
-    def __init__(self):
+    TX_BUFFER_LOW = 4096
+    """When streaming from a source, the transmit buffer is refilled as soon as
+    less than this many bytes are waiting to be sent.
+    """
+    TX_BUFFER_HIGH = 16384
+    """When streaming from a source, the transmit buffer is refilled up to this
+    many bytes.
+    """
+    STATUS_REQUEST_LINES = 200
+    """A status request is slipped into a job every this many lines, its
+    reply carries the position of the head, see `JobProgress`.
+    """
+    CHECKPOINT_INTERVAL = 2.0
+    """Seconds between two checkpoints of a resumable job."""
+    HANDSHAKE_TIMEOUT = 3.0
+    """Seconds to wait for the firmware to answer after connecting, see
+    `handshake`."""
+    RECONNECT_DELAY = 0.5
+    """Seconds before the first attempt to reconnect a lost serial link,
+    doubled after every failed attempt, see `_link_lost`."""
+    RECONNECT_MAX_DELAY = 30.0
+    """Longest wait between two attempts to reconnect."""
+    RECONNECT_TIMEOUT = 600.0
+    """Seconds after which reconnecting a lost serial link is given up."""
+
+    def __init__(self, name=DEFAULT_MACHINE, port=None):
+        self.name = name
+        """Name of the machine, see `get_serial_manager`."""
+        self.port = port
+        """Serial device of the machine, set on `connect`."""
+        self.hwid = None
+        """Hardware id of the serial device."""
+        self.baudrate = None
         self.device = None
 
         self.rx_buffer = bytearray()
         self.tx_buffer = bytearray()
         self.tx_index = 0
 
+        self.tx_source = None
+        """Iterator of `GCODE` lines still to be queued, see
+        `queue_gcode_source`."""
+        self.tx_source_closer = None
+        self.tx_source_size = 0
+        self.tx_source_read = 0
+        self.tx_source_queued = 0
+        self.tx_source_sent = 0
+
+        self.tx_offset = 0
+        """Number of bytes sent before the start of the transmit buffer."""
+        self.tx_lines = collections.deque()
+        """Lines queued and not acknowledged yet, tuples of the stream
+        offset of their end, the number of replies expected and the
+        `JobProgress` of the job they belong to, if any."""
+        self.tx_lines_sent = 0
+        self.status_countdown = self.STATUS_REQUEST_LINES
+
         self.nRequested = 0
 
         # used for calculating percentage done
         self.job_active = False
+        self.progress = None
+        """`JobProgress` of the current or last job."""
+        self.journal = None
+        """`checkpoint.Journal` of resumable jobs, set by the app."""
+        self.journal_progress = None
+        self.last_checkpoint = 0
+        self.port_cache = None
+        """`discovery.PortCache` of the ports that worked, set by the app."""
+        self.port_confirmed = False
+
+        # reconnecting a lost serial link
+        self.link_lost_at = None
+        self.reconnect_at = None
+        """Time of the next attempt to reconnect, None if not reconnecting."""
+        self.reconnect_delay = self.RECONNECT_DELAY
 
         # status flags
         self.status = {}
@@ -133,62 +284,49 @@ class SerialManager:
             'chiller_off': False,
             'x': False,
             'y': False,
-            'firmware_version': None
+            'firmware_version': None,
+            'job_error': None
         }
 
     def list_devices(self, baudrate):
-        ports = []
         if os.name == 'posix':
-            iterator = sorted(list_ports.grep('tty'))
+            infos = list_port_infos('tty')
             log.debug("Found ports:")
-            for port, desc, hwid in iterator:
-                ports.append(port)
+            for port, desc, hwid in infos:
                 log.debug("%-20s", port)
                 log.debug("    desc: %s", desc)
                 log.debug("    hwid: %s", hwid)
+            ports = [info[0] for info in infos]
         else:
-            # scan for available ports. return a list of tuples (num, name)
-            available = []
-            for i in range(24):
-                try:
-                    s = serial.Serial(port=i, baudrate=baudrate)
-                    ports.append(s.portstr)
-                    available.append( (i, s.portstr))
-                    s.close()
-                except serial.SerialException:
-                    pass
-            log.debug("Found ports:")
-            for n,s in available: log.debug("(%d) %s", n, s)
+            # USB serial ports may not be enumerated, try to open them all
+            ports = [info[0] for info in list_port_infos()]
+            ports += open_ports([port for port in WINDOWS_PORTS
+                                 if port not in ports], baudrate)
+            log.debug("Found ports: %s", ", ".join(ports))
         return ports
 
     def match_device(self, search_regex, baudrate):
-        if os.name == 'posix':
-            matched_ports = list_ports.grep(search_regex)
-            if matched_ports:
-                for match_tuple in matched_ports:
-                    if match_tuple:
-                        return match_tuple[0]
-            log.debug("No serial port match for anything like: " + search_regex)
-            return None
-        else:
-            # windows hack because pyserial does not enumerate USB-style com ports
-            log.info("Trying to find Controller ...")
-            for i in range(24):
-                try:
-                    s = serial.Serial(port=i, baudrate=baudrate, timeout=2.0)
-                    lasaur_hello = s.read(32)
-                    if lasaur_hello.find(self.LASAURGRBL_FIRST_STRING) > -1:
-                        return s.portstr
-                    s.close()
-                except serial.SerialException:
-                    pass
-            return None
+        """Find the port of the machine, see `discovery.find_device`. Ports
+        of the other machines are left alone."""
+        exclude = set(serial_manager.port for serial_manager in serial_managers()
+                      if serial_manager is not self)
+        return find_device(search_regex, baudrate, self.port_cache, self.name,
+                           exclude)
 
 
     def connect(self, port, baudrate):
+        self.port = port
+        self.hwid = port_hwid(port)
+        self.baudrate = baudrate
+        self.reconnect_at = None
         self.rx_buffer = bytearray()
         self.tx_buffer = bytearray()
         self.tx_index = 0
+        self.tx_offset = 0
+        self.tx_lines.clear()
+        self.tx_lines_sent = 0
+        self.progress = None
+        self.port_confirmed = False
         self.reset_status()
 
         # Create serial device with both read timeout set to 0.
@@ -201,8 +339,55 @@ class SerialManager:
         self.device = serial.Serial(port, baudrate, timeout=0, write_timeout=1)
         log.debug('Connect: (%s) %r', bool(self.device), self.device)
 
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT):
+        """Wait until the firmware answers after connecting.
+
+        Opening the port resets the `ATmega` on most boards and the firmware
+        sends its banner once booted, a firmware already running answers
+        the ready requests sent meanwhile. Whatever is received is dropped.
+        Returns False if there was no answer within timeout seconds.
+        """
+        deadline = time.time() + timeout
+        received = bytearray()
+        last_request = 0
+        answered = False
+        while self.device and time.time() < deadline:
+            chars = self.device.read(self.RX_CHUNK_SIZE)
+            if chars:
+                received += chars
+                continue
+            if (self.READY_CHAR in received or
+                    self.LASAURGRBL_FIRST_STRING in received):
+                # answered, and nothing more to read
+                answered = True
+                break
+            if time.time() - last_request > 0.25:
+                self.device.write(self.REQUEST_READY_CHAR)
+                last_request = time.time()
+            time.sleep(0.005)
+        self.rx_buffer = bytearray()
+        self.nRequested = 0
+        self.last_request_ready = 0
+        self.flush_input()
+        self.flush_output()
+        if answered:
+            self._confirm_port()
+        else:
+            log.warn("No answer from the firmware on %s", self.port)
+        return answered
+
+
+    def _confirm_port(self):
+        """The firmware answered, remember the port."""
+        self.port_confirmed = True
+        if self.port_cache is not None:
+            self.port_cache.remember(self.name, self.port)
+
+
     def close(self):
+        self.reconnect_at = None
         if self.device:
+            self._checkpoint('disconnect')
             try:
                 self.device.flushOutput()
                 self.device.flushInput()
@@ -218,6 +403,48 @@ class SerialManager:
     def is_connected(self):
         return bool(self.device)
 
+
+    def is_reconnecting(self):
+        return self.reconnect_at is not None
+
+
+    def _link_lost(self):
+        """The serial link broke, a USB reset most likely.
+
+        The job is stopped with a checkpoint, since the firmware may be reset
+        too and lines in flight lost, and reconnecting to the same hardware
+        is tried with an exponential backoff. Once back, the job waits for
+        the operator to resume it from the checkpoint.
+        """
+        log.warn("Serial link to %s lost, reconnecting ...", self.port)
+        self.cancel_queue('disconnect')
+        self.close()
+        self.link_lost_at = time.time()
+        self.reconnect_delay = self.RECONNECT_DELAY
+        self.reconnect_at = self.link_lost_at + self.reconnect_delay
+
+
+    def _reconnect(self):
+        now = time.time()
+        if now - self.link_lost_at > self.RECONNECT_TIMEOUT:
+            log.error("Serial link to %s not back after %d s, giving up",
+                      self.port, self.RECONNECT_TIMEOUT)
+            self.reconnect_at = None
+            return
+        port = find_hardware(self.port, self.hwid)
+        if port is not None:
+            try:
+                self.connect(port, self.baudrate)
+                log.info("Serial link back on %s after %.1f s", port,
+                         now - self.link_lost_at)
+                return
+            except (serial.SerialException, OSError, ValueError):
+                self.device = None
+                log.debug("Reconnecting to %s failed", port)
+        self.reconnect_delay = min(2*self.reconnect_delay,
+                                   self.RECONNECT_MAX_DELAY)
+        self.reconnect_at = now + self.reconnect_delay
+
     def get_hardware_status(self):
         if self.is_queue_empty():
             # trigger a status report
@@ -242,53 +469,268 @@ class SerialManager:
             gcode = gcode.encode('ascii')
         lines = gcode.split(b'\n')
         log.debug("Adding to queue %s lines" % len(lines))
+        self._queue_lines(lines)
+        self.job_active = True
+        if self.progress is not None:
+            self.progress.complete = self.tx_source is None
+
+
+    def queue_gcode_source(self, source, size=0, resumable=False,
+                           first_line=0, prefix_lines=0):
+        """Stream `GCODE` lines, as bytes, from an iterable.
+
+        Lines are pulled from source only when the transmit buffer runs low,
+        so a job never needs to be in memory as a whole. If source has a
+        ``close()`` method it is called when the stream is exhausted or
+        canceled. ``size`` is the total number of bytes expected from source,
+        if known, used to report the progress.
+
+        The progress of a resumable job is checkpointed in the `journal`,
+        the app starts the journal of the job. A resumed job starts at line
+        first_line of the job and with prefix_lines lines restoring the
+        state of the firmware, see `JobProgress`.
+        """
+        from .progress import JobProgress
+        self.cancel_source()
+        self.progress = JobProgress(self._head_position(), first_line,
+                                    prefix_lines, resumable)
+        self.journal_progress = self.progress if resumable else None
+        self.tx_source = iter(source)
+        self.tx_source_closer = getattr(source, 'close', None)
+        self.tx_source_size = size
+        self.tx_source_read = 0
+        self.tx_source_queued = len(self.tx_buffer) - self.tx_index
+        self.tx_source_sent = 0
+        self.job_active = True
+        self.status['job_error'] = None
+        self._fill_tx_buffer()
+
+
+    def _fill_tx_buffer(self):
+        """Move lines from the streaming source to the transmit buffer."""
+        if self.tx_source is None:
+            return
+        if len(self.tx_buffer) - self.tx_index >= self.TX_BUFFER_LOW:
+            return
+        # drop what has been sent already, keeping the buffer bounded
+        self.tx_source_sent += self.tx_index
+        self.tx_offset += self.tx_index
+        del self.tx_buffer[:self.tx_index]
+        self.tx_index = 0
+        lines = []
+        pending = len(self.tx_buffer)
+        try:
+            for line in self.tx_source:
+                lines.append(line)
+                self.tx_source_read += len(line) + 1
+                pending += len(line) + 1
+                if pending >= self.TX_BUFFER_HIGH:
+                    break
+            else:
+                self.cancel_source()
+        except Exception as e:
+            # the job can't be generated or read, not a fault of the port
+            self._source_failed(e)
+            return
+        if lines:
+            self.tx_source_queued += self._queue_lines(lines)
+        if self.progress is not None:
+            self.progress.complete = self.tx_source is None
+
+
+    def _source_failed(self, error):
+        """Stop the job whose source raised error and report it in the
+        status."""
+        log.exception("Job stopped, error in its source")
+        self.status['job_error'] = str(error) or error.__class__.__name__
+        # resuming would run into the same error
+        self.journal_progress = None
+        if self.journal is not None:
+            self.journal.clear()
+        self.cancel_queue()
+
+
+    def _queue_lines(self, lines):
+        """Process lines and append them to the transmit buffer, returns the
+        number of bytes queued."""
+        data, entries = self._process_lines(lines)  # may cancel the queue
+        offset = self.tx_offset + len(self.tx_buffer)
+        for size, replies, job_line in entries:
+            offset += size
+            self.tx_lines.append((offset, replies, job_line))
+        self.tx_buffer += data
+        return len(data)
+
+
+    def _encode_line(self, line):
+        if self.fec_redundancy > FEC_TYPES.NONE: # using error correction
+            # prepend marker and checksum
+            checksum = 0
+            for c in line:
+                if c > ord(b' ') and c != ord(b'~') and c != ord(b'!'): # ignore 32 and lower, ~, !
+                    checksum += c
+                    if checksum >= 128:
+                        checksum -= 128
+            checksum = (checksum >> 1) + 128
+            line_redundant = bytearray()
+            if self.fec_redundancy == FEC_TYPES.ERROR_CORRECTION:
+                line_redundant += b'^' + bytes([checksum]) + line + b'\n'
+            line = line_redundant + b'*' + bytes([checksum]) + line
+        return line
+
+
+    def _process_lines(self, lines):
+        """Encode lines, returns the data to send and a list of (size,
+        replies, job line) tuples, one per line, see `tx_lines`."""
+        from .progress import JobProgress
+        replies = 2 if self.fec_redundancy == FEC_TYPES.ERROR_CORRECTION else 1
         job_list = []
+        entries = []
         for line in lines:
             line = line.strip()
-            if line == b'' or line[0] == b'%':
+            if line == b'' or line.startswith(b'%'):
                 continue
 
-            if line[0] == b'!':
+            if line.startswith(b'!'):
                 self.cancel_queue()
                 self.reset_status()
-                job_list.append(b'!')
+                job_list = [b'!']
+                entries = [(2, 0, None)]
+            elif line == b'?':
+                line = self._encode_line(line)
+                job_list.append(line)
+                entries.append((len(line) + 1, replies, None))
             else:
-                if line != b'?':  # not ready unless just a ?-query
-                    self.status['ready'] = False
-
-                if self.fec_redundancy > FEC_TYPES.NONE: # using error correction
-                    # prepend marker and checksum
-                    checksum = 0
-                    for c in line:
-                        if c > ord(b' ') and c != ord(b'~') and c != ord(b'!'): # ignore 32 and lower, ~, !
-                            checksum += c
-                            if checksum >= 128:
-                                checksum -= 128
-                    checksum = (checksum >> 1) + 128
-                    line_redundant = bytearray()
-                    if self.fec_redundancy == FEC_TYPES.ERROR_CORRECTION:
-                        line_redundant += b'^' + bytes([checksum]) + line + b'\n'
-                    line = line_redundant + b'*' + bytes([checksum]) + line
-
+                # not ready unless just a ?-query
+                self.status['ready'] = False
+                if self.progress is None or self.progress.is_finished():
+                    self.progress = JobProgress(self._head_position())
+                self.progress.add_line(line)
+                line = self._encode_line(line)
                 job_list.append(line)
+                entries.append((len(line) + 1, replies, self.progress))
+                self.status_countdown -= 1
+                if self.status_countdown <= 0:
+                    self.status_countdown = self.STATUS_REQUEST_LINES
+                    line = self._encode_line(b'?')
+                    job_list.append(line)
+                    entries.append((len(line) + 1, replies, None))
+
+        if not job_list:
+            return b'', entries
+        return b'\n'.join(job_list) + b'\n', entries
+
+
+    def _head_position(self):
+        try:
+            return float(self.status['x']), float(self.status['y'])
+        except (TypeError, ValueError):
+            return None
 
-        gcode_processed = b'\n'.join(job_list) + b'\n'
-        self.tx_buffer += gcode_processed
-        self.job_active = True
+
+    def _count_sent_lines(self):
+        sent = self.tx_offset + self.tx_index
+        lines = self.tx_lines
+        while (self.tx_lines_sent < len(lines) and
+               lines[self.tx_lines_sent][0] <= sent):
+            progress = lines[self.tx_lines_sent][2]
+            if progress is not None:
+                progress.lines_sent += 1
+            self.tx_lines_sent += 1
+
+
+    def _acknowledge_line(self):
+        """Account for a line the firmware replied to."""
+        lines = self.tx_lines
+        # lines without a reply, like the stop request
+        while self.tx_lines_sent > 0 and lines[0][1] == 0:
+            lines.popleft()
+            self.tx_lines_sent -= 1
+        if self.tx_lines_sent == 0:
+            return
+        end, replies, progress = lines[0]
+        if replies > 1:
+            lines[0] = (end, replies - 1, progress)
+            return
+        lines.popleft()
+        self.tx_lines_sent -= 1
+        if progress is not None:
+            progress.lines_acked += 1
+
+
+    def _checkpoint(self, reason=None):
+        """Checkpoint the resumable job, at most every CHECKPOINT_INTERVAL
+        unless it stopped for reason."""
+        progress = self.journal_progress
+        if progress is None or self.journal is None:
+            return
+        now = time.time()
+        if reason is None:
+            if now - self.last_checkpoint < self.CHECKPOINT_INTERVAL:
+                return
+            if progress.is_finished():
+                progress.update()
+                if progress.time_done >= progress.planner.elapsed(len(progress.planner)):
+                    self.journal.clear()
+                    self.journal_progress = None
+                    return
+        else:
+            self.journal_progress = None
+        self.last_checkpoint = now
+        checkpoint = progress.checkpoint()
+        if checkpoint is not None:
+            self.journal.checkpoint(checkpoint, reason)
 
 
-    def cancel_queue(self):
+    def cancel_queue(self, reason='stop'):
         """Removes all the instructions from the queue"""
+        self._checkpoint(reason)
+        self.tx_offset += self.tx_index
         self.tx_buffer = bytearray()
         self.tx_index = 0
+        # the firmware still replies to the lines it got
+        sent = [(end, replies, None) for end, replies, progress
+                in itertools.islice(self.tx_lines, self.tx_lines_sent)]
+        self.tx_lines = collections.deque(sent)
+        self.progress = None
+        self.cancel_source()
         self.job_active = False
 
 
+    def cancel_source(self):
+        """Stops streaming from the current source, if any."""
+        if self.tx_source is not None:
+            self.tx_source = None
+            if self.tx_source_closer is not None:
+                self.tx_source_closer()
+            self.tx_source_closer = None
+
+
     def is_queue_empty(self):
-        return self.tx_index >= len(self.tx_buffer)
+        return self.tx_index >= len(self.tx_buffer) and self.tx_source is None
+
+
+    def get_progress(self):
+        """Returns the `JobProgress.report` of the current or last job, or
+        None."""
+        if self.progress is None:
+            return None
+        fraction_queued = None
+        if self.tx_source is not None and self.tx_source_size:
+            fraction_queued = min(1.0, self.tx_source_read /
+                                  float(self.tx_source_size))
+        return self.progress.report(fraction_queued)
 
 
     def get_queue_percentage_done(self):
+        if self.progress is not None and not self.is_queue_empty():
+            return str(self.get_progress()['percentage'])
+        if self.tx_source_size and self.tx_source_queued:
+            # fraction of the queued bytes sent, scaled by the fraction of
+            # the source read so far
+            sent = self.tx_source_sent + self.tx_index
+            return str(100 * min(1.0, sent / float(self.tx_source_queued) *
+                                 self.tx_source_read / self.tx_source_size))
         buflen = len(self.tx_buffer)
         if buflen == 0:
             return ""
@@ -310,12 +752,17 @@ class SerialManager:
 
     def send_queue_as_ready(self):
         """This is the communication workhorse, it reads and sends return-terminated
-        lines via the serial interface. It gets polled from the main app code.
+        lines via the serial interface. It gets polled from the main app code,
+        see `send_queues_as_ready`.
+
+        Returns False when there was nothing to receive or send.
         """
+        busy = False
         if self.device and not self.status['paused']:
             try:
                 ### receiving
                 chars = self.device.read(self.RX_CHUNK_SIZE)
+                busy = len(chars) > 0 or self.nRequested > 0
                 if len(chars) > 0:
                     ## check for data request
                     if self.READY_CHAR in chars:
@@ -333,12 +780,20 @@ class SerialManager:
                             line = self.rx_buffer[:posNewline]
                             self.rx_buffer = self.rx_buffer[posNewline + 1:]
                             log.debug("RX < DATA: %s" % line.decode('ascii'))
+                        if not self.port_confirmed:
+                            self._confirm_port()
+                        if b'#' not in line[:3]:  # not a reply, a banner
+                            self._acknowledge_line()
                         self.process_status_line(line)
-                else:
-                    if self.nRequested == 0:
-                        time.sleep(0.001)  # no rx/tx, rest a bit
+                        if (self.progress is not None and b'X' in line
+                                and b'Y' in line):
+                            position = self._head_position()
+                            if position is not None:
+                                self.progress.position_report(*position)
+                self._checkpoint()
 
                 ### sending
+                self._fill_tx_buffer()
                 if self.tx_index < len(self.tx_buffer):
                     if self.nRequested > 0:
                         try:
@@ -359,20 +814,23 @@ class SerialManager:
                             actuallySent = 0  # assume nothing has been sent
                             log.exception("TX > DATA: Timeout!")
                         self.tx_index += actuallySent
+                        self._count_sent_lines()
                         self.nRequested -= actuallySent
                         if self.nRequested <= 0:
                             self.last_request_ready = 0  # make sure to request ready
-                    elif self.tx_buffer[self.tx_index] in [b'!', b'~']:  # send
+                    elif self.tx_buffer[self.tx_index] in b'!~':  # send
                         # control chars no matter what
                         try:
                             t_prewrite = time.time()
-                            actuallySent = self.device.write(self.tx_buffer[self.tx_index])
+                            actuallySent = self.device.write(
+                                self.tx_buffer[self.tx_index:self.tx_index + 1])
                             if time.time() - t_prewrite > 0.02:
                                 log.warn("TX > CONTROL_CHAR: Delay ")
                         except serial.SerialTimeoutException:
                             actuallySent = 0  # assume nothing has been sent
                             log.exception("TX > CONTROL_CHAR: Timeout!")
                         self.tx_index += actuallySent
+                        self._count_sent_lines()
                     else:
                         if (time.time() - self.last_request_ready) > 2.0:
                             # ask to send a ready byte
@@ -396,8 +854,10 @@ class SerialManager:
                     if self.job_active:
                         # print "\nG-code stream finished!"
                         # print "(LasaurGrbl may take some extra time to finalize)"
+                        self.tx_offset += len(self.tx_buffer)
                         self.tx_buffer = bytearray()
                         self.tx_index = 0
+                        self.tx_source_size = 0
                         self.job_active = False
                         # ready whenever a job is done, including a status
                         # request via '?'
@@ -405,14 +865,18 @@ class SerialManager:
             except OSError:
                 # Serial port appears closed => reset
                 log.exception('Error in sqar()')
-                self.close()
+                self._link_lost()
             except ValueError:
                 # Serial port appears closed => reset
                 log.exception('Error in sqar()')
-                self.close()
+                self._link_lost()
         else:
             # serial disconnected
             self.status['ready'] = False
+            if (self.reconnect_at is not None and
+                    time.time() >= self.reconnect_at):
+                self._reconnect()
+        return busy
 
 
 
@@ -428,7 +892,15 @@ class SerialManager:
         else:
             if b'!' in line:
                 # in stop mode
-                self.cancel_queue()
+                if b'L' in line:
+                    reason = 'limit hit'
+                elif b'P' in line:
+                    reason = 'power off'
+                elif b'T' in line or b'B' in line or b'I' in line:
+                    reason = 'transmission error'
+                else:
+                    reason = 'stop'
+                self.cancel_queue(reason)
                 # not ready whenever in stop mode
                 self.status['ready'] = False
                 log.info('Status: stop')
@@ -490,8 +962,38 @@ class SerialManager:
             if b'V' in line:
                 self.status['firmware_version'] = line[line.find(b'V') + 1:].decode('utf-8')
 
-def get_serial_manager():
-    global SERIAL_MANAGER
-    if not SERIAL_MANAGER:
-        SERIAL_MANAGER = SerialManager()
-    return SERIAL_MANAGER
+def get_serial_manager(name=None):
+    """Returns the `SerialManager` of the machine name, registering it if new.
+
+    Without a name it's the default machine, the first one registered.
+    """
+    if name is None:
+        if SERIAL_MANAGERS:
+            return next(iter(SERIAL_MANAGERS.values()))
+        name = DEFAULT_MACHINE
+    if name not in SERIAL_MANAGERS:
+        SERIAL_MANAGERS[name] = SerialManager(name)
+    return SERIAL_MANAGERS[name]
+
+
+def find_serial_manager(name):
+    """Returns the `SerialManager` of a registered machine, or None."""
+    return SERIAL_MANAGERS.get(name)
+
+
+def serial_managers():
+    """Returns the `SerialManager` of all the machines."""
+    return list(SERIAL_MANAGERS.values())
+
+
+def send_queues_as_ready():
+    """Poll the serial line of every machine once, see
+    `SerialManager.send_queue_as_ready`. All the machines are serviced by
+    the same loop, which rests a bit when none of them has anything to do.
+    """
+    busy = False
+    for serial_manager in serial_managers():
+        if serial_manager.send_queue_as_ready():
+            busy = True
+    if not busy:
+        time.sleep(0.001)  # no rx/tx, rest a bit
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
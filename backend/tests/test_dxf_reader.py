@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- DXF reader tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import io
+import math
+import unittest
+
+from ..filereaders.dxf_reader import (DXFReader, dxf_entities,
+                                      iter_dxf_entities)
+
+TOLERANCE = 0.08
+
+
+def entity(name, *pairs):
+    """Group pairs of an entity, pairs are (code, value) tuples."""
+    return [(0, name)] + list(pairs)
+
+
+def dxf(entities, blocks=()):
+    """Encode a DXF file, with padded group codes as written by CAD
+    programs."""
+    pairs = []
+    if blocks:
+        pairs += [(0, 'SECTION'), (2, 'BLOCKS')]
+        for name, base, block_entities in blocks:
+            pairs += entity('BLOCK', (2, name), (10, base[0]), (20, base[1]))
+            for group in block_entities:
+                pairs += group
+            pairs += entity('ENDBLK')
+        pairs += [(0, 'ENDSEC')]
+    pairs += [(0, 'SECTION'), (2, 'ENTITIES')]
+    for group in entities:
+        pairs += group
+    pairs += [(0, 'ENDSEC'), (0, 'EOF')]
+    return ''.join('%3d\n%s\n' % (code, value) for code, value in pairs)
+
+
+def line(x1, y1, x2, y2):
+    return entity('LINE', (8, '0'), (10, x1), (20, y1), (30, 0.0),
+                  (11, x2), (21, y2), (31, 0.0))
+
+
+def vertices(points):
+    pairs = []
+    for point in points:
+        pairs += [(10, point[0]), (20, point[1])]
+        if len(point) > 2:
+            pairs.append((42, point[2]))
+    return pairs
+
+
+def lwpolyline(points, closed=False):
+    return entity('LWPOLYLINE', (90, len(points)), (70, int(closed)),
+                  *vertices(points))
+
+
+def polyline(points, closed=False):
+    pairs = entity('POLYLINE', (66, 1), (70, int(closed)))
+    for point in points:
+        pairs += entity('VERTEX', *vertices([point]))
+    return pairs + entity('SEQEND')
+
+
+def parse(data):
+    return DXFReader(TOLERANCE).parse(data)['boundarys']['#000000']
+
+
+ALL = dxf([
+    line(0, 0, 10, 0),
+    entity('CIRCLE', (10, 50), (20, 50), (40, 10)),
+    entity('ARC', (10, 0), (20, 0), (40, 5), (50, 0), (51, 90)),
+    entity('ELLIPSE', (10, 0), (20, 0), (11, 10), (21, 0), (40, 0.5)),
+    lwpolyline([(0, 0, 0.5), (10, 0), (10, 10)], closed=True),
+    polyline([(0, 0), (10, 0, -1), (20, 0)]),
+    entity('SPLINE', (71, 3), (72, 8), (73, 4),
+           *([(40, 0.0)]*4 + [(40, 1.0)]*4 +
+             vertices([(0, 0), (0, 10), (10, 10), (10, 0)]))),
+    entity('INSERT', (2, 'part'), (10, 100), (20, 100), (41, 2), (42, 2),
+           (50, 90)),
+    entity('TEXT', (1, 'ignored')),
+], blocks=[('part', (0, 0), [line(0, 0, 1, 0),
+                             entity('CIRCLE', (10, 0), (20, 0), (40, 1))])])
+
+
+def distance_to_curve(vertex, curve):
+    return min(math.hypot(vertex[0] - x, vertex[1] - y) for x, y in curve)
+
+
+class TestEntities(unittest.TestCase):
+
+    def test_bulk_and_streaming(self):
+        bulk = [(name, codes, [value.strip() for value in values])
+                for name, codes, values in dxf_entities(ALL)]
+        streamed = [(name, codes, [value.strip() for value in values])
+                    for name, codes, values
+                    in iter_dxf_entities(io.StringIO(ALL))]
+        self.assertEqual(streamed, bulk)
+        self.assertEqual(bulk[0], ('SECTION', [2], ['BLOCKS']))
+        self.assertEqual(bulk[-1], ('EOF', [], []))
+
+    def test_bulk_and_streaming_parse(self):
+        self.assertEqual(parse(io.StringIO(ALL)), parse(ALL))
+        crlf = ALL.replace('\n', '\r\n')
+        self.assertEqual(parse(crlf), parse(ALL))
+        self.assertEqual(parse(io.StringIO(crlf, newline=None)), parse(ALL))
+
+    def test_header_pairs(self):
+        data = '  9\n$ACADVER\n  1\nAC1015\n' + dxf([line(0, 0, 1, 1)])
+        self.assertEqual(list(dxf_entities(data))[0],
+                         (None, [9, 1], ['$ACADVER', 'AC1015']))
+        self.assertEqual(parse(io.StringIO(data)), parse(data))
+
+    def test_after_eof(self):
+        # blank lines after the end, as written by some CAD programs
+        data = dxf([line(0, 0, 1, 1)])
+        for tail in ('\n', '\n\n', '\r\n', '  \n', '\x1a', '\n999\n'):
+            self.assertEqual(list(dxf_entities(data + tail)),
+                             list(dxf_entities(data)))
+            self.assertEqual(list(iter_dxf_entities(io.StringIO(data + tail))),
+                             list(iter_dxf_entities(io.StringIO(data))))
+            self.assertEqual(parse(data + tail), [[[0.0, 0.0], [1.0, 1.0]]])
+            self.assertEqual(parse(io.StringIO(data + tail)),
+                             [[[0.0, 0.0], [1.0, 1.0]]])
+
+    def test_premature_end(self):
+        data = dxf([line(0, 0, 1, 1)]).split('ENDSEC')[0]
+        self.assertRaises(ValueError, parse, data)
+        self.assertRaises(ValueError, parse, io.StringIO(data))
+
+
+class TestFlattening(unittest.TestCase):
+
+    def test_line(self):
+        self.assertEqual(parse(dxf([line(1, 2, 3, 4)])),
+                         [[[1.0, 2.0], [3.0, 4.0]]])
+
+    def test_circle_and_arc(self):
+        circle, arc = parse(dxf([
+            entity('CIRCLE', (10, 50), (20, 50), (40, 10)),
+            entity('ARC', (10, 0), (20, 0), (40, 5), (50, 0), (51, 90))]))
+        for x, y in circle:
+            self.assertAlmostEqual(math.hypot(x - 50, y - 50), 10)
+        self.assertAlmostEqual(circle[0][0], circle[-1][0])
+        self.assertAlmostEqual(circle[0][1], circle[-1][1])
+        self.assertAlmostEqual(arc[0][0], 5)
+        self.assertAlmostEqual(arc[-1][1], 5)
+        for x, y in arc:
+            self.assertAlmostEqual(math.hypot(x, y), 5)
+            self.assertGreaterEqual(min(x, y), -1e-9)
+
+    def test_lwpolyline(self):
+        square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+        self.assertEqual(parse(dxf([lwpolyline(square, closed=True)])),
+                         [[[0.0, 0.0], [10.0, 0.0], [10.0, 10.0],
+                           [0.0, 10.0], [0.0, 0.0]]])
+
+    def test_bulge(self):
+        # a bulge of 1 is a half circle, counterclockwise, -1 clockwise
+        path, = parse(dxf([lwpolyline([(0, 0, 1), (10, 0)])]))
+        self.assertEqual(path[-1], [10.0, 0.0])
+        self.assertAlmostEqual(path[0][0], 0)
+        self.assertAlmostEqual(path[0][1], 0)
+        for x, y in path:
+            self.assertAlmostEqual(math.hypot(x - 5, y), 5)
+            self.assertLessEqual(y, 1e-9)
+        path, = parse(dxf([lwpolyline([(0, 0, -1), (10, 0)])]))
+        for x, y in path:
+            self.assertGreaterEqual(y, -1e-9)
+
+    def test_polyline(self):
+        # the same as a LWPOLYLINE
+        points = [(0, 0), (10, 0, 0.5), (20, 10), (5, 5)]
+        self.assertEqual(parse(dxf([polyline(points, closed=True)])),
+                         parse(dxf([lwpolyline(points, closed=True)])))
+
+    def test_polyline_mesh_skipped(self):
+        mesh = entity('POLYLINE', (66, 1), (70, 16))
+        for point in [(0, 0), (1, 0), (1, 1)]:
+            mesh += entity('VERTEX', *vertices([point]))
+        mesh += entity('SEQEND')
+        self.assertEqual(parse(dxf([mesh, line(0, 0, 1, 1)])),
+                         [[[0.0, 0.0], [1.0, 1.0]]])
+
+    def test_spline(self):
+        # a clamped cubic spline on four control points is a Bezier curve
+        controls = [(0, 0), (0, 10), (10, 10), (10, 0)]
+        path, = parse(dxf([entity('SPLINE', (71, 3),
+                                  *([(40, 0.0)]*4 + [(40, 1.0)]*4 +
+                                    vertices(controls)))]))
+        self.assertEqual(path[0], [0.0, 0.0])
+        self.assertEqual(path[-1], [10.0, 0.0])
+
+        def bezier(t):
+            weights = [(1-t)**3, 3*t*(1-t)**2, 3*t*t*(1-t), t**3]
+            return (sum(w*p[0] for w, p in zip(weights, controls)),
+                    sum(w*p[1] for w, p in zip(weights, controls)))
+        curve = [bezier(i/2000.0) for i in range(2001)]
+        for vertex in path:
+            self.assertLess(distance_to_curve(vertex, curve), 0.01)
+        # and the chords follow the curve within the tolerance
+        for (x1, y1), (x2, y2) in zip(path, path[1:]):
+            middle = ((x1 + x2)/2, (y1 + y2)/2)
+            self.assertLess(distance_to_curve(middle, curve), TOLERANCE)
+
+    def test_spline_fit_points(self):
+        spline = entity('SPLINE', (70, 1), (71, 3),
+                        (11, 0), (21, 0), (11, 5), (21, 5), (11, 10), (21, 0))
+        self.assertEqual(parse(dxf([spline])),
+                         [[[0.0, 0.0], [5.0, 5.0], [10.0, 0.0], [0.0, 0.0]]])
+
+    def test_ellipse(self):
+        full, quarter = parse(dxf([
+            entity('ELLIPSE', (10, 0), (20, 0), (11, 10), (21, 0), (40, 0.5)),
+            entity('ELLIPSE', (10, 0), (20, 0), (11, 10), (21, 0), (40, 0.5),
+                   (41, 0), (42, math.pi/2))]))
+        for x, y in full + quarter:
+            self.assertAlmostEqual((x/10)**2 + (y/5)**2, 1)
+        self.assertAlmostEqual(full[0][0], full[-1][0])
+        self.assertAlmostEqual(full[0][1], full[-1][1])
+        self.assertEqual(quarter[0], [10.0, 0.0])
+        self.assertAlmostEqual(quarter[-1][0], 0)
+        self.assertAlmostEqual(quarter[-1][1], 5)
+
+    def test_rotated_ellipse(self):
+        # major axis along y
+        path, = parse(dxf([entity('ELLIPSE', (10, 0), (20, 0), (11, 0),
+                                  (21, 10), (40, 0.5))]))
+        for x, y in path:
+            self.assertAlmostEqual((x/5)**2 + (y/10)**2, 1)
+
+    def test_insert(self):
+        blocks = [('part', (1, 0), [line(1, 0, 2, 0)])]
+        paths = parse(dxf([
+            entity('INSERT', (2, 'part'), (10, 10), (20, 10), (41, 2),
+                   (42, 2), (50, 90)),
+            entity('INSERT', (2, 'part'), (10, 0), (20, 0), (70, 2),
+                   (44, 5)),
+            entity('INSERT', (2, 'missing'), (10, 0), (20, 0))],
+            blocks=blocks))
+        self.assertEqual(len(paths), 3)
+        # scaled from the base point, then rotated around the insert point
+        rotated = paths[0]
+        self.assertAlmostEqual(rotated[0][0], 10)
+        self.assertAlmostEqual(rotated[0][1], 10)
+        self.assertAlmostEqual(rotated[1][0], 10)
+        self.assertAlmostEqual(rotated[1][1], 12)
+        # an array of two columns
+        self.assertEqual([[round(x, 9), round(y, 9)] for x, y in paths[1]],
+                         [[0, 0], [1, 0]])
+        self.assertEqual([[round(x, 9), round(y, 9)] for x, y in paths[2]],
+                         [[5, 0], [6, 0]])
+
+    def test_insert_scale_tessellation(self):
+        # a block inserted larger is flattened finer, to the same tolerance
+        blocks = [('dot', (0, 0), [entity('CIRCLE', (10, 0), (20, 0),
+                                          (40, 1))])]
+        small, large = parse(dxf([
+            entity('INSERT', (2, 'dot'), (10, 0), (20, 0)),
+            entity('INSERT', (2, 'dot'), (10, 0), (20, 0), (41, 50),
+                   (42, 50))], blocks=blocks))
+        self.assertGreater(len(large), len(small))
+        for (x1, y1), (x2, y2) in zip(large, large[1:]):
+            middle = math.hypot((x1 + x2)/2, (y1 + y2)/2)
+            self.assertLess(50 - middle, TOLERANCE)
+
+    def test_recursive_insert(self):
+        blocks = [('loop', (0, 0), [line(0, 0, 1, 0),
+                                    entity('INSERT', (2, 'loop'), (10, 5),
+                                           (20, 0))])]
+        paths = parse(dxf([entity('INSERT', (2, 'loop'), (10, 0), (20, 0))],
+                          blocks=blocks))
+        self.assertEqual(paths, [[[0.0, 0.0], [1.0, 0.0]]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- G-code generation tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import unittest
+
+from ..gcode import check_passes, iter_gcode
+
+PASS = {'colors': ['#000000'], 'feedrate': 1200, 'intensity': 50}
+SQUARE = {'#000000': [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]]}
+
+
+def with_(**changes):
+    pass_ = dict(PASS)
+    pass_.update(changes)
+    return pass_
+
+
+class TestCheckPasses(unittest.TestCase):
+
+    def test_valid(self):
+        # numbers may come as strings from the passes widget
+        passes = [PASS, with_(feedrate='2000', intensity='10'),
+                  with_(fill=0.2), with_(fill=0), with_(colors=[])]
+        check_passes(passes)
+        list(iter_gcode(SQUARE, passes))
+
+    def test_invalid(self):
+        for passes in ({}, 'passes', [None], [[PASS]],
+                       [{'feedrate': 1200, 'intensity': 50}],
+                       [with_(colors='#000000')], [with_(colors=[['#000000']])],
+                       [PASS, with_(feedrate='abc')],
+                       [PASS, {'colors': [], 'intensity': 50}],
+                       [with_(intensity=None)], [with_(feedrate=float('nan'))],
+                       [with_(intensity=[])], [with_(fill=-0.1)],
+                       [with_(fill='abc')], [with_(fill=0.001)]):
+            self.assertRaises(ValueError, check_passes, passes)
+
+    def test_fill_line_spacing(self):
+        # the generator stops instead of looping forever
+        for fill in (-0.1, 1e-9, float('nan')):
+            self.assertRaises(ValueError, list,
+                              iter_gcode(SQUARE, [with_(fill=fill)]))
+        large = {'#000000': [[[0, 0], [10, 0], [10, 1e5], [0, 1e5]]]}
+        self.assertRaises(ValueError, list,
+                          iter_gcode(large, [with_(fill=0.1)]))
+
+    def test_invalid_raster(self):
+        bitmap = {'image': b'PNG', 'pos': [0, 0], 'size': [10, 10]}
+        check_passes([with_(raster=bitmap)])
+        for changes in ({'image': None}, {'image': b''}, {'pos': [0]}, {'pos': '0,0'},
+                        {'size': [10, 0]}, {'size': [10, 'a']},
+                        {'line_spacing': 0}, {'line_spacing': 'a'},
+                        {'size': [1e5, 10], 'line_spacing': 0.1}):
+            invalid = dict(bitmap, **changes)
+            if changes.get('image', True) is None:
+                del invalid['image']
+            self.assertRaises(ValueError, check_passes,
+                              [with_(raster=invalid)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- binary job file tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import array
+import json
+import random
+import unittest
+
+from .. import jobfile
+
+PASSES = [{'items': [0, 1], 'feedrate': 2000, 'intensity': 40}]
+
+
+def float32(value):
+    return array.array('f', [value])[0]
+
+
+def random_paths(count, seed=1):
+    rnd = random.Random(seed)
+    return [[[rnd.uniform(-2000, 2000), rnd.uniform(-2000, 2000)]
+             for _ in range(rnd.randint(1, 20))]
+            for _ in range(count)]
+
+
+class TestDumpsLoads(unittest.TestCase):
+
+    def setUp(self):
+        self.paths_by_color = {'#000000': random_paths(50),
+                               '#ff0000': random_paths(10, 2)}
+
+    def assertFloat32Paths(self, paths, expected):
+        self.assertEqual(len(paths), len(expected))
+        for path, orig in zip(paths, expected):
+            self.assertEqual(path, [[float32(x), float32(y)]
+                                    for x, y in orig])
+
+    def test_round_trip(self):
+        data = jobfile.dumps(PASSES, self.paths_by_color)
+        self.assertTrue(jobfile.is_job(data))
+        passes, paths_by_color = jobfile.loads(data)
+        self.assertEqual(passes, PASSES)
+        self.assertEqual(set(paths_by_color), set(self.paths_by_color))
+        for color, paths in paths_by_color.items():
+            self.assertFloat32Paths(paths, self.paths_by_color[color])
+
+    def test_idempotent(self):
+        data = jobfile.dumps(PASSES, self.paths_by_color)
+        self.assertEqual(jobfile.dumps(*jobfile.loads(data)), data)
+
+    def test_compressed(self):
+        data = jobfile.dumps(PASSES, self.paths_by_color)
+        compressed = jobfile.dumps(PASSES, self.paths_by_color, compress=True)
+        flags, meta, base = jobfile.read_header(compressed)
+        self.assertTrue(flags & jobfile.FLAG_ZLIB)
+        self.assertEqual(jobfile.loads(compressed), jobfile.loads(data))
+
+    def test_quantized(self):
+        data = jobfile.dumps(PASSES, self.paths_by_color, quantize=True)
+        passes, paths_by_color = jobfile.loads(data)
+        for color, paths in paths_by_color.items():
+            for path, orig in zip(paths, self.paths_by_color[color]):
+                for vertex, expected in zip(path, orig):
+                    self.assertAlmostEqual(vertex[0], expected[0], delta=5e-4)
+                    self.assertAlmostEqual(vertex[1], expected[1], delta=5e-4)
+
+    def test_empty_colors(self):
+        data = jobfile.dumps(PASSES, {'#000000': [], '#00ff00': [[[1, 2]]]},
+                             compress=True)
+        passes, paths_by_color = jobfile.loads(data)
+        self.assertEqual(paths_by_color, {'#000000': [],
+                                          '#00ff00': [[[1.0, 2.0]]]})
+        self.assertEqual(jobfile.loads(jobfile.dumps([], {})), ([], {}))
+
+    def test_blocks_aligned(self):
+        data = jobfile.dumps(PASSES, self.paths_by_color, compress=True)
+        flags, meta, base = jobfile.read_header(data)
+        self.assertEqual(base % 4, 0)
+        for entry in meta['colors']:
+            self.assertEqual(entry['offset'] % 4, 0)
+
+    def test_meta(self):
+        data = jobfile.dumps(PASSES, {}, meta={'name': 'x'})
+        flags, meta, base = jobfile.read_header(data)
+        self.assertEqual(meta['name'], 'x')
+        self.assertEqual(meta['passes'], PASSES)
+
+
+class TestLsa(unittest.TestCase):
+
+    def test_round_trip(self):
+        paths_by_color = {'#000000': random_paths(100)}
+        data = jobfile.dumps(PASSES, paths_by_color)
+        lsa = jobfile.to_lsa(data)
+        job = json.loads(lsa)
+        self.assertEqual(job['passes'], PASSES)
+        self.assertEqual(jobfile.from_lsa(lsa), data)
+
+    def test_from_lsa(self):
+        lsa = json.dumps({'passes': PASSES,
+                          'paths_by_color': {'#000000': [[[0.5, 1.25]]]}})
+        data = jobfile.from_lsa(lsa, compress=True)
+        self.assertEqual(jobfile.loads(data),
+                         (PASSES, {'#000000': [[[0.5, 1.25]]]}))
+        self.assertEqual(json.loads(jobfile.to_lsa(data)), json.loads(lsa))
+
+    def test_short_decimals(self):
+        data = jobfile.dumps([], {'#000000': [[[0.1, 1234.5678]]]})
+        job = json.loads(jobfile.to_lsa(data))
+        self.assertEqual(job['paths_by_color']['#000000'],
+                         [[[0.100000001, 1234.56775]]])
+
+
+class TestInvalid(unittest.TestCase):
+
+    def setUp(self):
+        self.data = jobfile.dumps(PASSES, {'#000000': random_paths(20)})
+
+    def test_not_a_job(self):
+        self.assertFalse(jobfile.is_job(b'{"passes": []}'))
+        self.assertRaises(ValueError, jobfile.loads, b'{"passes": [], "x": 1}')
+
+    def test_version(self):
+        data = bytearray(self.data)
+        data[4] = jobfile.VERSION + 1
+        self.assertRaises(ValueError, jobfile.loads, bytes(data))
+
+    def test_truncated(self):
+        for size in (0, 3, 11, 20, len(self.data) - 1):
+            self.assertRaises(ValueError, jobfile.loads, self.data[:size])
+
+    def test_truncated_compressed(self):
+        data = jobfile.dumps(PASSES, {'#000000': random_paths(20)},
+                             compress=True)
+        self.assertRaises(ValueError, jobfile.loads, data[:-8])
+
+    def test_corrupt_block(self):
+        data = jobfile.dumps(PASSES, {'#000000': random_paths(20)},
+                             compress=True)
+        flags, meta, base = jobfile.read_header(data)
+        data = bytearray(data)
+        data[base + 2:base + 10] = b'\xff'*8
+        self.assertRaises(ValueError, jobfile.loads, bytes(data))
+
+    def test_corrupt_starts(self):
+        flags, meta, base = jobfile.read_header(self.data)
+        end = base + 4*meta['colors'][0]['paths']
+        data = bytearray(self.data)
+        data[end:end + 4] = b'\xff'*4
+        self.assertRaises(ValueError, jobfile.loads, bytes(data))
+
+    def test_corrupt_meta(self):
+        data = bytearray(self.data)
+        data[12] = ord('[')
+        self.assertRaises(ValueError, jobfile.loads, bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- G-code reader tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import io
+import math
+import unittest
+
+from ..filereaders.ngc_reader import NGCReader
+
+TOLERANCE = 0.08
+
+SQUARE = """\
+%
+(a square, cut twice as fast the second time)
+G21 G90
+N10 G0 X0 Y0
+N20 G1 X10 Y0 F1000 S255 ; full power
+N30 G1 Y10
+N40 X0
+G1 Y0
+G0 X20
+G1 X30 F2000
+M5
+%
+"""
+
+INCHES = """\
+G20 G90
+G0 X1 Y1
+G1 X2 F10 S127.5
+G21
+G1 Y2
+"""
+
+RELATIVE = """\
+G21 G91
+G0 X5 Y5
+G1 X10 F1000
+Y10
+X-10
+G90
+G1 X0 Y0
+"""
+
+
+def parse(ngc):
+    return NGCReader(TOLERANCE).parse(ngc)
+
+
+class TestLines(unittest.TestCase):
+
+    def test_square(self):
+        result = parse(SQUARE)
+        self.assertEqual(result['boundarys'], {
+            '#000000': [[[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0],
+                         [0.0, 0.0]]],
+            '#ff0000': [[[20.0, 0.0], [30.0, 0.0]]]})
+        self.assertEqual(result['lasertags'], [
+            [1, 1000, '', 100, '%', '#000000', '', '', '', '', ''],
+            [2, 2000, '', 100, '%', '#ff0000', '', '', '', '', '']])
+
+    def test_inches(self):
+        result = parse(INCHES)
+        self.assertEqual(result['boundarys'], {
+            '#000000': [[[25.4, 25.4], [50.8, 25.4], [50.8, 2.0]]]})
+        # F10 in/min, S127.5 of 255
+        self.assertEqual(result['lasertags'][0][1:4], [254, '', 50])
+
+    def test_relative(self):
+        self.assertEqual(parse(RELATIVE)['boundarys'], {
+            '#000000': [[[5.0, 5.0], [15.0, 5.0], [15.0, 15.0], [5.0, 15.0],
+                         [0.0, 0.0]]]})
+
+    def test_no_cuts(self):
+        self.assertEqual(parse("G0 X10 Y10\nM3\n"),
+                         {'boundarys': {'#000000': []}})
+
+    def test_lines_iterable(self):
+        self.assertEqual(parse(io.StringIO(SQUARE)), parse(SQUARE))
+
+
+class TestArcs(unittest.TestCase):
+
+    def assertArc(self, path, center, radius, start, end):
+        self.assertEqual(path[0], list(start))
+        self.assertEqual(path[-1], list(end))
+        for x, y in path:
+            self.assertAlmostEqual(math.hypot(x - center[0], y - center[1]),
+                                   radius, places=9)
+        # the chords stay within the tolerance of the arc
+        for (x1, y1), (x2, y2) in zip(path, path[1:]):
+            middle = math.hypot((x1 + x2)/2 - center[0],
+                                (y1 + y2)/2 - center[1])
+            self.assertLessEqual(radius - middle, TOLERANCE + 1e-9)
+
+    def sweep(self, path, center):
+        angles = [math.atan2(y - center[1], x - center[0]) for x, y in path]
+        total = 0.0
+        for a1, a2 in zip(angles, angles[1:]):
+            total += (a2 - a1 + math.pi) % (2*math.pi) - math.pi
+        return math.degrees(total)
+
+    def test_clockwise_offsets(self):
+        paths = parse("G0 X10 Y0\nG2 X0 Y-10 I-10 J0 F500")['boundarys']
+        path = paths['#000000'][0]
+        self.assertArc(path, (0, 0), 10, (10, 0), (0, -10))
+        self.assertAlmostEqual(self.sweep(path, (0, 0)), -90)
+        # ceil(90 deg / (2 acos(1 - 0.08/10))) segments
+        self.assertEqual(len(path) - 1, 7)
+
+    def test_counterclockwise_full_circle(self):
+        paths = parse("G0 X10 Y0\nG3 X10 Y0 I-10 J0")['boundarys']
+        path = paths['#000000'][0]
+        self.assertArc(path, (0, 0), 10, (10, 0), (10, 0))
+        self.assertAlmostEqual(self.sweep(path, (0, 0)), 360)
+
+    def test_absolute_centers(self):
+        relative = parse("G0 X10 Y10\nG3 X0 Y20 I-10 J0")
+        absolute = parse("G90.1\nG0 X10 Y10\nG3 X0 Y20 I0 J10")
+        self.assertEqual(relative, absolute)
+        path = absolute['boundarys']['#000000'][0]
+        self.assertArc(path, (0, 10), 10, (10, 10), (0, 20))
+        self.assertAlmostEqual(self.sweep(path, (0, 10)), 90)
+
+    def test_radius(self):
+        # the shorter arc for a positive radius, the longer for a negative
+        short = parse("G0 X0 Y0\nG2 X10 Y0 R10")['boundarys']['#000000'][0]
+        center = (5, -math.sqrt(75))
+        self.assertArc(short, center, 10, (0, 0), (10, 0))
+        self.assertAlmostEqual(self.sweep(short, center), -60)
+        long = parse("G0 X0 Y0\nG2 X10 Y0 R-10")['boundarys']['#000000'][0]
+        center = (5, math.sqrt(75))
+        self.assertArc(long, center, 10, (0, 0), (10, 0))
+        self.assertAlmostEqual(self.sweep(long, center), -300)
+
+    def test_arc_in_inches(self):
+        paths = parse("G20\nG0 X1 Y0\nG3 X0 Y1 I-1 J0")['boundarys']
+        self.assertArc(paths['#000000'][0], (0, 0), 25.4, (25.4, 0),
+                       (0, 25.4))
+
+    def test_relative_arc(self):
+        paths = parse("G91\nG0 X10 Y0\nG2 X-10 Y-10 I-10 J0")['boundarys']
+        self.assertArc(paths['#000000'][0], (0, 0), 10, (10, 0), (0, -10))
+
+
+class TestLasertags(unittest.TestCase):
+
+    def test_settings_colors(self):
+        result = parse("G1 X1 F100 S255\nS0\nG1 X2\nF100 S255\nG1 X3\n"
+                       "G1 X4 F300")
+        self.assertEqual(result['boundarys'], {
+            '#000000': [[[0.0, 0.0], [1.0, 0.0]], [[2.0, 0.0], [3.0, 0.0]]],
+            '#ff0000': [[[1.0, 0.0], [2.0, 0.0]]],
+            '#00ff00': [[[3.0, 0.0], [4.0, 0.0]]]})
+        self.assertEqual([tag[:6] for tag in result['lasertags']], [
+            [1, 100, '', 100, '%', '#000000'],
+            [2, 100, '', 0, '%', '#ff0000'],
+            [3, 300, '', 100, '%', '#00ff00']])
+
+    def test_many_settings(self):
+        ngc = ''.join("G0 X0 Y%d\nG1 X1 S%d\n" % (i, i) for i in range(20))
+        result = parse(ngc)
+        self.assertEqual(len(result['lasertags']), 20)
+        self.assertEqual(len(set(result['boundarys'])), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- run time estimation tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import math
+import random
+import unittest
+
+from ..planner import (ACCELERATION, JUNCTION_DEVIATION, MINIMUM_SPEED,
+                       STEPS_PER_MM, GcodeState, Planner, block_time,
+                       estimate_gcode)
+
+
+class TestBlockTime(unittest.TestCase):
+
+    def test_trapezoid(self):
+        # 600 to 6000 mm/min takes 5400/1800000 min over
+        # (6000^2 - 600^2)/(2*1800000) = 9.9 mm, twice, leaving a plateau
+        # of 100 - 19.8 mm at 6000 mm/min
+        minutes = 2*5400/1800000.0 + 80.2/6000
+        self.assertAlmostEqual(block_time(100, 6000, 600, 600, 1800000),
+                               60*minutes, places=9)
+
+    def test_asymmetric_trapezoid(self):
+        # 0 is taken as the minimum speed
+        accelerate = (6000**2 - MINIMUM_SPEED**2) / (2*1800000.0)
+        decelerate = (6000**2 - 1200**2) / (2*1800000.0)
+        minutes = ((6000 - MINIMUM_SPEED)/1800000.0 + 4800/1800000.0 +
+                   (50 - accelerate - decelerate)/6000)
+        self.assertAlmostEqual(block_time(50, 6000, 0, 1200, 1800000),
+                               60*minutes, places=9)
+
+    def test_triangle(self):
+        # too short to reach 6000 mm/min, the peak is where accelerating
+        # from 600 and decelerating to 600 meet half way:
+        # (peak^2 - 600^2)/(2*1800000) = 0.5 mm
+        peak = math.sqrt(600**2 + 1800000.0)
+        minutes = 2*(peak - 600)/1800000.0
+        self.assertAlmostEqual(block_time(1, 6000, 600, 600, 1800000),
+                               60*minutes, places=9)
+
+    def test_cruise(self):
+        self.assertAlmostEqual(block_time(100, 6000, 6000, 6000), 1.0)
+
+
+class TestPlanner(unittest.TestCase):
+
+    def planner(self, moves, feed_rate=6000):
+        planner = Planner()
+        planner.set_position(0, 0)
+        for x, y in moves:
+            planner.line(x, y, 0, feed_rate)
+        planner.plan(final=True)
+        return planner
+
+    def test_straight_line(self):
+        # no slowing down between blocks in line
+        split = self.planner([(10, 0), (20, 0)])
+        whole = self.planner([(20, 0)])
+        self.assertEqual(len(split), 2)
+        self.assertAlmostEqual(split.total_time(), whole.total_time(),
+                               places=9)
+        # 20 mm is just enough to reach 6000 mm/min, from and to standstill
+        length = 1778 / STEPS_PER_MM[0]
+        self.assertAlmostEqual(whole.total_time(),
+                               block_time(length, 6000, 0, 0), places=9)
+
+    def test_corner(self):
+        corner = self.planner([(10, 0), (10, 10)])
+        # the junction speed of a 90 degree corner
+        sin_theta_d2 = math.sqrt(0.5)
+        junction = math.sqrt(ACCELERATION*JUNCTION_DEVIATION *
+                             sin_theta_d2/(1 - sin_theta_d2))
+        length_x = 889 / STEPS_PER_MM[0]
+        length_y = 909 / STEPS_PER_MM[1]
+        self.assertAlmostEqual(corner.total_time(),
+                               block_time(length_x, 6000, 0, junction) +
+                               block_time(length_y, 6000, junction, 0),
+                               places=9)
+        straight = self.planner([(10, 0), (20, 0)])
+        self.assertGreater(corner.total_time(), straight.total_time())
+
+    def test_dropped_moves(self):
+        planner = Planner()
+        planner.set_position(0, 0)
+        self.assertTrue(planner.line(1, 0, 0, 6000))
+        self.assertFalse(planner.line(1.001, 0, 0, 6000))
+        self.assertEqual(len(planner), 1)
+
+    def test_incremental(self):
+        rnd = random.Random(1)
+        moves = [(rnd.uniform(0, 100), rnd.uniform(0, 100))
+                 for _ in range(2000)]
+        # mostly short moves in line, as flattened curves are
+        for i in range(0, len(moves), 3):
+            moves[i] = (moves[i-1][0] + 0.1, moves[i-1][1])
+        reference = self.planner(moves)
+        planner = Planner()
+        planner.set_position(0, 0)
+        for i, (x, y) in enumerate(moves):
+            planner.line(x, y, 0, 6000)
+            if i % 37 == 0:
+                planner.plan()
+        self.assertLess(len(planner.times), len(planner))
+        planner.plan(final=True)
+        self.assertEqual(len(planner.times), len(reference.times))
+        for time, expected in zip(planner.times, reference.times):
+            self.assertAlmostEqual(time, expected, places=6)
+
+    def test_forget(self):
+        planner = self.planner([(i % 2 * 10, i) for i in range(1, 101)])
+        total = planner.total_time()
+        middle = planner.elapsed(50)
+        planner.forget(50)
+        self.assertEqual(planner.base, 50)
+        self.assertEqual(len(planner), 100)
+        self.assertEqual(planner.elapsed(50), middle)
+        self.assertEqual(planner.elapsed(100), total)
+
+
+class TestGcode(unittest.TestCase):
+
+    def test_execute(self):
+        planner = Planner()
+        lines = [b'G90', b'G0X10Y0', b'G1F3000', b'G1X20', b'G91', b'G1Y10',
+                 b'S100', b'G20', b'G1X1']
+        added = [planner.execute(line) for line in lines]
+        self.assertEqual(added, [0, 1, 0, 1, 0, 1, 0, 0, 1])
+        self.assertAlmostEqual(planner.xs[-1], 20 + 25.4 + 5, places=1)
+        self.assertAlmostEqual(planner.ys[-1], 10 + 5, places=1)
+        self.assertEqual(planner.speeds[1], 3000)
+
+    def test_estimate(self):
+        # 100 mm at 6000 mm/min and back, at least 2 s
+        seconds = estimate_gcode([b'G0X0Y0', b'G1F6000', b'G1X100',
+                                  b'G1X0'])
+        self.assertGreater(seconds, 2.0)
+        self.assertLess(seconds, 2.5)
+
+    def test_state_round_trip(self):
+        state = GcodeState()
+        for line in (b'G10L2P1X1Y2Z0', b'G55', b'G91', b'G1F1000', b'M80',
+                     b'S50', b'G0X5Y5'):
+            state.execute(line)
+        restored = GcodeState.from_dict(state.to_dict())
+        self.assertEqual(restored.to_dict(), state.to_dict())
+        replayed = GcodeState()
+        for line in state.prefix():
+            replayed.execute(line)
+        self.assertEqual(replayed.to_dict(), state.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- PNG reader tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import struct
+import unittest
+import zlib
+
+from ..filereaders.png_reader import PNGReader
+
+
+def chunk(ctype, data):
+    return (struct.pack('>I', len(data)) + ctype + data +
+            struct.pack('>I', zlib.crc32(ctype + data)))
+
+
+def png(width, height, filtertype=0, idat_size=None):
+    """A gray PNG, its image data split in IDAT chunks of idat_size."""
+    raw = b''.join(bytes([filtertype]) +
+                   bytes((x + y) % 256 for x in range(width))
+                   for y in range(height))
+    data = zlib.compress(raw)
+    idat_size = idat_size or len(data)
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0,
+                                       0, 0)) +
+            b''.join(chunk(b'IDAT', data[i:i+idat_size])
+                     for i in range(0, len(data), idat_size)) +
+            chunk(b'IEND', b''))
+
+
+class TestPNGReader(unittest.TestCase):
+
+    def test_rows(self):
+        image = png(300, 200, idat_size=100)
+        PNGReader(image).check()
+        rows = list(PNGReader(image).iter_rows())
+        self.assertEqual(len(rows), 200)
+        self.assertEqual(rows[7][:3], bytearray([7, 8, 9]))
+
+    def test_truncated(self):
+        image = png(300, 200, idat_size=100)
+        for size in (len(image) // 2, len(image) - 40):
+            self.assertRaises(ValueError, PNGReader(image[:size]).check)
+            self.assertRaises(ValueError, list,
+                              PNGReader(image[:size]).iter_rows())
+
+    def test_corrupt(self):
+        image = bytearray(png(300, 200))
+        index = image.index(b'IDAT') + 40
+        image[index:index + 20] = b'\xff'*20
+        image = bytes(image)
+        self.assertRaises(ValueError, PNGReader(image).check)
+        self.assertRaises(ValueError, list, PNGReader(image).iter_rows())
+
+    def test_filter_type(self):
+        image = png(30, 20, filtertype=5)
+        self.assertRaises(ValueError, PNGReader(image).check)
+        self.assertRaises(ValueError, list, PNGReader(image).iter_rows())
+
+
+if __name__ == '__main__':
+    unittest.main()
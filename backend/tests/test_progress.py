@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- job progress tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import unittest
+
+from ..planner import BLOCK_BUFFER_SIZE, GcodeState
+from ..progress import PLAN_INTERVAL, JobProgress
+
+
+def zigzag(count):
+    """Lines of G-code moving back and forth, with some lines that don't
+    move."""
+    yield b'G90'
+    yield b'G1F3000'
+    for i in range(count):
+        if i % 7 == 0:
+            yield b'S%d' % (i % 255)
+        yield b'G1X%dY%d' % (10 + i % 2 * 5, 10 + i % 3)
+
+
+def modal_job(count):
+    """Lines of G-code switching between modes along the way."""
+    yield b'G10L2P1X5Y5Z0'
+    for i in range(count):
+        if i % 400 == 0:
+            yield (b'M80', b'M81')[i // 400 % 2]
+            yield (b'G54', b'G55')[i // 800 % 2]
+        if i % 300 == 0:
+            yield (b'G90', b'G91')[i // 300 % 2]
+            yield b'G0X0Y0' if i // 300 % 2 == 0 else b'G0F%d' % (5000 + i)
+        if i % 7 == 0:
+            yield b'S%d' % (i % 255)
+        if i // 300 % 2:
+            yield b'G1X%dY1F%d' % ((-1)**i, 1000 + i % 5)
+        else:
+            yield b'G1X%dY%d' % (10 + i % 2 * 5, 10 + i % 3)
+
+
+def replay(lines, state=None):
+    """Run lines through a `GcodeState`, returns it and the moves."""
+    state = state or GcodeState()
+    return state, [state.execute(line) for line in lines]
+
+
+class TestJobProgress(unittest.TestCase):
+
+    def run_job(self, progress, lines, done=None):
+        """Queue lines and have the firmware ack them, with the machine
+        keeping up. Stops after done lines."""
+        for number, line in enumerate(lines, 1):
+            progress.add_line(line)
+            progress.lines_sent = progress.lines_acked = number
+            if number % 50 == 0:
+                progress.time_done = float('inf')
+                progress.update()
+            if number == done:
+                break
+        return progress
+
+    def test_bounded_memory(self):
+        progress = self.run_job(JobProgress(), zigzag(20000))
+        self.assertEqual(progress.lines_queued(), 22860)
+        self.assertLess(len(progress.planner.lengths), 3*PLAN_INTERVAL)
+        self.assertLess(len(progress.line_blocks), 4*PLAN_INTERVAL)
+        self.assertEqual(len(progress._pending), 0)
+        self.assertIsNone(progress.checkpoint())
+
+    def test_same_estimate(self):
+        # what is dropped does not change the progress
+        progress = self.run_job(JobProgress(), zigzag(5000))
+        reference = JobProgress()
+        reference._forget = lambda: None
+        self.run_job(reference, zigzag(5000))
+        self.assertGreater(progress.planner.base, 0)
+        for p in (progress, reference):
+            p.complete = True
+            p.time_done = float('inf')
+            p.update()
+        self.assertEqual(progress.report()['time_total'],
+                         reference.report()['time_total'])
+        self.assertEqual(progress.lines_done(), reference.lines_done())
+        self.assertTrue(progress.is_finished())
+
+    def test_position_report(self):
+        progress = self.run_job(JobProgress(), zigzag(5000))
+        planner = progress.planner
+        self.assertGreater(planner.base, 0)
+        planner.plan()
+        blocks = planner.base + len(planner.times)
+        progress.position_report(planner.xs[len(planner.times) - 5],
+                                 planner.ys[len(planner.times) - 5])
+        self.assertLessEqual(progress.time_done, planner.elapsed(blocks))
+        self.assertGreaterEqual(progress.time_done,
+                                planner.elapsed(blocks - BLOCK_BUFFER_SIZE))
+
+    def test_resume(self):
+        job = list(modal_job(3000))
+        for stop in (1000, 2345, 3000):
+            progress = self.run_job(JobProgress(resumable=True), job, stop)
+            checkpoint = progress.checkpoint()
+            line = checkpoint['line']
+            self.assertLessEqual(line, stop)
+            # the planner holds back the blocks it may still slow down
+            self.assertGreater(line, stop - 3*PLAN_INTERVAL)
+            original, moves = replay(job)
+            done, _ = replay(job[:line])
+            self.assertEqual(checkpoint['state'], done.to_dict())
+
+            # the prefix restores the modal state, then the moves are those
+            # of the rest of the job
+            prefix = GcodeState.from_dict(checkpoint['state']).prefix()
+            resumed, _ = replay(prefix)
+            self.assertEqual(resumed.to_dict(), done.to_dict())
+            resumed, resumed_moves = replay(job[line:], resumed)
+            self.assertEqual(resumed_moves, moves[line:])
+            self.assertEqual(resumed.to_dict(), original.to_dict())
+
+            # a checkpoint of the resumed job counts the lines of the job
+            progress = self.run_job(
+                JobProgress(first_line=line - len(prefix),
+                            prefix_lines=len(prefix), resumable=True),
+                prefix + job[line:], 1000)
+            checkpoint = progress.checkpoint()
+            done, _ = replay(job[:checkpoint['line']])
+            self.assertGreater(checkpoint['line'], line)
+            self.assertEqual(checkpoint['state'], done.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- SVG reader tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import unittest
+
+from ..filereaders import read_svg
+from ..filereaders.svg_attribute_reader import SVGAttributeReader
+
+TOLERANCE = 0.08
+
+
+def svg(body):
+    return ('<svg xmlns="http://www.w3.org/2000/svg" '
+            'xmlns:xlink="http://www.w3.org/1999/xlink" '
+            'width="100mm" height="100mm" viewBox="0 0 100 100">'
+            '<defs><rect id="r" x="0" y="0" width="10" height="10" '
+            'stroke="#0000ff" fill="none"/></defs>%s</svg>' % body)
+
+
+class TestHref(unittest.TestCase):
+
+    def test_use(self):
+        boundarys = read_svg(svg('<use xlink:href="#r" x="50" y="50"/>'),
+                             [1220, 610], TOLERANCE)['boundarys']
+        self.assertEqual(list(boundarys), ['#0000ff'])
+        xs = [x for path in boundarys['#0000ff'] for x, y in path]
+        self.assertAlmostEqual(min(xs), 50, places=3)
+
+    def test_empty(self):
+        for href in ('', '   '):
+            body = ('<use href="%s"/><use xlink:href="%s"/>'
+                    '<use href="#r"/>' % (href, href))
+            boundarys = read_svg(svg(body), [1220, 610],
+                                 TOLERANCE)['boundarys']
+            self.assertEqual(len(boundarys['#0000ff']), 1)
+
+    def test_href_attrib(self):
+        reader = SVGAttributeReader(None)
+        for href in ('', '   '):
+            node = {}
+            reader.hrefAttrib(node, 'href', href)
+            self.assertEqual(node, {})
+        node = {}
+        reader.hrefAttrib(node, 'href', ' #r ')
+        self.assertEqual(node, {'href': 'r'})
+
+
+if __name__ == '__main__':
+    unittest.main()
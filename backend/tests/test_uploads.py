@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- streaming upload tests
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+import io
+import random
+import unittest
+from unittest import mock
+
+from .. import uploads
+from ..uploads import MultipartReader, UploadError, read_upload, text_lines
+
+BOUNDARY = 'AaB03x'
+
+
+class ShortReads(io.RawIOBase):
+    """A stream returning at most size bytes at once, fewer at random."""
+
+    def __init__(self, data, size, seed=1):
+        io.RawIOBase.__init__(self)
+        self.data = io.BytesIO(data)
+        self.size = size
+        self.random = random.Random(seed)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.data.read(self.random.randint(1, min(len(buffer),
+                                                         self.size)))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def multipart(parts, boundary=BOUNDARY, preamble=b'', close=True):
+    """Encode parts, a list of (name, filename, content)."""
+    body = preamble
+    for name, filename, content in parts:
+        disposition = 'form-data; name="%s"' % name
+        if filename:
+            disposition += '; filename="%s"' % filename
+        body += (b'--' + boundary.encode() + b'\r\n' +
+                 b'Content-Disposition: ' + disposition.encode() +
+                 b'\r\n\r\n' + content + b'\r\n')
+    if close:
+        body += b'--' + boundary.encode() + b'--\r\n'
+    return body
+
+
+def environ(body, content_type='multipart/form-data; boundary=' + BOUNDARY,
+            length=None):
+    return {'wsgi.input': io.BytesIO(body),
+            'CONTENT_LENGTH': str(len(body) if length is None else length),
+            'CONTENT_TYPE': content_type}
+
+
+class TestMultipartReader(unittest.TestCase):
+
+    def read_parts(self, body, chunk_size=uploads.CHUNK_SIZE, read_size=7):
+        with mock.patch.object(uploads, 'CHUNK_SIZE', chunk_size):
+            reader = MultipartReader(
+                io.BufferedReader(ShortReads(body, chunk_size), chunk_size),
+                BOUNDARY)
+            parts = []
+            for part in reader:
+                content = b''
+                while True:
+                    data = part.file.read(read_size)
+                    if not data:
+                        break
+                    content += data
+                parts.append((part.name, part.filename, content))
+        return parts
+
+    def test_several_fields(self):
+        parts = [('a', None, b'1'), ('b', None, b''),
+                 ('file', 'x.svg', b'<svg/>'), ('c', None, b'3')]
+        self.assertEqual(self.read_parts(multipart(parts)), parts)
+
+    def test_split_boundaries(self):
+        # content with line breaks and pieces of the delimiter, read in
+        # chunks splitting the delimiter anywhere
+        content = (b'\r\n--' + BOUNDARY[:-1].encode() + b'\r\n\r\n--\r' +
+                   bytes(range(256))*20 + b'\r\n-')
+        parts = [('a', None, b'\r\n'), ('file', 'x.bin', content)]
+        body = multipart(parts, preamble=b'preamble\r\n')
+        for chunk_size in (1, 2, 3, 5, len(BOUNDARY) + 3, 64, 4096):
+            self.assertEqual(self.read_parts(body, chunk_size), parts)
+
+    def test_crlf(self):
+        parts = [('file', 'x.dxf', b'0\r\nSECTION\r\n2\r\nENTITIES\r\n')]
+        self.assertEqual(self.read_parts(multipart(parts)), parts)
+        # a lone line feed is content, not a line break of the delimiter
+        body = multipart([('file', 'x', b'a\n--' + BOUNDARY.encode())])
+        self.assertEqual(self.read_parts(body)[0][2],
+                         b'a\n--' + BOUNDARY.encode())
+
+    def test_unread_parts_skipped(self):
+        body = multipart([('a', None, b'x'*100000), ('b', None, b'y')])
+        with mock.patch.object(uploads, 'CHUNK_SIZE', 1000):
+            names = [part.name for part in
+                     MultipartReader(io.BytesIO(body), BOUNDARY)]
+        self.assertEqual(names, ['a', 'b'])
+
+    def test_missing_closing_boundary(self):
+        body = multipart([('file', 'x', b'data')], close=False)
+        with self.assertRaises(UploadError):
+            self.read_parts(body)
+        with self.assertRaises(UploadError):
+            self.read_parts(body[:-10])
+
+    def test_missing_boundary(self):
+        self.assertRaises(UploadError, MultipartReader, io.BytesIO(b''), None)
+
+    def test_headers_too_large(self):
+        body = (b'--' + BOUNDARY.encode() + b'\r\nX-Long: ' +
+                b'x'*(uploads.MAX_HEADER_SIZE + 1))
+        with self.assertRaises(UploadError):
+            self.read_parts(body + b'\r\n\r\n\r\n--' + BOUNDARY.encode() +
+                            b'--\r\n')
+
+
+class TestReadUpload(unittest.TestCase):
+
+    def test_fields_before_file(self):
+        body = multipart([('name', None, 'é'.encode('utf-8')),
+                          ('filedata', 'a.ngc', b'G0X1\r\nG1Y2\r\n'),
+                          ('after', None, b'x')])
+        fields, stream = read_upload(environ(body), 'filedata', 1000)
+        self.assertEqual(fields, {'name': 'é'})
+        self.assertEqual(list(text_lines(stream)), ['G0X1\n', 'G1Y2\n'])
+
+    def test_no_file(self):
+        body = multipart([('name', None, b'x')])
+        self.assertEqual(read_upload(environ(body), 'filedata', 1000),
+                         ({'name': 'x'}, None))
+
+    def test_raw_body(self):
+        fields, stream = read_upload(environ(b'<svg/>', 'image/svg+xml'),
+                                     'filedata', 1000)
+        self.assertEqual(fields, {})
+        self.assertEqual(stream.read(), b'<svg/>')
+
+    def test_oversize(self):
+        body = multipart([('filedata', 'x', b'x'*1000)])
+        with self.assertRaises(UploadError) as context:
+            read_upload(environ(body), 'filedata', 1000)
+        self.assertEqual(context.exception.status, 413)
+        with self.assertRaises(UploadError) as context:
+            read_upload(environ(b'', length=1001), 'filedata', 1000)
+        self.assertEqual(context.exception.status, 413)
+
+    def test_long_field(self):
+        value = b'x'*(3*uploads.CHUNK_SIZE)
+        body = multipart([('name', None, value), ('filedata', 'x', b'')])
+        fields, stream = read_upload(environ(body), 'filedata',
+                                     uploads.MAX_FIELD_SIZE)
+        self.assertEqual(fields, {'name': value.decode()})
+
+    def test_field_too_large(self):
+        body = multipart([('name', None, b'x'*(uploads.MAX_FIELD_SIZE + 1)),
+                          ('filedata', 'x', b'')])
+        with self.assertRaises(UploadError) as context:
+            read_upload(environ(body), 'filedata', 10*uploads.MAX_FIELD_SIZE)
+        self.assertEqual(context.exception.status, 413)
+
+    def test_premature_end(self):
+        body = multipart([('filedata', 'x', b'x'*1000)])
+        fields, stream = read_upload(environ(body[:-100], length=len(body)),
+                                     'filedata', 10000)
+        self.assertRaises(UploadError, stream.read)
+
+    def test_invalid_length(self):
+        with self.assertRaises(UploadError) as context:
+            read_upload(environ(b'', length='x'), 'filedata', 1000)
+        self.assertEqual(context.exception.status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
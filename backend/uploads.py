@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# :Project:   LasaurApp -- streaming uploads
+# :License:   GNU General Public License version 3 or later
+# :Copyright: © 2012-2016 Stefan Hechenberger <stefan@nortd.com> and others,
+#             see AUTHORS.txt
+#
+
+"""
+Streaming Uploads
+-----------------
+
+Uploaded files are read from the request as they arrive, instead of
+having bottle buffer and decode the whole form first. A file is either the
+raw request body, with its parameters in the query string, or a part of a
+``multipart/form-data`` body, in which case the form fields sent before it
+are available.
+
+The size is checked against the limit from the ``Content-Length`` header,
+before anything is read.
+"""
+
+import email.message
+import io
+import logging
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+"""Bytes read from the client at once."""
+MAX_FIELD_SIZE = 1048576
+"""Largest form field other than the file, in bytes."""
+MAX_HEADER_SIZE = 16384
+"""Largest header block of a multipart part, in bytes."""
+
+
+class UploadError(ValueError):
+    """An upload that can't be accepted, status is the HTTP status to
+    answer with."""
+
+    def __init__(self, message, status=400):
+        ValueError.__init__(self, message)
+        self.status = status
+
+
+class BodyReader(io.RawIOBase):
+    """The body of the request of environ as a raw binary stream.
+
+    Raises `UploadError` if the body is longer than limit.
+    """
+
+    def __init__(self, environ, limit):
+        io.RawIOBase.__init__(self)
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise UploadError("Invalid Content-Length.")
+        if length > limit:
+            raise UploadError("Upload larger than %d bytes." % limit, 413)
+        self.input = environ['wsgi.input']
+        self.remaining = length
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.input.read(size)
+        if not data:
+            raise UploadError("Upload ended prematurely.")
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+class PartReader(io.RawIOBase):
+    """The content of the current part of a `MultipartReader`."""
+
+    def __init__(self, multipart):
+        io.RawIOBase.__init__(self)
+        self.multipart = multipart
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        data = self.multipart.read_part(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class Part:
+    """A part of a multipart body, file is a binary stream of its
+    content."""
+
+    def __init__(self, headers, file):
+        self.headers = headers
+        disposition = email.message.Message()
+        disposition['content-disposition'] = headers.get(
+            'content-disposition', '')
+        self.name = disposition.get_param('name',
+                                          header='content-disposition')
+        self.filename = disposition.get_param('filename',
+                                              header='content-disposition')
+        self.file = file
+
+
+class MultipartReader:
+    """Generates the `Part` objects of a ``multipart/form-data`` body read
+    from stream, one after the other, without keeping them in memory.
+
+    The content of a part has to be read before going on to the next
+    one, what is left of it is skipped.
+    """
+
+    def __init__(self, stream, boundary):
+        if not boundary:
+            raise UploadError("Multipart boundary missing.")
+        self.stream = stream
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # the delimiter starts with a line break, the first one has none
+        self.buffer = bytearray(b'\r\n')
+        self.in_part = True
+
+
+    def _fill(self):
+        data = self.stream.read(CHUNK_SIZE)
+        if not data:
+            raise UploadError("Multipart body ended prematurely.")
+        self.buffer += data
+
+
+    def read_part(self, size):
+        """Returns up to size bytes of the current part, b'' at its end."""
+        if not self.in_part:
+            return b''
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index == 0:
+                del self.buffer[:len(self.delimiter)]
+                self.in_part = False
+                return b''
+            elif index > 0:
+                available = index
+            else:
+                # the end might hold the start of the delimiter
+                available = len(self.buffer) - len(self.delimiter) + 1
+            if available > 0:
+                break
+            self._fill()
+        data = bytes(self.buffer[:min(size, available)])
+        del self.buffer[:len(data)]
+        return data
+
+
+    def _read_headers(self):
+        while True:
+            if self.buffer.startswith(b'--'):
+                return None  # the closing delimiter
+            index = self.buffer.find(b'\r\n\r\n', 0, MAX_HEADER_SIZE + 4)
+            if index >= 0:
+                break
+            if len(self.buffer) > MAX_HEADER_SIZE:
+                raise UploadError("Multipart headers too large.")
+            self._fill()
+        block = bytes(self.buffer[:index]).decode('utf-8', 'replace')
+        del self.buffer[:index + 4]
+        headers = {}
+        for line in block.split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+
+    def __iter__(self):
+        while self.read_part(CHUNK_SIZE):
+            pass  # the preamble or the rest of the last part
+        while True:
+            headers = self._read_headers()
+            if headers is None:
+                return
+            self.in_part = True
+            yield Part(headers, PartReader(self))
+            while self.read_part(CHUNK_SIZE):
+                pass
+
+
+def read_upload(environ, field, limit):
+    """Returns the form fields and a binary stream of the file uploaded in
+    the request of environ.
+
+    For a ``multipart/form-data`` request the file is the part named field
+    and the fields are those sent before it, the stream is None if there is
+    no such part. Otherwise the file is the whole body and the fields are
+    empty. Raises `UploadError` if the body is larger than limit bytes.
+    """
+    body = BodyReader(environ, limit)
+    content_type = email.message.Message()
+    content_type['content-type'] = environ.get('CONTENT_TYPE', '')
+    if content_type.get_content_type() != 'multipart/form-data':
+        return {}, io.BufferedReader(body, CHUNK_SIZE)
+    fields = {}
+    for part in MultipartReader(body, content_type.get_param('boundary')):
+        if part.name == field:
+            return fields, io.BufferedReader(part.file, CHUNK_SIZE)
+        # a raw read returns what is buffered, whatever the size
+        value = io.BufferedReader(part.file).read(MAX_FIELD_SIZE + 1)
+        if len(value) > MAX_FIELD_SIZE:
+            raise UploadError("Form field %s too large." % part.name, 413)
+        fields[part.name] = value.decode('utf-8', 'replace')
+    return fields, None
+
+
+def text_lines(stream):
+    """The lines of a binary stream of UTF-8 text, decoded as they are
+    read."""
+    return io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
@@ -1,7 +1,10 @@
 var hardware_ready_state = false;
 var firmware_version_reported = false;
 var lasaurapp_version_reported = false;
+var job_error_reported = null;
 var progress_not_yet_done_flag = false;
+// machine routes are namespaced when the app is opened as /machine/<name>/
+var machine_url = (window.location.pathname.match(/^\/machine\/[^\/]+/) || [''])[0];
 
 
 (function($){
@@ -57,20 +60,14 @@ function send_gcode(gcode, success_msg, progress) {
       // $().uxmessage('notice', gcode, Infinity);
       $.ajax({
         type: "POST",
-        url: "/gcode",
+        url: machine_url + "/gcode",
         data: {'job_data':gcode},
         // dataType: "json",
         success: function (data) {
           if (data == "__ok__") {
             $().uxmessage('success', success_msg);
             if (progress = true) {
-              // show progress bar, register live updates
-              if ($("#progressbar").children().first().width() == 0) {
-                $("#progressbar").children().first().width('5%');
-                $("#progressbar").show();
-                progress_not_yet_done_flag = true;
-                setTimeout(update_progress, 2000);
-              }
+              show_progress();
             }
           } else {
             $().uxmessage('error', "Backend error: " + data);
@@ -92,11 +89,80 @@ function send_gcode(gcode, success_msg, progress) {
 }
 
 
+function send_job(name, etag, passes, success_msg) {
+  // run a stored job by reference, the backend generates the gcode
+  // etag is that of the job loaded, to tell if the stored one changed
+  // falls back to sending the gcode if the backend cannot find the job,
+  // unless only a preview of the job is loaded, see DataHandler.preview
+  var preview = DataHandler.preview;
+  if (!etag && !preview) {
+    // not stored, or not yet
+    DataHandler.segmentizeLongLines();
+    send_gcode(DataHandler.getGcode(), success_msg, true);
+    return;
+  }
+  var data = {'job_name':name, 'passes':JSON.stringify(passes)};
+  if (etag) {
+    data['job_etag'] = etag;
+  }
+  $.ajax({
+    type: "POST",
+    url: machine_url + "/gcode/job",
+    data: data,
+    success: function (data) {
+      if (data == "__ok__") {
+        $().uxmessage('success', success_msg);
+        show_progress();
+      } else if (data == "serial disconnected" || preview) {
+        $().uxmessage('error', "Backend error: " + data);
+      } else {
+        DataHandler.segmentizeLongLines();
+        send_gcode(DataHandler.getGcode(), success_msg, true);
+      }
+    },
+    error: function (xhr) {
+      if (xhr.status == 400) {
+        $().uxmessage('error', "Backend error: " + xhr.responseText);
+      } else {
+        $().uxmessage('error', "Timeout. LasaurApp server down?");
+      }
+    }
+  });
+}
+
+
+function show_progress() {
+  // show progress bar, register live updates
+  if ($("#progressbar").children().first().width() == 0) {
+    $("#progressbar").children().first().width('5%');
+    $("#progressbar").show();
+    progress_not_yet_done_flag = true;
+    setTimeout(update_progress, 2000);
+  }
+}
+
+
+function format_duration(seconds) {
+  var minutes = Math.floor(seconds/60);
+  var hours = Math.floor(minutes/60);
+  seconds = Math.floor(seconds % 60);
+  if (hours > 0) {
+    minutes = minutes % 60;
+    return hours + ':' + (minutes < 10 ? '0' : '') + minutes + ':' +
+           (seconds < 10 ? '0' : '') + seconds;
+  }
+  return minutes + ':' + (seconds < 10 ? '0' : '') + seconds;
+}
+
+
 function update_progress() {
-  $.get('/queue_pct_done', function(data) {
-    if (data.length > 0) {
-      var pct = parseInt(data);
+  $.getJSON(machine_url + '/queue/progress', function(data) {
+    if (data && data.active) {
+      var pct = Math.min(100, Math.round(data.percentage));
       $("#progressbar").children().first().width(pct+'%');
+      $("#progressbar").attr('title', format_duration(data.time_remaining) +
+                             ' remaining, line ' + data.lines_acked +
+                             ' of ' + data.lines_queued);
       setTimeout(update_progress, 2000);
     } else {
       if (progress_not_yet_done_flag) {
@@ -215,7 +281,7 @@ $(document).ready(function(){
 
   // get hardware status
   function poll_hardware_status() {
-    $.getJSON('/status', function(data) {
+    $.getJSON(machine_url + '/status', function(data) {
       // pause status
       if (data.paused) {
         pause_btn_state = true;
@@ -227,11 +293,22 @@ $(document).ready(function(){
         $("#pause_btn").removeClass("btn-primary");
         $("#pause_btn").html('<i class="icon-pause"></i>');
       }
+      // stopped job that can be resumed
+      if (data.resume_line !== null && data.resume_line !== undefined) {
+        $("#resume_btn").attr('title', 'resume the stopped job from line ' +
+                              data.resume_line);
+        $("#resume_btn").show();
+      } else {
+        $("#resume_btn").hide();
+      }
       // serial connected
       if (data.serial_connected) {
         connect_btn_set_state(true);
       } else {
         connect_btn_set_state(false);
+        if (data.reconnecting) {
+          $("#connect_btn").html("Reconnecting");
+        }
       }
 
       // ready state
@@ -279,6 +356,10 @@ $(document).ready(function(){
           $().uxmessage('error', "Transmission Error!");
           $().uxmessage('notice', "If this happens a lot tell the author of this software.");
         }
+        if (data.job_error && data.job_error != job_error_reported) {
+          $().uxmessage('error', "Job stopped: " + data.job_error);
+        }
+        job_error_reported = data.job_error;
         if (data.x && data.y) {
           // only update if not manually entering at the same time
           if (!$('#x_location_field').is(":focus") &&
@@ -333,7 +414,7 @@ $(document).ready(function(){
   $("#connect_btn").width(connect_btn_width);
   $("#connect_btn").click(function(e){
     if (connect_btn_state == true) {
-      $.get('/serial/0', function(data) {
+      $.get(machine_url + '/serial/0', function(data) {
         if (data != "") {
           connect_btn_set_state(false);
         } else {
@@ -344,7 +425,7 @@ $(document).ready(function(){
       });
     } else {
       $("#connect_btn").html('Connecting...');
-      $.get('/serial/1', function(data) {
+      $.get(machine_url + '/serial/1', function(data) {
         if (data != "") {
           connect_btn_set_state(true);
           $("#connect_btn").html("Connected");
@@ -382,7 +463,7 @@ $(document).ready(function(){
   $("#pause_btn").tooltip({placement:'bottom', delay: {show:500, hide:100}});
   $("#pause_btn").click(function(e){
     if (pause_btn_state == true) {  // unpause
-      $.get('/pause/0', function(data) {
+      $.get(machine_url + '/pause/0', function(data) {
         if (data == '0') {
           pause_btn_state = false;
           $("#pause_btn").removeClass('btn-primary');
@@ -393,7 +474,7 @@ $(document).ready(function(){
       });
     } else {  // pause
       $("#pause_btn").addClass('btn-warning');
-      $.get('/pause/1', function(data) {
+      $.get(machine_url + '/pause/1', function(data) {
         if (data == "1") {
           pause_btn_state = true;
           $("#pause_btn").removeClass("btn-warning");
@@ -425,6 +506,19 @@ $(document).ready(function(){
     e.preventDefault();
   });
 
+  $("#resume_btn").tooltip({placement:'bottom', delay: {show:500, hide:100}});
+  $("#resume_btn").click(function(e){
+    $.post(machine_url + '/gcode/resume', function(data) {
+      if (data == "__ok__") {
+        $().uxmessage('success', "Resuming job ...");
+        show_progress();
+      } else {
+        $().uxmessage('error', "Cannot resume: " + data);
+      }
+    });
+    e.preventDefault();
+  });
+
   $("#homing_cycle").tooltip({placement:'bottom', delay: {show:500, hide:100}});
   $("#homing_cycle").click(function(e){
     var gcode = '!\n'  // ! is enter stop state char
@@ -7,15 +7,23 @@
 
 DataHandler = {
 
+  // paths packed by color like the decoded binary jobs, see JobFile.decode
+  // {'#000000':{'starts':[0, 2, ..], 'coords':[x, y, x, y, ..]}, ..}
+  // the vertices of path i are coords[2*starts[i]] up to coords[2*starts[i+1]]
   paths_by_color : {},
   passes : [],
   stats_by_color : {},
+  // simplified paths of a huge import, with the full resolution kept
+  // by the backend, see backend/app.py binary_reader_result
+  // {'token':'..', 'tolerances':[0.08, ..], 'level':n}
+  preview : null,
 
 
   clear : function() {
     this.paths_by_color = {};
     this.passes = [];
     this.stats_by_color = {};
+    this.preview = null;
   },
 
   isEmpty : function() {
@@ -32,22 +40,29 @@ DataHandler = {
     // {'#000000':[[[x,y],[x,y], ..],[], ..], '#ffffff':[..]}
     this.clear();
     for (var color in paths_by_color) {
-      var paths_src = paths_by_color[color];
-      this.paths_by_color[color] = [];
-      var paths = this.paths_by_color[color];
-      for (var i=0; i<paths_src.length; i++) {
-        var path = [];
-        paths.push(path);
-        var path_src = paths_src[i];
-        for (var p=0; p<path_src.length; p++) {
-          path.push([path_src[p][0], path_src[p][1]]);
-        }
-      }
+      this.paths_by_color[color] = this.packPaths(paths_by_color[color]);
     }
     // also calculate stats
     this.calculateBasicStats();
   },
 
+  setByJobFile : function(job) {
+    // read a binary job as decoded by JobFile.decode
+    // its typed arrays are used as they are, never modified
+    this.clear();
+    this.passes = (job.meta.passes || []).slice();
+    this.preview = job.meta.preview || null;
+    for (var color in job.colors) {
+      this.paths_by_color[color] = job.colors[color];
+    }
+    // stats computed by the backend, if fetched with the job
+    if (job.stats) {
+      this.setStats(job.stats);
+    } else {
+      this.calculateBasicStats();
+    }
+  },
+
   setByGcode : function(gcode) {
     // Read limited Gcode
     // G0, G00, G1, G01, G4, G04
@@ -66,7 +81,10 @@ DataHandler = {
     this.clear();
     var data = JSON.parse(strdata);
     this.passes = data['passes'];
-    this.paths_by_color = data['paths_by_color'];
+    for (var color in data['paths_by_color']) {
+      this.paths_by_color[color] = this.packPaths(data['paths_by_color'][color]);
+    }
+    this.preview = data['preview'] || null;
     if ('stats_by_color' in data) {
       this.stats_by_color = data['stats_by_color'];
     } else {
@@ -81,20 +99,36 @@ DataHandler = {
   getJson : function(exclude_colors) {
     // write internal format
     // exclude_colors is optional
-    var paths_by_color = this.paths_by_color;
-    if (!(exclude_colors === undefined)) {
-      paths_by_color = {};
-      for (var color in this.paths_by_color) {
-        if (!(color in exclude_colors)) {
-          paths_by_color[color] = this.paths_by_color[color];
-        }
+    var paths_by_color = {};
+    for (var color in this.paths_by_color) {
+      if (exclude_colors === undefined || !(color in exclude_colors)) {
+        paths_by_color[color] = this.unpackPaths(this.paths_by_color[color]);
       }
     }
     var data = {'passes': this.passes,
                 'paths_by_color': paths_by_color}
+    if (this.preview) {
+      data['preview'] = this.preview;
+    }
     return JSON.stringify(data);
   },
 
+  getJobFile : function(exclude_colors) {
+    // write a job like JobFile.decode reads it, sharing the paths
+    // exclude_colors is optional
+    var colors = {};
+    for (var color in this.paths_by_color) {
+      if (exclude_colors === undefined || !(color in exclude_colors)) {
+        colors[color] = this.paths_by_color[color];
+      }
+    }
+    var meta = {'passes': this.passes};
+    if (this.preview) {
+      meta['preview'] = this.preview;
+    }
+    return {'meta':meta, 'colors':colors};
+  },
+
   getGcode : function() {
     // write machinable gcode, organize by passes
     // header
@@ -110,18 +144,18 @@ DataHandler = {
       glist.push("G1F"+feedrate+"\nS"+intensity+"\n");
       for (var c=0; c<colors.length; c++) {
         var color = colors[c];
-        var paths = this.paths_by_color[color];
-        for (var k=0; k<paths.length; k++) {
-          var path = paths[k];
-          if (path.length > 0) {
-            var vertex = 0;
-            var x = path[vertex][0];
-            var y = path[vertex][1];
+        var starts = this.paths_by_color[color].starts;
+        var coords = this.paths_by_color[color].coords;
+        for (var k=0; k<starts.length-1; k++) {
+          if (starts[k+1] > starts[k]) {
+            var vertex = starts[k];
+            var x = coords[2*vertex];
+            var y = coords[2*vertex+1];
             glist.push("G0X"+x.toFixed(app_settings.num_digits)+
                          "Y"+y.toFixed(app_settings.num_digits)+"\n");
-            for (vertex=1; vertex<path.length; vertex++) {
-              var x = path[vertex][0];
-              var y = path[vertex][1];
+            for (vertex++; vertex<starts[k+1]; vertex++) {
+              var x = coords[2*vertex];
+              var y = coords[2*vertex+1];
               glist.push("G1X"+x.toFixed(app_settings.num_digits)+
                            "Y"+y.toFixed(app_settings.num_digits)+"\n");
             }
@@ -166,20 +200,21 @@ DataHandler = {
     var y_prev = 0;
     for (var color in this.paths_by_color) {
       if (exclude_colors === undefined || !(color in exclude_colors)) {
-        var paths = this.paths_by_color[color];
-        for (var k=0; k<paths.length; k++) {
-          var path = paths[k];
-          if (path.length > 0) {
-            var x = path[0][0]*scale;
-            var y = path[0][1]*scale;
+        var starts = this.paths_by_color[color].starts;
+        var coords = this.paths_by_color[color].coords;
+        for (var k=0; k<starts.length-1; k++) {
+          if (starts[k+1] > starts[k]) {
+            var vertex = starts[k];
+            var x = coords[2*vertex]*scale;
+            var y = coords[2*vertex+1]*scale;
             canvas.stroke('#aaaaaa');
             canvas.line(x_prev, y_prev, x, y);
             x_prev = x;
             y_prev = y;
             canvas.stroke(color);
-            for (vertex=1; vertex<path.length; vertex++) {
-              var x = path[vertex][0]*scale;
-              var y = path[vertex][1]*scale;
+            for (vertex++; vertex<starts[k+1]; vertex++) {
+              var x = coords[2*vertex]*scale;
+              var y = coords[2*vertex+1]*scale;
               canvas.line(x_prev, y_prev, x, y);
               x_prev = x;
               y_prev = y;
@@ -342,18 +377,19 @@ DataHandler = {
     for (var color in this.paths_by_color) {
       var path_lenths_color = 0;
       var bbox_color = [Infinity, Infinity, 0, 0];
-      var paths = this.paths_by_color[color];
-      for (var k=0; k<paths.length; k++) {
-        var path = paths[k];
-        if (path.length > 1) {
-          var x = path[0][0];
-          var y = path[0][1];
+      var starts = this.paths_by_color[color].starts;
+      var coords = this.paths_by_color[color].coords;
+      for (var k=0; k<starts.length-1; k++) {
+        if (starts[k+1] - starts[k] > 1) {
+          var vertex = starts[k];
+          var x = coords[2*vertex];
+          var y = coords[2*vertex+1];
           this.bboxExpand(bbox_color, x, y);
           x_prev = x;
           y_prev = y;
-          for (vertex=1; vertex<path.length; vertex++) {
-            var x = path[vertex][0];
-            var y = path[vertex][1];
+          for (vertex++; vertex<starts[k+1]; vertex++) {
+            var x = coords[2*vertex];
+            var y = coords[2*vertex+1];
             path_lenths_color += 
               Math.sqrt((x-x_prev)*(x-x_prev)+(y-y_prev)*(y-y_prev));
             this.bboxExpand(bbox_color, x, y);
@@ -379,6 +415,25 @@ DataHandler = {
   },
 
 
+  setStats : function(stats) {
+    // read the stats of backend/jobstats.py compute_stats
+    // into this.stats_by_color, see calculateBasicStats
+    var stats_by_color = {};
+    for (var color in this.paths_by_color) {
+      var stat = stats['colors'][color] || {'bbox':null, 'cut_length':0};
+      stats_by_color[color] = {
+        'bbox':stat['bbox'] || [Infinity, Infinity, 0, 0],
+        'length':stat['cut_length']
+      }
+    }
+    stats_by_color['_all_'] = {
+      'bbox':stats['bbox'] || [Infinity, Infinity, 0, 0],
+      'length':stats['cut_length']
+    }
+    this.stats_by_color = stats_by_color;
+  },
+
+
   bboxExpand : function(bbox, x, y) {
     if (x < bbox[0]) {bbox[0] = x;}
     else if (x > bbox[2]) {bbox[2] = x;}
@@ -409,59 +464,77 @@ DataHandler = {
   // path optimizations /////////////////////////
 
   segmentizeLongLines : function() {
+    // splits feed lines into new packed paths, the arrays
+    // of a job set by setByJobFile are left alone
     var x_prev = 0;
     var y_prev = 0;
     var d2 = 0;
     var length_limit = app_settings.max_segment_length;
     var length_limit2 = length_limit*length_limit;
 
-    var lerp = function(x0, y0, x1, y1, t) {
-      return [x0*(1-t)+x1*t, y0*(1-t)+y1*t];
-    }
-
     for (var color in this.paths_by_color) {
-      var paths = this.paths_by_color[color];
-      for (var k=0; k<paths.length; k++) {
-        var path = paths[k];
-        if (path.length > 1) {
-          var new_path = [];
-          var copy_from = 0;
-          var x = path[0][0];
-          var y = path[0][1];
+      var starts = this.paths_by_color[color].starts;
+      var coords = this.paths_by_color[color].coords;
+      var new_starts = [0];
+      var new_coords = [];
+      var split = false;
+      for (var k=0; k<starts.length-1; k++) {
+        for (var vertex=starts[k]; vertex<starts[k+1]; vertex++) {
+          var x = coords[2*vertex];
+          var y = coords[2*vertex+1];
           // ignore seek lines for now
-          x_prev = x;
-          y_prev = y;
-          for (vertex=1; vertex<path.length; vertex++) {
-            var x = path[vertex][0];
-            var y = path[vertex][1];
+          if (vertex > starts[k]) {
             d2 = (x-x_prev)*(x-x_prev) + (y-y_prev)*(y-y_prev);
             // check length for each feed line
             if (d2 > length_limit2) {
-              // copy previous verts
-              for (var n=copy_from; n<vertex; n++) {
-                new_path.push(path[n]);
-              }
               // add lerp verts
               var t_step = 1/(Math.sqrt(d2)/length_limit);
               for(var t=t_step; t<0.99; t+=t_step) {
-                new_path.push(lerp(x_prev, y_prev, x, y, t));
+                new_coords.push(x_prev*(1-t)+x*t, y_prev*(1-t)+y*t);
               }
-              copy_from = vertex;
+              split = true;
             }
-            x_prev = x;
-            y_prev = y;
-          }
-          if (new_path.length > 0) {
-            // add any rest verts from path
-            for (var p=copy_from; p<path.length; p++) {
-              new_path.push(path[p]);
-            }
-            copy_from = 0;
-            paths[k] = new_path;
           }
+          new_coords.push(x, y);
+          x_prev = x;
+          y_prev = y;
         }
+        new_starts.push(new_coords.length/2);
+      }
+      if (split) {
+        this.paths_by_color[color] = {'starts':new_starts, 'coords':new_coords};
+      }
+    }
+  },
+
+
+  packPaths : function(paths) {
+    // [[[x,y],[x,y], ..],[], ..] -> {'starts':[..], 'coords':[..]}
+    var starts = [0];
+    var coords = [];
+    for (var k=0; k<paths.length; k++) {
+      var path = paths[k];
+      for (var p=0; p<path.length; p++) {
+        coords.push(path[p][0], path[p][1]);
+      }
+      starts.push(coords.length/2);
+    }
+    return {'starts':starts, 'coords':coords};
+  },
+
+  unpackPaths : function(packed) {
+    // {'starts':[..], 'coords':[..]} -> [[[x,y],[x,y], ..],[], ..]
+    var starts = packed.starts;
+    var coords = packed.coords;
+    var paths = [];
+    for (var k=0; k<starts.length-1; k++) {
+      var path = [];
+      for (var v=starts[k]; v<starts[k+1]; v++) {
+        path.push([coords[2*v], coords[2*v+1]]);
       }
+      paths.push(path);
     }
+    return paths;
   },
 
 
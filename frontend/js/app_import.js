@@ -16,7 +16,9 @@ $(document).ready(function(){
   var h = app_settings.canvas_dimensions[1];
   $('#import_canvas_container').html('<canvas id="import_canvas" width="'+w+'px" height="'+h+'px" style="border:1px dashed #aaaaaa;"></canvas>');
   $('#import_canvas').click(function(e){
-    open_bigcanvas(4, getDeselectedColors());
+    withPreviewLevel(4*app_settings.to_canvas_scale, function () {
+      open_bigcanvas(4, getDeselectedColors());
+    });
     return false;
   });
   $("#import_canvas").hover(
@@ -57,11 +59,11 @@ $(document).ready(function(){
       $().uxmessage('notice', "This browser does not support the files property.");
     }
 
+    // the file is posted as it is, the backend parses it while it arrives
+    var file = undefined;
     if (browser_supports_file_api) {
       if (input.files[0]) {
-        var fr = new FileReader()
-        fr.onload = sendToBackend
-        fr.readAsText(input.files[0])
+        file = input.files[0];
       } else {
         $().uxmessage('error', "No file was selected.");
       }
@@ -73,36 +75,52 @@ $(document).ready(function(){
     // same file is chosen again (but with different dpi)
     $('#import_name').val($('#svg_upload_file').val().split('\\').pop().split('/').pop());
     $('#svg_upload_file').val('');
+    if (file) {
+      sendToBackend(file);
+    }
 
     e.preventDefault();
   });
 
 
-  function sendToBackend(e) {
-    var filedata = e.target.result;
+  function sendToBackend(file) {
     var filename = $('#import_name').val()
     var ext = filename.slice(-4);
     if (ext == '.svg' || ext == '.SVG') {
       $().uxmessage('notice', "parsing SVG ...");
     } else if (ext == '.dxf' || ext == '.DXF') {
       $().uxmessage('notice', "parsing DXF ...");
-      $().uxmessage('warning', "DXF import is limited to R14, lines, arcs, lwpolylines, and mm units");
+      $().uxmessage('warning', "DXF import is limited to lines, arcs, circles, ellipses, polylines, splines, block inserts, and mm units");
     } else if (ext == '.ngc' || ext == '.NGC') {
       $().uxmessage('notice', "parsing G-Code ...");
     }
-    if (filedata.length > 102400) {
+    if (file.size > 102400) {
       $().uxmessage('notice', "Importing large files may take a few minutes.");
     }
-    $.ajax({
-      type: "POST",
-      url: "/file_reader",
-      data: {'filename':filename,
-             'filedata':filedata,
+    // the paths come in the binary job format, see app_jobfile.js,
+    // jQuery can't receive an ArrayBuffer
+    var xhr = new XMLHttpRequest();
+    xhr.open("POST", "/file_reader?" + $.param({
+             'filename':filename,
              'dpi':forceSvgDpiTo,
              'optimize':path_optimize,
-             'dimensions':JSON.stringify(app_settings.work_area_dimensions)},
-      dataType: "json",
-      success: function (data) {
+             'dimensions':JSON.stringify(app_settings.work_area_dimensions),
+             'format':'binary',
+             'preview':1}));
+    xhr.responseType = 'arraybuffer';
+    xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+    xhr.onload = function () {
+      var data = undefined;
+      if (xhr.status == 200) {
+        try {
+          var job = JobFile.decode(xhr.response);
+          data = job.meta;
+          data.job = job;
+        } catch (err) {
+          data = undefined;
+        }
+      }
+      if (data) {
         if (ext == '.svg' || ext == '.SVG') {
           $().uxmessage('success', "SVG parsed.");
           $('#dpi_import_info').html('Using <b>' + data.dpi + '</b> for converting units.');
@@ -114,27 +132,75 @@ $(document).ready(function(){
         } else {
           $().uxmessage('warning', "File extension not supported. Import SVG, DXF, or G-Code files.");
         }
-        // alert(JSON.stringify(data));
         handleParsedGeometry(data);
-      },
-      error: function (data) {
+      } else {
         $().uxmessage('error', "backend error.");
-      },
-      complete: function (data) {
-        $('#file_import_btn').button('reset');
-        forceSvgDpiTo = undefined;  // reset
       }
-    });
+      importComplete();
+    };
+    xhr.onerror = function () {
+      $().uxmessage('error', "backend error.");
+      importComplete();
+    };
+    xhr.send(file);
+  }
+
+  function importComplete() {
+    $('#file_import_btn').button('reset');
+    forceSvgDpiTo = undefined;  // reset
+  }
+
+  function withPreviewLevel(scale, callback) {
+    // with the preview of a huge import loaded, switch to the coarsest
+    // level of detail that still resolves a pixel at scale, then callback
+    var preview = DataHandler.preview;
+    if (!preview) {
+      callback();
+      return;
+    }
+    var level = 0;
+    for (var i=preview.tolerances.length-1; i>0; i--) {
+      if (preview.tolerances[i] <= 1.0/scale) {
+        level = i;
+        break;
+      }
+    }
+    if (preview.level <= level) {  // fine enough
+      callback();
+      return;
+    }
+    var xhr = new XMLHttpRequest();
+    xhr.open("GET", "/file_reader/preview/" + preview.token + "/" + level);
+    xhr.responseType = 'arraybuffer';
+    xhr.onload = function () {
+      if (xhr.status == 200) {
+        var job = JobFile.decode(xhr.response);
+        job.meta.preview = $.extend({}, preview, {'level':level});
+        var passes = DataHandler.passes;
+        DataHandler.setByJobFile(job);
+        DataHandler.passes = passes;
+      } else {
+        $().uxmessage('notice', "Import expired, showing less detail.");
+      }
+      callback();
+    };
+    xhr.onerror = function () {
+      callback();
+    };
+    xhr.send();
   }
 
   function handleParsedGeometry(data) {
     // data is a dict with the following keys [boundarys, dpi, lasertags]
+    // or [job, dpi, lasertags] with job as decoded by JobFile.decode
     var boundarys = data.boundarys;
-    if (boundarys) {
-      DataHandler.setByPaths(boundarys);
-      if (path_optimize) {
-        DataHandler.segmentizeLongLines();
+    if (boundarys || data.job) {
+      if (data.job) {
+        DataHandler.setByJobFile(data.job);
+      } else {
+        DataHandler.setByPaths(boundarys);
       }
+      // long lines are segmentized by the backend when running the job
       // some init
       $('#canvas_properties .colorbtns').html('');  // reset colors
       canvas.background('#ffffff');
@@ -228,9 +294,12 @@ $(document).ready(function(){
   $("#import_to_queue").click(function(e) {
     if (!(DataHandler.isEmpty())) {
       var jobdata = DataHandler.getJson(getDeselectedColors());
+      var job = DataHandler.getJobFile(getDeselectedColors());
       var filename = $('#import_name').val();
-      save_and_add_to_job_queue(filename, jobdata);
-      load_into_job_widget(filename, jobdata);
+      // a preview is stored at full resolution by the backend
+      var preview_token = DataHandler.preview ? DataHandler.preview.token : undefined;
+      save_and_add_to_job_queue(filename, jobdata, preview_token, job);
+      load_into_job_widget(filename, job);
       $('#tab_jobs_button').trigger('click');
 
       // reset tap
@@ -0,0 +1,70 @@
+
+// module to decode the binary job format, see backend/jobfile.py
+// the coordinates are Float32Array views of the response, not copies,
+// typed arrays use the byte order of the platform, little endian in
+// practice as the format
+
+
+
+JobFile = {
+
+  MAGIC : 'LSAB',
+  FLAG_ZLIB : 1,
+  FLAG_QUANTIZED : 2,
+  QUANTIZE_SCALE : 1000.0,
+
+
+  decode : function(buffer) {
+    // read an ArrayBuffer
+    // {'meta':{'passes':[..], 'colors':[..], ..},
+    //  'colors':{'#000000':{'starts':Uint32Array, 'coords':Float32Array}, ..}}
+    // starts has the index of the first vertex of every path plus the total,
+    // coords the x, y pairs of all the vertices
+    var view = new DataView(buffer);
+    var magic = String.fromCharCode(view.getUint8(0), view.getUint8(1),
+                                    view.getUint8(2), view.getUint8(3));
+    if (magic != this.MAGIC) {
+      throw new Error("Not a binary job.");
+    }
+    var flags = view.getUint16(6, true);
+    if (flags & this.FLAG_ZLIB) {
+      throw new Error("Compressed binary jobs are not supported.");
+    }
+    var meta_size = view.getUint32(8, true);
+    var meta = JSON.parse(this.decodeUtf8(new Uint8Array(buffer, 12, meta_size)));
+    var base = 12 + meta_size;
+    var colors = {};
+    for (var i=0; i<meta.colors.length; i++) {
+      var entry = meta.colors[i];
+      var offset = base + entry.offset;
+      var starts = new Uint32Array(buffer, offset, entry.paths + 1);
+      offset += 4*(entry.paths + 1);
+      var coords;
+      if (flags & this.FLAG_QUANTIZED) {
+        var ints = new Int32Array(buffer, offset, 2*entry.vertices);
+        coords = new Float32Array(ints.length);
+        for (var k=0; k<ints.length; k++) {
+          coords[k] = ints[k] / this.QUANTIZE_SCALE;
+        }
+      } else {
+        coords = new Float32Array(buffer, offset, 2*entry.vertices);
+      }
+      colors[entry.color] = {'starts':starts, 'coords':coords};
+    }
+    return {'meta':meta, 'colors':colors};
+  },
+
+
+  decodeUtf8 : function(bytes) {
+    if (typeof TextDecoder !== 'undefined') {
+      return new TextDecoder('utf-8').decode(bytes);
+    }
+    // in pieces, apply() is limited in the number of arguments
+    var chars = '';
+    for (var i=0; i<bytes.length; i+=8192) {
+      chars += String.fromCharCode.apply(null, bytes.subarray(i, i+8192));
+    }
+    return decodeURIComponent(escape(chars));
+  }
+
+};
@@ -4,16 +4,19 @@ var preview_canvas_obj = null;
 
 
 
-function load_into_job_widget(name, jobdata) {
+function load_into_job_widget(name, job, etag) {
+  // job as decoded by JobFile.decode
+  // etag is that of the stored job, if known, see send_job
   // create some empty pass widgets
   $('#passes').html('');
-  DataHandler.setByJson(jobdata);
+  DataHandler.setByJobFile(job);
   addPasses(minNumPassWidgets);
   writePassesWidget();
   $('#passes_info').show();
 
   $('#job_name').val(name);
-  $('#job_data').val(jobdata);
+  $('#job_data').data('job', job);
+  $('#job_data').data('etag', etag || null);
   // make sure preview refreshes
   refresh_preview(false, false);
   // scroll to top
@@ -23,7 +26,7 @@ function load_into_job_widget(name, jobdata) {
 
 function refresh_preview(reload_data, read_passes_widget) {
   if (reload_data === true) {
-    DataHandler.setByJson($('#job_data').val());
+    DataHandler.setByJobFile($('#job_data').data('job'));
   }
   if (read_passes_widget === true) {
     readPassesWidget();
@@ -40,6 +43,67 @@ function refresh_preview(reload_data, read_passes_widget) {
 
 /// QUEUE/LIBRARY ///////////////////////////////
 
+function get_job(kind, name, filename, callback) {
+  // get a 'queue' or 'library' job with the stats the backend cached
+  // filename is that of the stored job, a starred one has a suffix
+  // callback(job, etag) with job as decoded by JobFile.decode plus the
+  // stats, see DataHandler.setByJobFile, undefined on failure
+  var stats = undefined;
+  var stats_request = $.getJSON("/" + kind + "/stats/" + name, function(data) {
+    stats = data;
+  });
+  // jobs are fetched in the binary format, see app_jobfile.js,
+  // jQuery can't receive an ArrayBuffer
+  var xhr = new XMLHttpRequest();
+  xhr.open("GET", "/" + kind + "/get/" + filename + "?format=binary");
+  xhr.responseType = 'arraybuffer';
+  xhr.onload = function () {
+    var job = undefined;
+    if (xhr.status == 200) {
+      try {
+        job = JobFile.decode(xhr.response);
+      } catch (err) {
+        job = undefined;
+      }
+    }
+    var etag = xhr.getResponseHeader('ETag');
+    stats_request.always(function() {
+      if (job) {
+        job.stats = stats;
+      }
+      callback(job, etag);
+    });
+  };
+  xhr.onerror = function () {
+    callback(undefined);
+  };
+  xhr.send();
+}
+
+function add_job_popover(link, kind, name, placement) {
+  // show the thumbnail and the stats of a job on hover, both cached by
+  // the backend, the job itself is only loaded when clicked
+  $(link).one('mouseenter', function() {
+    var hovering = true;
+    $(link).one('mouseleave', function() {
+      hovering = false;
+    });
+    $.getJSON("/" + kind + "/stats/" + name, function(stats) {
+      $(link).popover({
+        'title': name,
+        'content': '<img src="/' + kind + '/thumbnail/' + name + '"><br>' +
+                   'length: ' + (stats.cut_length/1000).toFixed(1) + 'm, ' +
+                   'time: ' + format_duration(stats.time),
+        'placement': placement,
+        'delay': {show: 500, hide: 100}
+      });
+      if (hovering) {
+        $(link).popover('show');
+      }
+    });
+  });
+}
+
 function populate_job_queue() {
   $.getJSON("/queue/list", function(data) {
     $.each(data, function(index, name) {
@@ -56,10 +120,17 @@ function populate_job_library() {
     $.each(data, function(index, name) {
       $('#job_library').prepend('<li><a href="#">'+ name +'</a></li>');
     });
+    $('#job_library li a').each(function() {
+      add_job_popover(this, 'library', $(this).text(), 'right');
+    });
     $('#job_library li a').click(function(){
       var name = $(this).text();
-      $.get("/library/get/" + name, function(jobdata) {
-        load_into_job_widget(name, jobdata);
+      get_job('library', name, name, function(job, etag) {
+        if (job) {
+          load_into_job_widget(name, job, etag);
+        } else {
+          $().uxmessage('error', "File not found: " + name);
+        }
       });
       return true;
     });
@@ -70,21 +141,43 @@ function populate_job_library() {
 }
 
 var queue_num_index = 1;
-function save_and_add_to_job_queue(name, jobdata) {
+function save_and_add_to_job_queue(name, jobdata, preview_token, job) {
+  // preview_token is optional, see DataHandler.preview
+  // job is optional, the job jobdata was written from, see
+  // DataHandler.getJobFile
   if ((typeof(name) == 'undefined') || ($.trim(name) == '')) {
     var date = new Date();
     name = date.toDateString() +' - '+ queue_num_index
   }
   //// store jobdata - on success add to queue
-  $.post("/queue/save", { 'job_name':name, 'job_data':jobdata }, function(data) {
-    if (data == "1") {
-      queue_num_index += 1;
-      add_to_job_queue(name);
-    } else if (data == "file_exists") {
-      // try again with numeral appendix
-      $().uxmessage('notice', "File already exists. Appending numeral.");
-      save_and_add_to_job_queue(name+' - '+ queue_num_index, jobdata);
-    } else {
+  // posted as the raw body, streamed to disk by the backend
+  $.ajax({
+    type: "POST",
+    url: "/queue/save?" + $.param(preview_token ? {'job_name':name, 'preview':preview_token}
+                                                : {'job_name':name}),
+    data: jobdata,
+    processData: false,
+    contentType: 'application/json',
+    success: function(data, status, xhr) {
+      if (data == "1") {
+        queue_num_index += 1;
+        add_to_job_queue(name);
+        if (job && $('#job_data').data('job') === job) {
+          // the job loaded is the one stored, maybe under another name
+          $('#job_name').val(name);
+          $('#job_data').data('etag', xhr.getResponseHeader('ETag'));
+        }
+      } else if (data == "file_exists") {
+        // try again with numeral appendix
+        $().uxmessage('notice', "File already exists. Appending numeral.");
+        save_and_add_to_job_queue(name+' - '+ queue_num_index, jobdata, preview_token, job);
+      } else if (data == "preview_expired") {
+        $().uxmessage('error', "Import expired, please import the file again.");
+      } else {
+        $().uxmessage('error', "Failed to store G-code.");
+      }
+    },
+    error: function (data) {
       $().uxmessage('error', "Failed to store G-code.");
     }
   });
@@ -109,19 +202,20 @@ function add_to_job_queue(name) {
   }
   $('#job_queue').prepend('<li><a href="#"><span>'+ name +'</span><span class="starwidget '+ star_class +' pull-right" title=" star to keep in queue"></span></a></li>')
   $('span.starwidget').tooltip({delay:{ show: 1500, hide: 100}})
+  add_job_popover($('#job_queue li:first a'), 'queue', name, 'left');
   //// action for loading gcode
   $('#job_queue li:first a').click(function(){
     var name = $(this).children('span:first').text();
+    var filename = name;
     if ($(this).find('span.icon-star').length > 0) {
-      name = name + '.starred'
+      filename = name + '.starred'
     }
-    $.get("/queue/get/" + name, function(jobdata) {
-      if (name.slice(-8) == '.starred') {
-        name = name.slice(0,-8);
+    get_job('queue', name, filename, function(job, etag) {
+      if (!job) {
+        $().uxmessage('error', "File not found: " + name);
+        return;
       }
-      load_into_job_widget(name, jobdata);
-    }).error(function() {
-      $().uxmessage('error', "File not found: " + name);
+      load_into_job_widget(name, job, etag);
     });
     return false;
   });
@@ -355,7 +449,7 @@ $(document).ready(function(){
   $("#progressbar").hide();
   $("#job_submit").click(function(e) {
     // send gcode string to server via POST
-    DataHandler.setByJson($('#job_data').val());
+    DataHandler.setByJobFile($('#job_data').data('job'));
     if (readPassesWidget()) {
       var job_bbox = DataHandler.getJobBbox();
       if (job_bbox[0] >= 0 &&
@@ -363,7 +457,8 @@ $(document).ready(function(){
           job_bbox[2] <= app_settings.work_area_dimensions[0] &&
           job_bbox[3] <= app_settings.work_area_dimensions[1])
       {
-        send_gcode(DataHandler.getGcode(), "G-Code sent to backend.", true);
+        send_job($.trim($('#job_name').val()), $('#job_data').data('etag'),
+                 DataHandler.getPasses(), "G-Code sent to backend.");
       } else {
         $().uxmessage('warning', "rejecting, outside work area");
       }
@@ -376,7 +471,7 @@ $(document).ready(function(){
 
   $('#job_bbox_submit').tooltip();
   $("#job_bbox_submit").click(function(e) {
-    DataHandler.setByJson($('#job_data').val());
+    DataHandler.setByJobFile($('#job_data').data('job'));
     if (readPassesWidget()) {
       var job_bbox = DataHandler.getJobBbox();
       if (job_bbox[0] >= 0 &&
@@ -396,9 +491,10 @@ $(document).ready(function(){
 
   $('#job_save_to_queue').tooltip();
   $("#job_save_to_queue").click(function(e) {
-    DataHandler.setByJson($('#job_data').val());
+    DataHandler.setByJobFile($('#job_data').data('job'));
     readPassesWidget();
-    save_and_add_to_job_queue($.trim($('#job_name').val()), DataHandler.getJson());
+    save_and_add_to_job_queue($.trim($('#job_name').val()), DataHandler.getJson(),
+                              undefined, $('#job_data').data('job'));
     return false;
   });
 
@@ -418,7 +514,12 @@ $(document).ready(function(){
 
 
   $("#export_json_btn").click(function(e) {
-    var filedata = $('#job_data').val();
+    DataHandler.setByJobFile($('#job_data').data('job'));
+    if (DataHandler.preview) {
+      $().uxmessage('warning', "Only a preview of this job is loaded, get it from the queue.");
+      return false;
+    }
+    var filedata = DataHandler.getJson();
     var filename = $('#job_name').val();
     if (filename.slice(-4) != '.lsa') {
       filename = filename + '.lsa';
@@ -429,7 +530,11 @@ $(document).ready(function(){
 
 
   $("#export_gcode_btn").click(function(e) {
-    DataHandler.setByJson($('#job_data').val());
+    DataHandler.setByJobFile($('#job_data').data('job'));
+    if (DataHandler.preview) {
+      $().uxmessage('warning', "Only a preview of this job is loaded, run it from the queue.");
+      return false;
+    }
     readPassesWidget();
     var filedata = DataHandler.getGcode()
     var filename = $('#job_name').val();